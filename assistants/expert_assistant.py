@@ -15,10 +15,14 @@ from state.state import State
 from pydantic import BaseModel, Field
 
 from tools.policy_tools import query_policy_tool, query_payment_methods_tool
-from tools.product_tools import search_and_recommend_products_tool, list_categories_tool, check_product_stock_tool
+from tools.product_tools import search_and_recommend_products_tool, list_categories_tool, check_product_stock_tool, \
+    check_products_stock_tool, get_product_facets_tool
 from tools.order_tools import (search_orders_tool, checkout_order_tool, update_delivery_address_tool, cancel_order_tool,
-                               get_recent_orders_tool)
-from tools.cart_tools import add_to_cart_tool, view_cart_tool, remove_from_cart_tool
+                               get_recent_orders_tool, get_order_history_tool, get_order_events_tool,
+                               get_user_order_summary_tool)
+from tools.cart_tools import (add_to_cart_tool, view_cart_tool, remove_from_cart_tool, update_cart_items_tool,
+                              scale_cart_tool, remove_matching_from_cart_tool)
+from tools.sales_tools import get_top_products_tool, get_purchase_history_tool, get_category_sales_tool
 
 from dotenv import load_dotenv
 
@@ -83,6 +87,10 @@ product_assistant_prompt = ChatPromptTemplate.from_messages(
             "If the user does not provide a specific query but asks about product categories, always call `list_categories_tool`."
             " When searching, be persistent. Expand your query bounds if the first search returns no results. "
             "for example if using category could not find product then using name to try find one "
+            "When a request is broad (e.g. 'electronics', 'cheapest in stock'), call `get_product_facets_tool` first and "
+            "narrow with the category, price range and stock counts it returns instead of guessing with repeated searches. "
+            "For best sellers or popular products call `get_top_products_tool`, and `get_category_sales_tool` for "
+            "recent sales per category. "
             "If the product the user wants to buy is not available, we will tell the user that it is not available. "
             "You can modify the stock data when the user places an order, restores the order, or cancels the order."
             "You cannot handle the task of deleting or adding products to the shopping cart. You need to call the cart assistant."
@@ -98,7 +106,9 @@ product_assistant_prompt = ChatPromptTemplate.from_messages(
     ]
 ).partial(time=datetime.now)
 
-product_safe_tools = [search_and_recommend_products_tool, list_categories_tool, check_product_stock_tool]
+product_safe_tools = [search_and_recommend_products_tool, list_categories_tool, check_product_stock_tool,
+                      check_products_stock_tool, get_product_facets_tool, get_top_products_tool,
+                      get_category_sales_tool]
 product_sensitive_tools = []
 product_tools = product_safe_tools + product_sensitive_tools
 product_runnable = product_assistant_prompt | llm.bind_tools(
@@ -115,7 +125,12 @@ cart_assistant_prompt = ChatPromptTemplate.from_messages(
             "Provide clear feedback to the user about the actions you perform. For sensitive actions like adding or "
             "removing items, like which product to add, how many of product to add."
             "If there are no items in the shopping cart to be deleted, politely inform the user"
-            "confirm with the user before proceeding. provide total view info when user view their cart."
+            "confirm with the user before proceeding. provide total view info when user view their cart: "
+            "`view_cart_tool` already returns each line's subtotal, the item count, the grand total and out-of-stock "
+            "flags, so report them as given instead of recalculating."
+            " When a request touches several products (e.g. 'double my cart', 'remove phone-related products', "
+            "'add 2 of A and 1 of B'), use one call to `scale_cart_tool`, `remove_matching_from_cart_tool` or "
+            "`update_cart_items_tool` instead of one add/remove call per product."
             " When searching, be persistent. Expand your query bounds if the first search returns no results. "
             "If you need more information or the customer changes their mind, escalate the task back to the main assistant."
             " Remember that a task isn't completed until after the relevant tool has successfully been used."
@@ -138,6 +153,9 @@ cart_safe_tools = [view_cart_tool]
 cart_sensitive_tools = [
     add_to_cart_tool,
     remove_from_cart_tool,
+    update_cart_items_tool,
+    scale_cart_tool,
+    remove_matching_from_cart_tool,
 ]
 cart_tools = cart_safe_tools + cart_sensitive_tools
 cart_runnable = cart_assistant_prompt | llm.bind_tools(
@@ -154,10 +172,17 @@ order_assistant_prompt = ChatPromptTemplate.from_messages(
             "You are a specialized assistant for managing customer order queries and checkout processes. "
             "Help users by providing detailed information about their orders based on their input. "
             "If the user provides an order ID, retrieve details about that order. "
-            "If no order ID is provided, retrieve all orders for the given user. "
+            "If no order ID is provided, retrieve all orders for the given user with `get_order_history_tool`; "
+            "set include_items=True when the products of several orders are needed instead of calling "
+            "`search_orders_tool` for each order, and pass `next_cursor` to get older orders. "
+            "Use `get_order_events_tool` when the user asks what happened to an order, and "
+            "`get_user_order_summary_tool` for their order count and total spending. "
+            "When the user wants to buy something again, call `get_purchase_history_tool` for the products they bought. "
             "If the user says 'calculate the cost,' 'I want to place an order,' or 'check out,' call the checkout tool."
             "Please check the stock when placing an order"
             "Pay attention to confirm the user’s payment method"
+            " Give every checkout request its own `idempotency_key` and pass the same key again if you retry that "
+            "checkout, so the order is never placed twice. "
             "When the user queries the delivery time, the user's estimated delivery time is given based on the logistics policy and the current time."
             "For sensitive actions like checkout order, cancel order, change order address, "
             "if There is no special description. The default operation is the latest order."
@@ -177,7 +202,8 @@ order_assistant_prompt = ChatPromptTemplate.from_messages(
 
 ).partial(time=datetime.now)
 
-order_safe_tools = [search_orders_tool, get_recent_orders_tool]
+order_safe_tools = [search_orders_tool, get_recent_orders_tool, get_order_history_tool, get_order_events_tool,
+                    get_user_order_summary_tool, get_purchase_history_tool]
 order_sensitive_tools = [checkout_order_tool, update_delivery_address_tool, cancel_order_tool]
 order_tools = order_safe_tools + order_sensitive_tools
 order_runnable = order_assistant_prompt | llm.bind_tools(
@@ -0,0 +1,178 @@
+"""
+@Time ： 2024-11-20
+@Auth ： Adam Lyu
+@Desc ： Index advisor: collects the SQL in tools/*.py, runs EXPLAIN QUERY PLAN and reports full table scans.
+"""
+import ast
+import os
+import re
+import sqlite3
+from typing import Dict, List, Tuple
+
+TOOLS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../tools"))
+
+_STATEMENT = re.compile(
+    r"^\s*(SELECT\b.*\bFROM\b|(INSERT|REPLACE)\s+(OR\s+\w+\s+)?INTO\b|UPDATE\s+\w+\s+SET\b|DELETE\s+FROM\b|WITH\b.*\bSELECT\b)",
+    re.IGNORECASE | re.DOTALL,
+)
+_TABLE_REFERENCE = re.compile(r"\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+_FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+# 明确需要全表扫描的语句（如全量导出）在 SQL 中用此注释标记，并写明原因
+ALLOW_FULL_SCAN = "-- allow-full-scan"
+_SQL_KEYWORDS = {
+    "where", "join", "on", "set", "values", "order", "group", "limit", "left", "inner", "cross",
+    "natural", "using", "select", "union", "having", "default", "as",
+}
+
+
+def is_sql_statement(text: str) -> bool:
+    """
+    Check whether a string literal is a complete DML statement.
+
+    Args:
+        text (str): A string literal from the source.
+
+    Returns:
+        bool: True if the literal looks like a SELECT/INSERT/UPDATE/DELETE statement.
+    """
+    return _STATEMENT.match(text) is not None
+
+
+def collect_tool_sql(tools_dir: str = TOOLS_DIR) -> List[Tuple[str, int, str]]:
+    """
+    Collect every literal SQL statement in the tool modules.
+
+    SQL assembled at runtime (f-strings, concatenation) is not a literal; cover it by
+    tracing the tool functions with `trace_statements` instead.
+
+    Args:
+        tools_dir (str): Directory holding the tool modules.
+
+    Returns:
+        List[Tuple[str, int, str]]: (file name, line number, statement) for each statement.
+    """
+    statements = []
+    for file_name in sorted(os.listdir(tools_dir)):
+        if not file_name.endswith(".py"):
+            continue
+        with open(os.path.join(tools_dir, file_name), encoding="utf-8") as source:
+            tree = ast.parse(source.read(), filename=file_name)
+
+        # 跳过文档字符串和 f-string 的片段
+        skipped = set()
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.Module, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and node.body:
+                first = node.body[0]
+                if isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant):
+                    skipped.add(id(first.value))
+            elif isinstance(node, ast.JoinedStr):
+                skipped.update(id(value) for value in node.values)
+
+        for node in ast.walk(tree):
+            if (isinstance(node, ast.Constant) and isinstance(node.value, str) and id(node) not in skipped
+                    and is_sql_statement(node.value)):
+                statements.append((file_name, node.lineno, node.value))
+    return statements
+
+
+def trace_statements(conn, func, *args, **kwargs) -> List[str]:
+    """
+    Run a function and capture the statements it executes on a connection, with parameters expanded.
+
+    Args:
+        conn: SQLite database connection passed to the function.
+        func: The function to run.
+
+    Returns:
+        List[str]: Executed DML statements.
+    """
+    executed = []
+    conn.set_trace_callback(executed.append)
+    try:
+        func(*args, conn=conn, **kwargs)
+    finally:
+        conn.set_trace_callback(None)
+    return [statement for statement in executed if is_sql_statement(statement)]
+
+
+def explain_query_plan(conn, statement: str) -> List[str]:
+    """
+    Run EXPLAIN QUERY PLAN for a statement, binding NULL to every placeholder.
+
+    Args:
+        conn: SQLite database connection.
+        statement (str): The SQL statement.
+
+    Returns:
+        List[str]: The detail column of each plan row.
+    """
+    params = [None] * statement.count("?")
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {statement}", params)]
+
+
+def find_full_scans(conn, statement: str) -> List[str]:
+    """
+    Find the tables a statement reads with a full table scan.
+
+    Scans of derived tables (subqueries, CTEs), virtual tables, SQLite's internal tables and
+    covering/ordered index scans are not reported; only bare `SCAN <table>` steps on tables of
+    the schema are.
+
+    Args:
+        conn: SQLite database connection.
+        statement (str): The SQL statement.
+
+    Returns:
+        List[str]: Names of fully scanned tables.
+    """
+    tables = {row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+    )}
+    aliases: Dict[str, str] = {}
+    for table, alias in _TABLE_REFERENCE.findall(statement):
+        if table in tables:
+            aliases[table] = table
+            if alias and alias.lower() not in _SQL_KEYWORDS:
+                aliases[alias] = table
+
+    scanned = []
+    for detail in explain_query_plan(conn, statement):
+        match = _FULL_SCAN.match(detail)
+        if match and match.group(1) in aliases:
+            scanned.append(aliases[match.group(1)])
+    return scanned
+
+
+def advise(conn, statements: List[Tuple[str, int, str]]) -> List[Tuple[str, int, str, List[str]]]:
+    """
+    Report every statement that falls back to a full table scan, except those marked with ALLOW_FULL_SCAN.
+
+    Args:
+        conn: SQLite database connection with the full schema.
+        statements (List[Tuple[str, int, str]]): Output of `collect_tool_sql`.
+
+    Returns:
+        List[Tuple[str, int, str, List[str]]]: (file name, line number, statement, scanned tables).
+    """
+    findings = []
+    for file_name, line, statement in statements:
+        if ALLOW_FULL_SCAN in statement:
+            continue
+        scanned = find_full_scans(conn, statement)
+        if scanned:
+            findings.append((file_name, line, statement, scanned))
+    return findings
+
+
+if __name__ == "__main__":
+    import sys
+
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+    from scripts.initialize_db import create_tables
+
+    connection = sqlite3.connect(":memory:")
+    create_tables(connection.cursor())
+    results = advise(connection, collect_tool_sql())
+    for file_name, line, statement, scanned in results:
+        print(f"{file_name}:{line} full scan of {', '.join(scanned)}:\n{statement.strip()}\n")
+    print(f"{len(results)} statements need an index.")
@@ -0,0 +1,108 @@
+"""
+@Time ： 2024-11-23
+@Auth ： Adam Lyu
+@Desc ： Measure the prompt tokens of each tool's output before and after compact encoding.
+
+Runs the tools against a database and counts tokens with tiktoken for:
+- baseline: what the LLM received before (LangChain's `json.dumps` of returned objects, or the
+  `indent=4` JSON the order tools used to build);
+- json: minified JSON;
+- table: the header-once table format.
+
+Usage: python dev_tools/token_usage.py [--db data/ecommerce.db] [--model gpt-4-turbo]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+from typing import Callable, List, Tuple
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils import output_encoder  # noqa: E402
+from utils.output_encoder import encode_output  # noqa: E402
+
+DEFAULT_DB = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/ecommerce.db"))
+
+
+def sample_calls(conn) -> List[Tuple[str, Callable, bool]]:
+    """
+    Tool calls to measure, using IDs that exist in the database.
+
+    Returns:
+        List[Tuple[str, Callable, bool]]: (label, call returning the raw result, whether the
+        result used to be indented JSON).
+    """
+    from tools.cart_tools import view_cart
+    from tools.order_tools import get_recent_orders, search_orders
+    from tools.product_tools import (check_products_stock, get_product_facets, list_category_summaries,
+                                     search_and_recommend_products)
+
+    cursor = conn.cursor()
+    cursor.execute("SELECT user_id FROM cart ORDER BY id LIMIT 1")
+    user = cursor.fetchone()
+    cursor.execute("SELECT id, user_id FROM orders ORDER BY id DESC LIMIT 1")
+    order = cursor.fetchone()
+
+    calls = [
+        ("list_categories", lambda: list_category_summaries(conn=conn), False),
+        ("search_and_recommend_products", lambda: search_and_recommend_products(category="Electronics", conn=conn),
+         False),
+        ("search_and_recommend_products (all fields)",
+         lambda: search_and_recommend_products(category="Electronics", fields=["description", "additional_specs",
+                                                                                 "color", "size"], conn=conn),
+         False),
+        ("get_product_facets", lambda: get_product_facets(conn=conn), False),
+        ("check_products_stock", lambda: check_products_stock(list(range(1, 21)), conn=conn), False),
+    ]
+    if user:
+        calls.append(("view_cart", lambda: view_cart(user[0], conn=conn), False))
+    if order:
+        calls.append(("search_orders", lambda: decoded(search_orders, order[0], conn=conn), True))
+        calls.append(("get_recent_orders", lambda: decoded(get_recent_orders, order[1], 3650, conn=conn), True))
+    return calls
+
+
+def decoded(func, *args, **kwargs):
+    """Call a tool that returns encoded text and decode it back into the object it encoded."""
+    with mock.patch.object(output_encoder, "TOOL_OUTPUT_FORMAT", "json"):
+        return json.loads(func(*args, **kwargs))
+
+
+def measure(calls, count_tokens: Callable[[str], int]) -> List[Tuple[str, int, int, int]]:
+    """
+    Count the tokens of every call's output in each encoding.
+
+    Returns:
+        List[Tuple[str, int, int, int]]: (label, baseline, json, table) token counts.
+    """
+    results = []
+    for label, call, was_indented in calls:
+        value = call()
+        baseline = json.dumps(value, indent=4) if was_indented else json.dumps(value, ensure_ascii=False)
+        results.append((label, count_tokens(baseline), count_tokens(encode_output(value, "json")),
+                        count_tokens(encode_output(value, "table"))))
+    return results
+
+
+if __name__ == "__main__":
+    import tiktoken
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DEFAULT_DB, help="SQLite database to run the tools against.")
+    parser.add_argument("--model", default="gpt-4-turbo", help="Model whose tokenizer is used.")
+    args = parser.parse_args()
+    if not os.path.exists(args.db):
+        sys.exit(f"{args.db} does not exist; run scripts/main.py first.")
+
+    encoding = tiktoken.encoding_for_model(args.model)
+    connection = sqlite3.connect(args.db)
+    rows = measure(sample_calls(connection), lambda text: len(encoding.encode(text)))
+    connection.close()
+
+    print(f"{'tool':<45}{'baseline':>10}{'json':>10}{'table':>10}{'saved':>8}")
+    for label, baseline, minified, table in rows:
+        saved = 1 - min(minified, table) / baseline if baseline else 0
+        print(f"{label:<45}{baseline:>10}{minified:>10}{table:>10}{saved:>8.0%}")
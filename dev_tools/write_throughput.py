@@ -0,0 +1,78 @@
+"""
+@Time ： 2024-11-29
+@Auth ： Adam Lyu
+@Desc ： Measure cart write throughput with per-call commits and with the group-commit writer.
+
+Starts many concurrent sessions that each add products to their own cart on a fresh copy of
+the schema and reports writes per second for DB_WRITER=direct and DB_WRITER=group.
+
+Usage: python dev_tools/write_throughput.py [--sessions 128] [--writes 20]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from scripts.initialize_db import create_tables  # noqa: E402
+from tools import cart_tools  # noqa: E402
+from utils import group_commit  # noqa: E402
+
+
+def measure(mode: str, sessions: int, writes: int) -> float:
+    """
+    Run `sessions` concurrent sessions of `writes` add_to_cart calls each.
+
+    Args:
+        mode (str): "direct" or "group".
+        sessions (int): Number of concurrent sessions (threads).
+        writes (int): Cart writes per session.
+
+    Returns:
+        float: Committed writes per second.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "throughput.db")
+        conn = sqlite3.connect(db_path)
+        create_tables(conn.cursor())
+        conn.executemany("INSERT INTO products (name, price, stock, category) VALUES (?, 1.0, 1000, 'C')",
+                         [(f"Item {i}",) for i in range(writes)])
+        conn.commit()
+        conn.close()
+
+        def connect():
+            # direct 模式：每个会话在自己的连接上逐次提交，在写锁上排队需要足够长的忙等待时间；
+            # group 模式：会话不传连接，写入交给写线程
+            return sqlite3.connect(db_path, timeout=60) if mode == "direct" else None
+
+        def session(user_id):
+            conn = connect()
+            try:
+                for product_id in range(1, writes + 1):
+                    cart_tools.add_to_cart(user_id, product_id, 1, conn=conn)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+        with mock.patch.object(group_commit, "DB_WRITER", mode), mock.patch.object(cart_tools, "db", db_path):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=sessions) as pool:
+                list(pool.map(session, range(1, sessions + 1)))
+            elapsed = time.perf_counter() - start
+            group_commit.close_group_writers()
+    return sessions * writes / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=128, help="Concurrent sessions.")
+    parser.add_argument("--writes", type=int, default=20, help="Cart writes per session.")
+    args = parser.parse_args()
+
+    for mode in ("direct", "group"):
+        print(f"{mode:<8}{measure(mode, args.sessions, args.writes):>10.0f} writes/s")
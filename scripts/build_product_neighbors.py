@@ -0,0 +1,131 @@
+"""
+@Time ： 2024-11-20
+@Auth ： Adam Lyu
+"""
+import argparse
+import json
+import os
+import sqlite3
+
+# 每个产品保存的推荐近邻数量
+NEIGHBOR_TOP_K = 10
+# 推荐的价格范围为原价格上下浮动 20%
+PRICE_BAND = 0.2
+
+# 候选近邻：同类别、价格在浮动范围内的其他产品，优先有库存、价格最接近的产品
+_CANDIDATES_SQL = f"""
+SELECT
+    a.id AS product_id,
+    ROW_NUMBER() OVER (
+        PARTITION BY a.id
+        ORDER BY (c.stock <= 0), ABS(c.price - a.price), c.id
+    ) AS rank,
+    c.id AS neighbor_id,
+    ABS(c.price - a.price) / MAX(a.price, 0.01) AS score
+FROM products a
+JOIN products c
+    ON c.category = a.category
+    AND c.price BETWEEN a.price * {1 - PRICE_BAND} AND a.price * {1 + PRICE_BAND}
+    AND c.id != a.id
+"""
+
+
+def rebuild_product_neighbors(cursor, top_k=NEIGHBOR_TOP_K):
+    """
+    全量重建所有产品的推荐近邻。
+    Args:
+        cursor: SQLite 游标对象
+        top_k (int): 每个产品保存的近邻数量
+    Returns:
+        int: 写入的近邻记录数
+    """
+    cursor.execute("DELETE FROM product_neighbors")
+    cursor.execute(f"""
+    INSERT INTO product_neighbors (product_id, rank, neighbor_id, score)
+    SELECT product_id, rank, neighbor_id, score FROM ({_CANDIDATES_SQL})
+    WHERE rank <= ?
+    """, (top_k,))
+    inserted = cursor.rowcount
+    cursor.execute("DELETE FROM product_neighbors_dirty")
+    return inserted
+
+
+def refresh_product_neighbors(cursor, top_k=NEIGHBOR_TOP_K):
+    """
+    增量刷新推荐近邻：只重新计算刷新队列中的产品，以及近邻列表可能受其影响的产品
+    （当前把它作为近邻的产品、以及价格范围覆盖它新价格的同类别产品）。
+    Args:
+        cursor: SQLite 游标对象
+        top_k (int): 每个产品保存的近邻数量
+    Returns:
+        int: 重新计算的产品数量
+    """
+    # 只处理并删除这里读到的产品：读取之后新加入队列的产品留到下次刷新
+    cursor.execute("SELECT product_id FROM product_neighbors_dirty")
+    dirty = json.dumps([row[0] for row in cursor.fetchall()])
+    if dirty == "[]":
+        return 0
+
+    cursor.execute(f"""
+    WITH dirty AS (SELECT value AS product_id FROM json_each(?))
+    SELECT product_id FROM dirty
+    UNION
+    SELECT n.product_id FROM product_neighbors n WHERE n.neighbor_id IN dirty
+    UNION
+    SELECT p.id FROM products d
+    JOIN products p
+        ON p.category = d.category
+        AND p.price BETWEEN d.price / {1 + PRICE_BAND} AND d.price / {1 - PRICE_BAND}
+    WHERE d.id IN dirty
+    """, (dirty,))
+    affected = [(row[0],) for row in cursor.fetchall()]
+
+    cursor.executemany("DELETE FROM product_neighbors WHERE product_id = ?", affected)
+    cursor.executemany(f"""
+    INSERT INTO product_neighbors (product_id, rank, neighbor_id, score)
+    SELECT product_id, rank, neighbor_id, score FROM ({_CANDIDATES_SQL} WHERE a.id = ?)
+    WHERE rank <= ?
+    """, [(product_id, top_k) for (product_id,) in affected])
+    cursor.execute("DELETE FROM product_neighbors_dirty WHERE product_id IN (SELECT value FROM json_each(?))",
+                   (dirty,))
+    return len(affected)
+
+
+def build_product_neighbors(db_path=None, full=False, top_k=NEIGHBOR_TOP_K):
+    """
+    构建产品推荐近邻表，默认只刷新发生变化的产品。
+    Args:
+        db_path (str): 数据库文件路径，默认使用 ../data/ecommerce.db。
+        full (bool): 是否全量重建
+        top_k (int): 每个产品保存的近邻数量
+    """
+    if not db_path:
+        data_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data"))
+        db_path = os.path.join(data_dir, "ecommerce.db")
+
+    connection = sqlite3.connect(db_path)
+    try:
+        cursor = connection.cursor()
+        if full:
+            count = rebuild_product_neighbors(cursor, top_k)
+            print(f"Rebuilt product neighbors: {count} rows.")
+        else:
+            count = refresh_product_neighbors(cursor, top_k)
+            print(f"Refreshed neighbors for {count} products.")
+        connection.commit()
+
+    except sqlite3.Error as e:
+        connection.rollback()
+        print(f"An error occurred while building product neighbors: {e}")
+        raise
+
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the product recommendation neighbor table.")
+    parser.add_argument("--full", action="store_true", help="Rebuild every product instead of only changed ones.")
+    parser.add_argument("--top-k", type=int, default=NEIGHBOR_TOP_K, help="Neighbors stored per product.")
+    args = parser.parse_args()
+    build_product_neighbors(full=args.full, top_k=args.top_k)
@@ -1,16 +1,29 @@
 import os
 import sqlite3
 
+from scripts.migrations import apply_migrations
+
 
 def create_tables(cursor):
     """
-    创建表结构。
+    创建表结构：按顺序执行 scripts/migrations 下尚未执行的迁移。
+    Args:
+        cursor: SQLite 游标对象
+    Returns:
+        List[int]: 本次执行的迁移版本号
+    """
+    return apply_migrations(cursor.connection)
+
+
+def create_base_tables(cursor):
+    """
+    创建产品、购物车、订单等基础表。
     Args:
         cursor: SQLite 游标对象
     """
     # 创建产品表
     cursor.execute("""
-    CREATE TABLE products (
+    CREATE TABLE IF NOT EXISTS products (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT NOT NULL,
         description TEXT,
@@ -77,9 +90,739 @@ def create_tables(cursor):
     """)
 
 
+def create_indexes(cursor):
+    """
+    创建工具 SQL 依赖的二级索引，避免 JOIN 和过滤条件全表扫描。
+    tests/test_query_plans.py 会检查 tools/ 下的所有查询都能使用这些索引。
+    Args:
+        cursor: SQLite 游标对象
+    """
+    # 购物车：按用户查找购物车，按购物车查找产品（同时保证同一产品只有一行）
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cart_user_id ON cart (user_id);")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_cart_product ON cart_products (cart_id, product_id);")
+
+    # 订单：按用户和时间查询最近订单，按订单查询产品
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_products_order_id ON order_products (order_id);")
+
+    # 产品：按类别筛选并按价格排序/过滤，以及不限类别时按价格排序/过滤
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_category_price ON products (category, price);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_price ON products (price);")
+    # 分面统计：覆盖索引，按类别/价格过滤后无需回表
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_facets ON products (category, price, stock, color, size);")
+
+
+def create_catalog_version(cursor):
+    """
+    创建产品目录版本号表。每个 scope 是一个计数器，由 products 上的触发器在相关数据变化时递增，
+    进程内缓存只需读取一次版本号即可判断是否失效。
+    - categories: 新增/删除产品，或修改产品的类别、价格
+    - names: 新增/删除产品，或修改产品名称
+    - text: 新增/删除产品，或修改产品名称、描述、附加规格
+    - facets: 新增/删除产品，或修改分面统计用到的任一列
+    - search: 新增/删除产品，或修改产品的任一列（不限类别的搜索结果缓存）
+    另有按类别的版本号表 category_version：某类别中的产品新增、删除、修改，或移入/移出该类别时递增，
+    带类别过滤的搜索结果缓存只在该类别变化时失效。
+    Args:
+        cursor: SQLite 游标对象
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS catalog_version (
+        scope TEXT PRIMARY KEY, -- 缓存范围
+        version INTEGER NOT NULL DEFAULT 0 -- 版本号
+    );
+    """)
+    scopes = {
+        "categories": "UPDATE OF category, price",
+        "names": "UPDATE OF name",
+        "text": "UPDATE OF name, description, additional_specs",
+        "facets": "UPDATE OF name, description, category, color, size, price, stock, additional_specs",
+        "search": "UPDATE",
+    }
+    for scope, update_event in scopes.items():
+        cursor.execute("INSERT OR IGNORE INTO catalog_version (scope, version) VALUES (?, 0)", (scope,))
+        for suffix, event in (("ai", "INSERT"), ("ad", "DELETE"), ("au", update_event)):
+            cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS catalog_version_{scope}_{suffix} AFTER {event} ON products BEGIN
+                UPDATE catalog_version SET version = version + 1 WHERE scope = '{scope}';
+            END;
+            """)
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS category_version (
+        category TEXT PRIMARY KEY, -- 产品类别
+        version INTEGER NOT NULL DEFAULT 0 -- 版本号
+    );
+    """)
+
+    def bump_category(target):
+        return f"""
+        INSERT INTO category_version (category, version) VALUES ({target}.category, 1)
+        ON CONFLICT (category) DO UPDATE SET version = version + 1;
+        """
+
+    for suffix, event, statements in (("ai", "INSERT", bump_category("new")),
+                                      ("ad", "DELETE", bump_category("old")),
+                                      ("au", "UPDATE", bump_category("old") + bump_category("new"))):
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS category_version_{suffix} AFTER {event} ON products BEGIN
+            {statements}
+        END;
+        """)
+
+
+def create_product_changes(cursor):
+    """
+    创建产品变更日志。新增、删除产品或修改名称、价格、库存、类别时，触发器追加一条记录，
+    列式目录快照 (tools/catalog_snapshot.py) 据此只重新读取发生变化的产品。
+    Args:
+        cursor: SQLite 游标对象
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS product_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT, -- 变更序号
+        product_id INTEGER NOT NULL -- 发生变化的产品ID
+    );
+    """)
+
+    for suffix, event, target in (("ai", "INSERT", "new"), ("ad", "DELETE", "old"),
+                                  ("au", "UPDATE OF name, price, stock, category", "new")):
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS product_changes_{suffix} AFTER {event} ON products BEGIN
+            INSERT INTO product_changes (product_id) VALUES ({target}.id);
+        END;
+        """)
+
+
+def create_product_neighbors(cursor):
+    """
+    创建预计算的产品推荐近邻表，以及记录待刷新产品的队列表。
+    价格、库存、类别变化或新增/删除产品时，触发器会把产品加入刷新队列，
+    由 scripts/build_product_neighbors.py 增量刷新。
+    Args:
+        cursor: SQLite 游标对象
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS product_neighbors (
+        product_id INTEGER NOT NULL, -- 产品ID
+        rank INTEGER NOT NULL, -- 推荐顺序，从 1 开始
+        neighbor_id INTEGER NOT NULL, -- 推荐产品ID
+        score REAL NOT NULL, -- 相对价格差，越小越相似
+        PRIMARY KEY (product_id, rank)
+    ) WITHOUT ROWID;
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_product_neighbors_neighbor ON product_neighbors (neighbor_id);
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS product_neighbors_dirty (
+        product_id INTEGER PRIMARY KEY
+    );
+    """)
+
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS product_neighbors_ai AFTER INSERT ON products BEGIN
+        INSERT OR IGNORE INTO product_neighbors_dirty (product_id) VALUES (new.id);
+    END;
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS product_neighbors_ad AFTER DELETE ON products BEGIN
+        INSERT OR IGNORE INTO product_neighbors_dirty (product_id) VALUES (old.id);
+    END;
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS product_neighbors_au AFTER UPDATE OF price, stock, category ON products BEGIN
+        INSERT OR IGNORE INTO product_neighbors_dirty (product_id) VALUES (new.id);
+    END;
+    """)
+
+
+def create_product_attributes(cursor):
+    """
+    创建产品规格属性表：把 additional_specs JSON 对象的每个顶层键值对拆成一行（如 Brand=Sony），
+    并建立 (name, value) 索引，使按规格过滤无需解析每一行 JSON。
+    触发器在新增、删除产品或修改 additional_specs 时同步；名称和值的比较不区分大小写。
+    Args:
+        cursor: SQLite 游标对象
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS product_attributes (
+        product_id INTEGER NOT NULL, -- 产品ID
+        name TEXT NOT NULL COLLATE NOCASE, -- 规格名称，如 Brand
+        value TEXT COLLATE NOCASE, -- 规格值，如 Sony
+        PRIMARY KEY (product_id, name)
+    ) WITHOUT ROWID;
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_product_attributes_name_value ON product_attributes (name, value);
+    """)
+
+    # 只拆分合法的 JSON 对象，其他内容（NULL、非法 JSON、数组）不产生属性
+    def specs_object(column):
+        return f"CASE WHEN json_valid({column}) THEN CASE json_type({column}) WHEN 'object' THEN {column} END END"
+
+    def insert_attributes(target):
+        return f"""
+        INSERT OR REPLACE INTO product_attributes (product_id, name, value)
+        SELECT {target}.id, key, CAST(value AS TEXT)
+        FROM json_each({specs_object(f"{target}.additional_specs")})
+        WHERE type NOT IN ('object', 'array');
+        """
+
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS product_attributes_ai AFTER INSERT ON products BEGIN
+        {insert_attributes("new")}
+    END;
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS product_attributes_ad AFTER DELETE ON products BEGIN
+        DELETE FROM product_attributes WHERE product_id = old.id;
+    END;
+    """)
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS product_attributes_au AFTER UPDATE OF additional_specs ON products BEGIN
+        DELETE FROM product_attributes WHERE product_id = old.id;
+        {insert_attributes("new")}
+    END;
+    """)
+
+    # 对已有数据建立属性索引
+    cursor.execute(f"""
+    INSERT OR REPLACE INTO product_attributes (product_id, name, value)
+    SELECT p.id, j.key, CAST(j.value AS TEXT)
+    FROM products p, json_each({specs_object("p.additional_specs")}) j
+    WHERE j.type NOT IN ('object', 'array');
+    """)
+
+
+def create_product_fts(cursor):
+    """
+    创建产品全文索引 (FTS5)，覆盖 name、description、category，并通过触发器与 products 表保持同步。
+    如果当前 SQLite 未编译 FTS5，则跳过，搜索会回退到 LIKE 查询。
+    Args:
+        cursor: SQLite 游标对象
+    Returns:
+        bool: 是否成功创建全文索引
+    """
+    try:
+        cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name,
+            description,
+            category,
+            content='products',
+            content_rowid='id'
+        );
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"FTS5 is not available, product search will fall back to LIKE: {e}")
+        return False
+
+    # 插入、删除、更新产品时同步全文索引
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts (rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END;
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts (products_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+    END;
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, description, category ON products BEGIN
+        INSERT INTO products_fts (products_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+        INSERT INTO products_fts (rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END;
+    """)
+
+    # 对已有数据重建索引
+    cursor.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+    return True
+
+
+def create_cart_version(cursor):
+    """
+    为购物车增加版本号列 cart.version。cart_products 中该购物车的产品新增、删除或修改数量时，
+    触发器将其递增，购物车汇总缓存 (tools/cart_tools.py) 据此判断是否失效。
+    Args:
+        cursor: SQLite 游标对象
+    """
+    cursor.execute("PRAGMA table_info(cart)")
+    if "version" not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE cart ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+    for suffix, event, targets in (("ai", "INSERT", ("new",)), ("ad", "DELETE", ("old",)),
+                                   ("au", "UPDATE", ("old", "new"))):
+        statements = "".join(f"UPDATE cart SET version = version + 1 WHERE id = {target}.cart_id;\n"
+                             for target in targets)
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS cart_version_{suffix} AFTER {event} ON cart_products BEGIN
+            {statements}
+        END;
+        """)
+
+
+def create_checkout_idempotency(cursor):
+    """
+    创建结账幂等键表。带幂等键的结账成功后，在同一事务中记录键、订单ID与返回结果；
+    相同用户重复提交同一个键时直接返回原结果，不再读取购物车或修改库存。过期的键按 created_at 清理。
+    Args:
+        cursor: SQLite 游标对象
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS checkout_idempotency (
+        user_id INTEGER NOT NULL, -- 用户ID
+        idempotency_key TEXT NOT NULL, -- 调用方提供的幂等键
+        order_id INTEGER NOT NULL, -- 结账生成的订单ID
+        result TEXT NOT NULL, -- 结账返回的结果
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, -- 记录时间
+        PRIMARY KEY (user_id, idempotency_key)
+    ) WITHOUT ROWID;
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_checkout_idempotency_created ON checkout_idempotency (created_at);")
+
+
+def create_order_events(cursor):
+    """
+    创建只追加的订单事件表 order_events。写入方只追加事件，触发器把事件投影到订单当前状态 (orders)
+    和按用户的订单汇总 (user_order_summary)：
+    - created: 新订单（订单行由结账写入），计入用户的订单数与消费总额
+    - address_changed: payload.delivery_address 写入 orders.delivery_address
+    - status_changed: payload.status 写入 orders.status
+    - cancelled: 订单状态改为 Cancelled 并记录 payload.reason，从用户消费总额中扣除
+    事件不可修改或删除。已有订单补写 created（以及已取消订单的 cancelled）事件并重建汇总。
+    Args:
+        cursor: SQLite 游标对象
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS order_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, -- 事件序号
+        order_id INTEGER NOT NULL, -- 订单ID
+        user_id INTEGER NOT NULL, -- 用户ID
+        event_type TEXT NOT NULL CHECK(event_type IN ('created', 'address_changed', 'status_changed', 'cancelled')), -- 事件类型
+        payload TEXT NOT NULL DEFAULT '{}', -- 事件内容 (JSON)
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP -- 发生时间
+    );
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_events_order ON order_events (order_id, id);")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS user_order_summary (
+        user_id INTEGER PRIMARY KEY, -- 用户ID
+        order_count INTEGER NOT NULL DEFAULT 0, -- 订单数（含已取消）
+        cancelled_count INTEGER NOT NULL DEFAULT 0, -- 已取消订单数
+        total_spent REAL NOT NULL DEFAULT 0, -- 未取消订单的总金额
+        last_order_at TIMESTAMP -- 最近一次下单时间
+    );
+    """)
+
+    # 事件只追加
+    for suffix, event in (("bu", "UPDATE"), ("bd", "DELETE")):
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS order_events_{suffix} BEFORE {event} ON order_events BEGIN
+            SELECT RAISE(ABORT, 'order_events is append-only');
+        END;
+        """)
+
+    # 投影：每种事件增量更新订单当前状态与用户汇总
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS order_events_created AFTER INSERT ON order_events
+    WHEN new.event_type = 'created' BEGIN
+        INSERT INTO user_order_summary (user_id, order_count, total_spent, last_order_at)
+        SELECT new.user_id, 1, total_amount, created_at FROM orders WHERE id = new.order_id
+        ON CONFLICT (user_id) DO UPDATE SET
+            order_count = order_count + 1,
+            total_spent = total_spent + excluded.total_spent,
+            last_order_at = MAX(COALESCE(last_order_at, ''), excluded.last_order_at);
+    END;
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS order_events_address_changed AFTER INSERT ON order_events
+    WHEN new.event_type = 'address_changed' BEGIN
+        UPDATE orders SET delivery_address = json_extract(new.payload, '$.delivery_address'),
+                          updated_at = new.created_at
+        WHERE id = new.order_id;
+    END;
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS order_events_status_changed AFTER INSERT ON order_events
+    WHEN new.event_type = 'status_changed' BEGIN
+        UPDATE orders SET status = json_extract(new.payload, '$.status'), updated_at = new.created_at
+        WHERE id = new.order_id;
+    END;
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS order_events_cancelled AFTER INSERT ON order_events
+    WHEN new.event_type = 'cancelled' BEGIN
+        UPDATE user_order_summary
+        SET cancelled_count = cancelled_count + 1,
+            total_spent = total_spent - (SELECT total_amount FROM orders WHERE id = new.order_id)
+        WHERE user_id = new.user_id;
+        UPDATE orders SET status = 'Cancelled', cancellation_reason = json_extract(new.payload, '$.reason'),
+                          updated_at = new.created_at
+        WHERE id = new.order_id;
+    END;
+    """)
+
+    # 为已有订单补写事件，汇总由投影触发器生成
+    cursor.execute("SELECT COUNT(*) FROM order_events")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("""
+        INSERT INTO order_events (order_id, user_id, event_type, payload, created_at)
+        SELECT id, user_id, 'created', json_object('total_amount', total_amount), created_at
+        FROM orders ORDER BY id
+        """)
+        cursor.execute("""
+        INSERT INTO order_events (order_id, user_id, event_type, payload, created_at)
+        SELECT id, user_id, 'cancelled', json_object('reason', cancellation_reason), updated_at
+        FROM orders WHERE status = 'Cancelled' ORDER BY id
+        """)
+
+
+def create_sales_aggregates(cursor):
+    """
+    创建物化的销售汇总表，由 order_events 上的触发器在结账 (created) 与取消 (cancelled) 的同一事务中增量维护：
+    - product_sales: 每个产品的销量与销售额
+    - user_product_purchases: 每个用户购买过的产品、数量与最近购买时间
+    - category_daily_sales: 每个类别每天的销量与销售额（按下单日期）
+    按用户的订单数与消费总额见 user_order_summary。已取消的订单不计入。
+    全量重建见 scripts/rebuild_sales_aggregates.py。
+    Args:
+        cursor: SQLite 游标对象
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS product_sales (
+        product_id INTEGER PRIMARY KEY, -- 产品ID
+        units_sold INTEGER NOT NULL DEFAULT 0, -- 销量
+        revenue REAL NOT NULL DEFAULT 0 -- 销售额
+    );
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_sales_units ON product_sales (units_sold DESC, revenue);")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS user_product_purchases (
+        user_id INTEGER NOT NULL, -- 用户ID
+        product_id INTEGER NOT NULL, -- 产品ID
+        units INTEGER NOT NULL DEFAULT 0, -- 购买数量
+        last_purchased_at TIMESTAMP, -- 最近购买时间
+        PRIMARY KEY (user_id, product_id)
+    ) WITHOUT ROWID;
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS category_daily_sales (
+        category TEXT NOT NULL, -- 产品类别
+        day DATE NOT NULL, -- 下单日期
+        units INTEGER NOT NULL DEFAULT 0, -- 销量
+        revenue REAL NOT NULL DEFAULT 0, -- 销售额
+        PRIMARY KEY (category, day)
+    ) WITHOUT ROWID;
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_category_daily_sales_day ON category_daily_sales (day);")
+    create_sales_aggregate_triggers(cursor)
+
+
+def order_line_category(cursor):
+    """
+    订单行计入类别销售时使用的类别：order_products 有 category 列（下单时的类别快照）时使用该列，
+    否则（迁移 0014 之前）使用产品当前的类别。
+    Args:
+        cursor: SQLite 游标对象
+    Returns:
+        tuple: (订单行 op 的类别表达式, 需要附加的 products 连接子句)
+    """
+    cursor.execute("PRAGMA table_info(order_products)")
+    if "category" in [row[1] for row in cursor.fetchall()]:
+        return "op.category", ""
+    return "p.category", "LEFT JOIN products p ON p.id = op.product_id"
+
+
+def create_sales_aggregate_triggers(cursor):
+    """
+    创建在结账 (created) 与取消 (cancelled) 事件上增量维护销售汇总表的触发器，类别见 order_line_category。
+    Args:
+        cursor: SQLite 游标对象
+    """
+    category, products_join = order_line_category(cursor)
+
+    # 订单中每个产品的数量与金额
+    order_lines = f"""
+        SELECT op.product_id, {category} AS category, date(o.created_at) AS day, o.created_at,
+               SUM(op.quantity) AS units, SUM(op.quantity * op.price) AS revenue
+        FROM order_products op
+        JOIN orders o ON o.id = op.order_id
+        {products_join}
+        WHERE op.order_id = new.order_id
+        GROUP BY op.product_id
+    """
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS sales_aggregates_created AFTER INSERT ON order_events
+    WHEN new.event_type = 'created' BEGIN
+        INSERT INTO product_sales (product_id, units_sold, revenue)
+        SELECT product_id, units, revenue FROM ({order_lines}) WHERE true
+        ON CONFLICT (product_id) DO UPDATE SET
+            units_sold = product_sales.units_sold + excluded.units_sold,
+            revenue = product_sales.revenue + excluded.revenue;
+        INSERT INTO user_product_purchases (user_id, product_id, units, last_purchased_at)
+        SELECT new.user_id, product_id, units, created_at FROM ({order_lines}) WHERE true
+        ON CONFLICT (user_id, product_id) DO UPDATE SET
+            units = user_product_purchases.units + excluded.units,
+            last_purchased_at = MAX(COALESCE(user_product_purchases.last_purchased_at, ''),
+                                    excluded.last_purchased_at);
+        INSERT INTO category_daily_sales (category, day, units, revenue)
+        SELECT category, day, SUM(units), SUM(revenue) FROM ({order_lines})
+        WHERE category IS NOT NULL GROUP BY category, day
+        ON CONFLICT (category, day) DO UPDATE SET
+            units = category_daily_sales.units + excluded.units,
+            revenue = category_daily_sales.revenue + excluded.revenue;
+    END;
+    """)
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS sales_aggregates_cancelled AFTER INSERT ON order_events
+    WHEN new.event_type = 'cancelled' BEGIN
+        UPDATE product_sales SET units_sold = product_sales.units_sold - l.units,
+            revenue = product_sales.revenue - l.revenue
+        FROM ({order_lines}) AS l
+        WHERE product_sales.product_id = l.product_id;
+        UPDATE user_product_purchases SET units = user_product_purchases.units - l.units
+        FROM ({order_lines}) AS l
+        WHERE user_product_purchases.user_id = new.user_id AND user_product_purchases.product_id = l.product_id;
+        UPDATE category_daily_sales SET units = category_daily_sales.units - l.units,
+            revenue = category_daily_sales.revenue - l.revenue
+        FROM (SELECT category, day, SUM(units) AS units, SUM(revenue) AS revenue
+              FROM ({order_lines}) GROUP BY category, day) AS l
+        WHERE category_daily_sales.category = l.category AND category_daily_sales.day = l.day;
+        -- 删除清零的行，与全量重建的结果一致（last_purchased_at 不回退）
+        DELETE FROM product_sales WHERE units_sold <= 0
+            AND product_id IN (SELECT product_id FROM order_products WHERE order_id = new.order_id);
+        DELETE FROM user_product_purchases WHERE user_id = new.user_id AND units <= 0
+            AND product_id IN (SELECT product_id FROM order_products WHERE order_id = new.order_id);
+        DELETE FROM category_daily_sales WHERE units <= 0
+            AND day = (SELECT date(created_at) FROM orders WHERE id = new.order_id);
+    END;
+    """)
+
+
+def create_product_change_consumers(cursor):
+    """
+    只在有消费者时记录产品变更：创建消费者表（每个列式目录快照一行，记录已应用的最后变更序号），
+    并把 product_changes 的触发器改为仅在存在消费者时写入。CATALOG_ENGINE=sql 时没有消费者，
+    结账扣减库存等更新不再写变更日志。日志按所有消费者中最小的已应用序号清理。
+    Args:
+        cursor: SQLite 游标对象
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS product_change_consumers (
+        consumer TEXT PRIMARY KEY, -- 消费者（快照目录）
+        seq INTEGER NOT NULL DEFAULT 0 -- 已应用的最后变更序号
+    );
+    """)
+
+    for suffix, event, target in (("ai", "INSERT", "new"), ("ad", "DELETE", "old"),
+                                  ("au", "UPDATE OF name, price, stock, category", "new")):
+        cursor.execute(f"DROP TRIGGER IF EXISTS product_changes_{suffix}")
+        cursor.execute(f"""
+        CREATE TRIGGER product_changes_{suffix} AFTER {event} ON products
+        WHEN EXISTS (SELECT 1 FROM product_change_consumers) BEGIN
+            INSERT INTO product_changes (product_id) VALUES ({target}.id);
+        END;
+        """)
+
+    # 之前没有消费者登记，已有的日志无人使用；已发布的快照首次刷新时全量重建
+    cursor.execute("DELETE FROM product_changes")
+
+
+def create_product_name_trigram(cursor):
+    """
+    创建产品名称的 trigram 全文索引 (FTS5)，使名称子串查询 name LIKE '%term%' 可以走索引
+    （例如 "phone" 命中 "Smartphone"），并通过触发器与 products 表保持同步。
+    如果当前 SQLite 不支持 trigram 分词器 (3.34 之前)，则跳过，子串匹配会扫描 products 表。
+    Args:
+        cursor: SQLite 游标对象
+    Returns:
+        bool: 是否成功创建索引
+    """
+    try:
+        cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_name_trigram USING fts5(
+            name,
+            content='products',
+            content_rowid='id',
+            tokenize='trigram'
+        );
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"FTS5 trigram tokenizer is not available, name substring search will scan products: {e}")
+        return False
+
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS products_name_trigram_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_name_trigram (rowid, name) VALUES (new.id, new.name);
+    END;
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS products_name_trigram_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_name_trigram (products_name_trigram, rowid, name) VALUES ('delete', old.id, old.name);
+    END;
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS products_name_trigram_au AFTER UPDATE OF name ON products BEGIN
+        INSERT INTO products_name_trigram (products_name_trigram, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO products_name_trigram (rowid, name) VALUES (new.id, new.name);
+    END;
+    """)
+
+    # 对已有数据重建索引
+    cursor.execute("INSERT INTO products_name_trigram (products_name_trigram) VALUES ('rebuild')")
+    return True
+
+
+def create_order_product_category(cursor):
+    """
+    为订单行增加下单时的产品类别快照 order_products.category，类别销售汇总在结账、取消与全量重建中
+    都按该列计入，产品之后改类别不会让取消扣错类别。未指定类别的订单行由触发器按产品当前类别填写；
+    已有订单行按产品当前类别补写，并重建销售汇总触发器。
+    Args:
+        cursor: SQLite 游标对象
+    """
+    cursor.execute("PRAGMA table_info(order_products)")
+    if "category" not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE order_products ADD COLUMN category TEXT")
+
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS order_products_category_ai AFTER INSERT ON order_products
+    WHEN new.category IS NULL BEGIN
+        UPDATE order_products SET category = (SELECT category FROM products WHERE id = new.product_id)
+        WHERE id = new.id;
+    END;
+    """)
+    cursor.execute("""
+    UPDATE order_products SET category = (SELECT category FROM products WHERE id = order_products.product_id)
+    WHERE category IS NULL
+    """)
+
+    for suffix in ("created", "cancelled"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS sales_aggregates_{suffix}")
+    create_sales_aggregate_triggers(cursor)
+
+
+def create_product_version(cursor):
+    """
+    为产品增加版本号列 products.version。产品的名称、价格或库存变化时，触发器将其递增，
+    购物车汇总缓存 (tools/cart_tools.py) 只在购物车中的产品变化时失效，而不是目录中任一产品变化时。
+    Args:
+        cursor: SQLite 游标对象
+    """
+    cursor.execute("PRAGMA table_info(products)")
+    if "version" not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE products ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS product_version_au AFTER UPDATE OF name, price, stock ON products
+    WHEN old.name IS NOT new.name OR old.price IS NOT new.price OR old.stock IS NOT new.stock BEGIN
+        UPDATE products SET version = version + 1 WHERE id = new.id;
+    END;
+    """)
+
+
+# 库存数量只在有货与缺货之间切换时才影响搜索结果、分面与近邻排序
+STOCK_STATUS_CHANGED = "(old.stock > 0) IS NOT (new.stock > 0)"
+
+
+def update_trigger_clause(columns, stock_status=False):
+    """
+    生成只在指定列的值变化时执行的更新触发器子句：UPDATE OF 列清单与 WHEN old.x IS NOT new.x 条件。
+    Args:
+        columns (tuple): 触发器依赖的列
+        stock_status (bool): 是否还在库存有货/缺货状态切换时执行
+    Returns:
+        str: "UPDATE OF ... ON products WHEN ..." 子句
+    """
+    conditions = [f"old.{column} IS NOT new.{column}" for column in columns]
+    if stock_status:
+        columns, conditions = columns + ("stock",), conditions + [STOCK_STATUS_CHANGED]
+    return f"UPDATE OF {', '.join(columns)} ON products WHEN {' OR '.join(conditions)}"
+
+
+def create_scoped_catalog_triggers(cursor):
+    """
+    把 catalog_version 的更新触发器限定为只在各 scope 依赖的列的值变化时递增版本号；
+    facets 只在库存有货/缺货状态切换时随库存变化，结账扣减库存不再使分面缓存失效。
+    search 见 create_scoped_search_triggers。
+    Args:
+        cursor: SQLite 游标对象
+    """
+    scopes = {
+        "categories": (("category", "price"), False),
+        "names": (("name",), False),
+        "text": (("name", "description", "additional_specs"), False),
+        "facets": (("name", "description", "category", "color", "size", "price", "additional_specs"), True),
+    }
+    for scope, (columns, stock_status) in scopes.items():
+        cursor.execute(f"DROP TRIGGER IF EXISTS catalog_version_{scope}_au")
+        cursor.execute(f"""
+        CREATE TRIGGER catalog_version_{scope}_au AFTER {update_trigger_clause(columns, stock_status)} BEGIN
+            UPDATE catalog_version SET version = version + 1 WHERE scope = '{scope}';
+        END;
+        """)
+
+
+def create_scoped_search_triggers(cursor):
+    """
+    把搜索结果缓存的版本号触发器（catalog_version 的 search 与 category_version）以及近邻待刷新标记
+    限定为只在依赖的列的值变化时执行。库存只在有货/缺货切换时计入：只改库存数量的更新（结账、取消）
+    不再使搜索缓存失效或标记近邻，搜索缓存命中时按主键重新读取库存 (tools/product_tools.py)。
+    Args:
+        cursor: SQLite 游标对象
+    """
+    # 搜索结果可返回的列（库存除外）
+    search_columns = ("name", "description", "price", "category", "color", "size", "additional_specs",
+                      "image_url", "created_at", "updated_at")
+    cursor.execute("DROP TRIGGER IF EXISTS catalog_version_search_au")
+    cursor.execute(f"""
+    CREATE TRIGGER catalog_version_search_au AFTER {update_trigger_clause(search_columns, True)} BEGIN
+        UPDATE catalog_version SET version = version + 1 WHERE scope = 'search';
+    END;
+    """)
+    cursor.execute("DROP TRIGGER IF EXISTS category_version_au")
+    cursor.execute(f"""
+    CREATE TRIGGER category_version_au AFTER {update_trigger_clause(search_columns, True)} BEGIN
+        INSERT INTO category_version (category, version) VALUES (old.category, 1)
+        ON CONFLICT (category) DO UPDATE SET version = version + 1;
+        INSERT INTO category_version (category, version) VALUES (new.category, 1)
+        ON CONFLICT (category) DO UPDATE SET version = version + 1;
+    END;
+    """)
+    cursor.execute("DROP TRIGGER IF EXISTS product_neighbors_au")
+    cursor.execute(f"""
+    CREATE TRIGGER product_neighbors_au AFTER {update_trigger_clause(("price", "category"), True)} BEGIN
+        INSERT OR IGNORE INTO product_neighbors_dirty (product_id) VALUES (new.id);
+    END;
+    """)
+
+
+def drop_product_version(cursor):
+    """
+    删除 products.version 及其触发器：购物车汇总缓存只按 cart.version 失效，不再需要在每次库存、
+    价格变化（结账扣减、取消回补）时额外写一次产品行。SQLite 3.35 之前不支持 DROP COLUMN，
+    此时只删除触发器，保留的列不再被读写。
+    Args:
+        cursor: SQLite 游标对象
+    """
+    cursor.execute("DROP TRIGGER IF EXISTS product_version_au")
+    cursor.execute("PRAGMA table_info(products)")
+    if "version" in [row[1] for row in cursor.fetchall()]:
+        try:
+            cursor.execute("ALTER TABLE products DROP COLUMN version")
+        except sqlite3.OperationalError as e:
+            print(f"Keeping the unused products.version column: {e}")
+
+
 def create_database_and_tables(db_path=None):
     """
-    创建 SQLite 数据库及相关表。如果文件不存在，将会自动创建。
+    创建 SQLite 数据库及相关表。如果文件不存在，将会自动创建；已有数据库只执行尚未执行的迁移。
     Args:
         db_path (str): 数据库文件路径，默认保存在 ../data/ecommerce.db。
     """
@@ -95,12 +838,13 @@ def create_database_and_tables(db_path=None):
         connection = sqlite3.connect(db_path)
         cursor = connection.cursor()
 
-        # 创建表结构
-        create_tables(cursor)
+        # 创建表结构（执行尚未执行的迁移）
+        applied = create_tables(cursor)
 
         # 提交事务
         connection.commit()
-        print(f"Database and tables created successfully! Database path: {db_path}")
+        print(f"Database and tables created successfully! Database path: {db_path}, "
+              f"applied migrations: {applied or 'none'}")
 
     except sqlite3.Error as e:
         print(f"An error occurred while creating database or tables: {e}")
@@ -2,6 +2,7 @@
 @Time ： 2024-11-15
 @Auth ： Adam Lyu
 """
+from scripts.build_product_neighbors import build_product_neighbors
 from scripts.initialize_data import insert_sample_products
 from scripts.initialize_db import create_database_and_tables, delete_database
 from scripts.initialze_data_from_csv import insert_products_from_csv, extract_csv_from_zip
@@ -9,8 +10,10 @@ from scripts.initialze_data_from_csv import insert_products_from_csv, extract_cs
 
 def setup_database():
     delete_database()
+    # 启动时执行一次数据库迁移，工具函数假定表结构和索引已经存在
     create_database_and_tables()
     insert_sample_products()
+    build_product_neighbors(full=True)
     # csv_file_path = extract_csv_from_zip(
     #     'marketing_sample_for_amazon_com-ecommerce__20200101_20200131__10k_data.csv.zip', '.')
     # csv_file_path = '/Users/adamlyu/PycharmProjects/shopping_assistant/scripts/marketing_sample_for_amazon_com-ecommerce__20200101_20200131__10k_data.csv'
@@ -0,0 +1,10 @@
+"""
+@Time ： 2024-11-24
+@Auth ： Adam Lyu
+@Desc ： 产品、购物车、购物车产品、订单、订单产品基础表。
+"""
+from scripts.initialize_db import create_base_tables
+
+
+def upgrade(cursor):
+    create_base_tables(cursor)
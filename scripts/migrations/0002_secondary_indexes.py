@@ -0,0 +1,10 @@
+"""
+@Time ： 2024-11-24
+@Auth ： Adam Lyu
+@Desc ： 购物车、订单和产品查询使用的二级索引。
+"""
+from scripts.initialize_db import create_indexes
+
+
+def upgrade(cursor):
+    create_indexes(cursor)
@@ -0,0 +1,10 @@
+"""
+@Time ： 2024-11-24
+@Auth ： Adam Lyu
+@Desc ： 目录版本号表与按类别的版本号表，以及维护它们的触发器。
+"""
+from scripts.initialize_db import create_catalog_version
+
+
+def upgrade(cursor):
+    create_catalog_version(cursor)
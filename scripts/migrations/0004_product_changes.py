@@ -0,0 +1,10 @@
+"""
+@Time ： 2024-11-24
+@Auth ： Adam Lyu
+@Desc ： 产品变更日志，列式目录快照据此增量刷新。
+"""
+from scripts.initialize_db import create_product_changes
+
+
+def upgrade(cursor):
+    create_product_changes(cursor)
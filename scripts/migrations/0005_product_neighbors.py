@@ -0,0 +1,10 @@
+"""
+@Time ： 2024-11-24
+@Auth ： Adam Lyu
+@Desc ： 预计算的产品推荐近邻表及其刷新队列。
+"""
+from scripts.initialize_db import create_product_neighbors
+
+
+def upgrade(cursor):
+    create_product_neighbors(cursor)
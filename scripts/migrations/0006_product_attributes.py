@@ -0,0 +1,10 @@
+"""
+@Time ： 2024-11-24
+@Auth ： Adam Lyu
+@Desc ： 从 additional_specs 拆分出的产品规格属性索引。
+"""
+from scripts.initialize_db import create_product_attributes
+
+
+def upgrade(cursor):
+    create_product_attributes(cursor)
@@ -0,0 +1,10 @@
+"""
+@Time ： 2024-11-24
+@Auth ： Adam Lyu
+@Desc ： 产品全文索引 (FTS5)；SQLite 未编译 FTS5 时跳过。
+"""
+from scripts.initialize_db import create_product_fts
+
+
+def upgrade(cursor):
+    create_product_fts(cursor)
@@ -0,0 +1,10 @@
+"""
+@Time ： 2024-11-25
+@Auth ： Adam Lyu
+@Desc ： 购物车版本号列及维护它的 cart_products 触发器。
+"""
+from scripts.initialize_db import create_cart_version
+
+
+def upgrade(cursor):
+    create_cart_version(cursor)
@@ -0,0 +1,10 @@
+"""
+@Time ： 2024-11-26
+@Auth ： Adam Lyu
+@Desc ： 结账幂等键表。
+"""
+from scripts.initialize_db import create_checkout_idempotency
+
+
+def upgrade(cursor):
+    create_checkout_idempotency(cursor)
@@ -0,0 +1,10 @@
+"""
+@Time ： 2024-11-27
+@Auth ： Adam Lyu
+@Desc ： 只追加的订单事件表，及投影到 orders 与 user_order_summary 的触发器。
+"""
+from scripts.initialize_db import create_order_events
+
+
+def upgrade(cursor):
+    create_order_events(cursor)
@@ -0,0 +1,12 @@
+"""
+@Time ： 2024-11-28
+@Auth ： Adam Lyu
+@Desc ： 物化的销售汇总表及其增量维护触发器；已有订单全量汇总一次。
+"""
+from scripts.initialize_db import create_sales_aggregates
+from scripts.rebuild_sales_aggregates import rebuild_sales_aggregates
+
+
+def upgrade(cursor):
+    create_sales_aggregates(cursor)
+    rebuild_sales_aggregates(cursor)
@@ -0,0 +1,10 @@
+"""
+@Time ： 2024-11-30
+@Auth ： Adam Lyu
+@Desc ： 产品变更日志只在有快照消费者时写入，并按消费者的进度清理。
+"""
+from scripts.initialize_db import create_product_change_consumers
+
+
+def upgrade(cursor):
+    create_product_change_consumers(cursor)
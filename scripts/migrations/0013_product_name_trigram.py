@@ -0,0 +1,10 @@
+"""
+@Time ： 2024-11-30
+@Auth ： Adam Lyu
+@Desc ： 产品名称 trigram 索引，名称子串搜索走索引；SQLite 不支持 trigram 时跳过。
+"""
+from scripts.initialize_db import create_product_name_trigram
+
+
+def upgrade(cursor):
+    create_product_name_trigram(cursor)
@@ -0,0 +1,10 @@
+"""
+@Time ： 2024-11-30
+@Auth ： Adam Lyu
+@Desc ： 订单行记录下单时的产品类别，类别销售汇总统一按该快照计入。
+"""
+from scripts.initialize_db import create_order_product_category
+
+
+def upgrade(cursor):
+    create_order_product_category(cursor)
@@ -0,0 +1,10 @@
+"""
+@Time ： 2024-11-30
+@Auth ： Adam Lyu
+@Desc ： 产品版本号，名称、价格或库存变化时递增；购物车汇总缓存按购物车中产品的版本号失效。
+"""
+from scripts.initialize_db import create_product_version
+
+
+def upgrade(cursor):
+    create_product_version(cursor)
@@ -0,0 +1,10 @@
+"""
+@Time ： 2024-11-30
+@Auth ： Adam Lyu
+@Desc ： 目录版本号触发器只在各 scope 依赖的列变化时递增；库存只在有货/缺货切换时影响分面。
+"""
+from scripts.initialize_db import create_scoped_catalog_triggers
+
+
+def upgrade(cursor):
+    create_scoped_catalog_triggers(cursor)
@@ -0,0 +1,10 @@
+"""
+@Time ： 2024-11-30
+@Auth ： Adam Lyu
+@Desc ： 搜索缓存版本号与近邻标记触发器只在依赖的列变化时执行；只改库存数量的更新不再使搜索缓存失效。
+"""
+from scripts.initialize_db import create_scoped_search_triggers
+
+
+def upgrade(cursor):
+    create_scoped_search_triggers(cursor)
@@ -0,0 +1,10 @@
+"""
+@Time ： 2024-12-01
+@Auth ： Adam Lyu
+@Desc ： 删除产品版本号及其触发器；购物车汇总缓存只按 cart.version 失效。
+"""
+from scripts.initialize_db import drop_product_version
+
+
+def upgrade(cursor):
+    drop_product_version(cursor)
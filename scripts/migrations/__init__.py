@@ -0,0 +1,118 @@
+"""
+@Time ： 2024-11-24
+@Auth ： Adam Lyu
+@Desc ： Versioned schema migrations.
+
+Each migration is a module in this package named `<4-digit version>_<description>.py` with an
+`upgrade(cursor)` function. `apply_migrations` runs the pending ones in version order, each in
+its own transaction together with its row in `schema_version`, so a database is always at a
+well-defined version. Migrations are applied once at startup (`scripts/main.setup_database`);
+the tools assume the resulting schema exists.
+
+Never edit a migration that has been released; add a new one instead.
+"""
+import importlib
+import os
+import re
+import sqlite3
+from typing import List, Tuple
+
+from utils.logger import logger
+
+MIGRATIONS_DIR = os.path.dirname(__file__)
+_MIGRATION_FILE = re.compile(r"^(\d{4})_(\w+)\.py$")
+
+
+def discover_migrations(migrations_dir: str = MIGRATIONS_DIR) -> List[Tuple[int, str]]:
+    """
+    List the migration modules in version order.
+
+    Args:
+        migrations_dir (str): Directory holding the migration modules.
+
+    Returns:
+        List[Tuple[int, str]]: (version, module name) pairs.
+
+    Raises:
+        ValueError: If two migrations share a version.
+    """
+    migrations = {}
+    for file_name in os.listdir(migrations_dir):
+        match = _MIGRATION_FILE.match(file_name)
+        if not match:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise ValueError(f"Duplicate migration version {version}: {migrations[version]} and {file_name}")
+        migrations[version] = file_name[:-3]
+    return sorted(migrations.items())
+
+
+def get_schema_version(cursor) -> int:
+    """
+    Read the version of the newest applied migration.
+
+    Args:
+        cursor: SQLite cursor.
+
+    Returns:
+        int: The schema version, 0 if no migration was applied.
+    """
+    try:
+        cursor.execute("SELECT MAX(version) FROM schema_version")
+    except sqlite3.OperationalError:
+        # 尚未执行过迁移
+        return 0
+    return cursor.fetchone()[0] or 0
+
+
+def apply_migrations(conn) -> List[int]:
+    """
+    Apply every pending migration to a database.
+
+    Each migration runs in its own transaction (a savepoint if the connection is already in one)
+    and is recorded in `schema_version`; a failing migration is rolled back and re-raised, leaving
+    the database at the previous version.
+
+    Args:
+        conn: SQLite database connection.
+
+    Returns:
+        List[int]: Versions of the migrations applied by this call.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY, -- 迁移版本号
+        name TEXT NOT NULL, -- 迁移模块名
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP -- 执行时间
+    );
+    """)
+
+    applied = []
+    for version, module_name in discover_migrations():
+        if version <= get_schema_version(cursor):
+            continue
+        module = importlib.import_module(f"{__name__}.{module_name}")
+
+        nested = conn.in_transaction
+        cursor.execute("SAVEPOINT migration" if nested else "BEGIN IMMEDIATE")
+        try:
+            # 加锁后再次检查，其他进程可能已执行该迁移
+            if version <= get_schema_version(cursor):
+                cursor.execute("RELEASE migration" if nested else "COMMIT")
+                continue
+            module.upgrade(cursor)
+            cursor.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (version, module_name))
+            cursor.execute("RELEASE migration" if nested else "COMMIT")
+        except Exception:
+            if nested:
+                cursor.execute("ROLLBACK TO migration")
+                cursor.execute("RELEASE migration")
+            else:
+                conn.rollback()
+            logger.error(f"Migration {module_name} failed.")
+            raise
+        applied.append(version)
+        logger.info(f"Applied migration {module_name}.")
+    return applied
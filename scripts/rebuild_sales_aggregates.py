@@ -0,0 +1,93 @@
+"""
+@Time ： 2024-11-28
+@Auth ： Adam Lyu
+"""
+import argparse
+import os
+import sqlite3
+
+from scripts.initialize_db import order_line_category
+
+
+def rebuild_sales_aggregates(cursor):
+    """
+    从 orders 与 order_products 全量重建销售汇总表（product_sales、user_product_purchases、
+    category_daily_sales）和用户订单汇总 user_order_summary。用于汇总表与订单不一致时的恢复；
+    日常由 order_events 上的触发器增量维护。
+    Args:
+        cursor: SQLite 游标对象
+    Returns:
+        int: 计入汇总的订单行数
+    """
+    for table in ("product_sales", "user_product_purchases", "category_daily_sales", "user_order_summary"):
+        cursor.execute(f"DELETE FROM {table}")
+
+    # 已取消的订单不计入销售；类别与增量触发器使用同一来源（下单时的类别快照）
+    category, products_join = order_line_category(cursor)
+    cursor.execute(f"""
+    CREATE TEMP TABLE sales_lines AS
+    SELECT o.user_id, op.product_id, {category} AS category, date(o.created_at) AS day, o.created_at,
+           op.quantity, op.quantity * op.price AS revenue
+    FROM order_products op
+    JOIN orders o ON o.id = op.order_id
+    {products_join}
+    WHERE o.status != 'Cancelled'
+    """)
+    try:
+        cursor.execute("""
+        INSERT INTO product_sales (product_id, units_sold, revenue)
+        SELECT product_id, SUM(quantity), SUM(revenue) FROM sales_lines GROUP BY product_id
+        """)
+        cursor.execute("""
+        INSERT INTO user_product_purchases (user_id, product_id, units, last_purchased_at)
+        SELECT user_id, product_id, SUM(quantity), MAX(created_at) FROM sales_lines GROUP BY user_id, product_id
+        """)
+        cursor.execute("""
+        INSERT INTO category_daily_sales (category, day, units, revenue)
+        SELECT category, day, SUM(quantity), SUM(revenue) FROM sales_lines
+        WHERE category IS NOT NULL GROUP BY category, day
+        """)
+        cursor.execute("SELECT COUNT(*) FROM sales_lines")
+        lines = cursor.fetchone()[0]
+    finally:
+        cursor.execute("DROP TABLE sales_lines")
+
+    cursor.execute("""
+    INSERT INTO user_order_summary (user_id, order_count, cancelled_count, total_spent, last_order_at)
+    SELECT user_id, COUNT(*), SUM(status = 'Cancelled'),
+           TOTAL(CASE WHEN status != 'Cancelled' THEN total_amount END), MAX(created_at)
+    FROM orders GROUP BY user_id
+    """)
+    return lines
+
+
+def build_sales_aggregates(db_path=None):
+    """
+    全量重建数据库中的销售汇总表。
+    Args:
+        db_path (str): 数据库文件路径，默认为 data/ecommerce.db
+    """
+    if not db_path:
+        data_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data"))
+        db_path = os.path.join(data_dir, "ecommerce.db")
+
+    connection = sqlite3.connect(db_path)
+    try:
+        count = rebuild_sales_aggregates(connection.cursor())
+        connection.commit()
+        print(f"Rebuilt sales aggregates from {count} order lines.")
+
+    except sqlite3.Error as e:
+        connection.rollback()
+        print(f"An error occurred while rebuilding sales aggregates: {e}")
+        raise
+
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the materialized sales aggregates from the orders.")
+    parser.add_argument("--db", default=None, help="SQLite database to rebuild (default: data/ecommerce.db).")
+    args = parser.parse_args()
+    build_sales_aggregates(args.db)
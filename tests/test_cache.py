@@ -0,0 +1,53 @@
+"""
+@Time ： 2024-11-23
+@Auth ： Adam Lyu
+"""
+import unittest
+from unittest import mock
+
+from utils.cache import LRUCache, estimate_size
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_version_and_ttl(self):
+        """Test entries stored under an older version or past their TTL are misses."""
+        cache = LRUCache(max_bytes=1024, ttl=10)
+        with mock.patch("utils.cache.time.monotonic", return_value=100.0):
+            cache.put("key", {"items": [1]}, version=1)
+            self.assertEqual(cache.get("key", version=1), {"items": [1]})
+            self.assertIsNone(cache.get("key", version=2), "A new version should invalidate the entry.")
+            cache.put("key", {"items": [2]}, version=2)
+        with mock.patch("utils.cache.time.monotonic", return_value=111.0):
+            self.assertIsNone(cache.get("key", version=2), "Expired entries should be misses.")
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 2)
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_memory_bound(self):
+        """Test the least recently used entries are evicted to stay within the byte budget."""
+        value = {"name": "x" * 100}
+        cache = LRUCache(max_bytes=3 * estimate_size(value))
+        for key in "abc":
+            cache.put(key, value)
+        cache.get("a")
+        cache.put("d", value)
+        self.assertIsNone(cache.get("b"), "The least recently used entry should be evicted.")
+        self.assertIsNotNone(cache.get("a"))
+        self.assertLessEqual(cache.stats()["bytes"], cache.max_bytes)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+        cache.put("huge", {"name": "x" * 1000})
+        self.assertIsNone(cache.get("huge"), "Values larger than the budget are not cached.")
+
+    def test_values_are_copied(self):
+        """Test callers cannot mutate cached values."""
+        cache = LRUCache(max_bytes=1024)
+        value = {"items": [1]}
+        cache.put("key", value)
+        value["items"].append(2)
+        cache.get("key")["items"].append(3)
+        self.assertEqual(cache.get("key"), {"items": [1]})
+
+
+if __name__ == "__main__":
+    unittest.main()
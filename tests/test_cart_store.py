@@ -0,0 +1,122 @@
+"""
+@Time ： 2024-11-25
+@Auth ： Adam Lyu
+"""
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from scripts.initialize_db import create_tables
+from tests.test_database import populate_test_data
+from tools import cart_tools, order_tools
+from tools.cart_store import WriteBackCartStore
+
+
+class TestWriteBackCartStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "carts.db")
+        self.journal_path = os.path.join(self.tmp_dir.name, "carts.journal")
+        conn = sqlite3.connect(self.db_path)
+        create_tables(conn.cursor())
+        populate_test_data(conn)
+        conn.close()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def stored_cart(self, user_id):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return dict(conn.execute("""
+            SELECT cp.product_id, cp.quantity FROM cart_products cp JOIN cart c ON c.id = cp.cart_id
+            WHERE c.user_id = ?
+            """, (user_id,)).fetchall())
+        finally:
+            conn.close()
+
+    def test_write_back(self):
+        """Test mutations stay in memory until a flush writes all dirty carts in one transaction."""
+        store = WriteBackCartStore(self.db_path, flush_interval=None)
+        self.assertEqual(store.update(1, {1: -2, 3: 4}), [1])
+        store.update(2, {4: 1})
+        self.assertTrue(store.remove(1, 2))
+        self.assertFalse(store.remove(1, 2))
+        self.assertEqual(store.scale(1, 2), 1)
+        self.assertEqual(store.items(1), {3: 8})
+        self.assertEqual(self.stored_cart(1), {1: 2, 2: 1}, "Nothing should be written before a flush.")
+
+        self.assertEqual(store.flush(), 2)
+        self.assertEqual(self.stored_cart(1), {3: 8})
+        self.assertEqual(self.stored_cart(2), {4: 1})
+        self.assertEqual(store.flush(), 0, "Clean carts should not be written again.")
+        store.close()
+
+    def test_idle_carts_evicted_after_write(self):
+        """Test idle carts are only evicted once written, so no change is lost while a flush runs."""
+        store = WriteBackCartStore(self.db_path, flush_interval=None, max_idle=0)
+        write_carts = store._write_carts
+        store.update(1, {3: 1})
+        with mock.patch.object(store, "_write_carts", side_effect=sqlite3.OperationalError("database is locked")):
+            with self.assertRaises(sqlite3.OperationalError):
+                store.flush()
+        self.assertEqual(store.flush(), 1, "A failed flush should be retried with the cart still in memory.")
+        self.assertEqual(self.stored_cart(1), {1: 2, 2: 1, 3: 1})
+
+        def write_while_user_edits(carts):
+            # 写入进行中用户再次修改购物车
+            store.update(1, {4: 1})
+            write_carts(carts)
+
+        store.update(1, {3: 1})
+        with mock.patch.object(store, "_write_carts", side_effect=write_while_user_edits):
+            store.flush()
+        store.flush()
+        self.assertEqual(self.stored_cart(1), {1: 2, 2: 1, 3: 2, 4: 1})
+        store.close()
+
+    def test_journal_recovery(self):
+        """Test unflushed mutations are replayed from the journal after a crash."""
+        store = WriteBackCartStore(self.db_path, flush_interval=None, journal_path=self.journal_path)
+        store.update(1, {3: 2})
+        store.flush()
+        store.update(1, {1: -2, 4: 1})
+        with open(self.journal_path, "a", encoding="utf-8") as journal:
+            journal.write('{"user_id": 1, "quant')  # 崩溃时写了一半的记录
+        # 模拟崩溃：不调用 close，直接由新的实例接管
+        self.assertEqual(self.stored_cart(1), {1: 2, 2: 1, 3: 2})
+
+        recovered = WriteBackCartStore(self.db_path, flush_interval=None, journal_path=self.journal_path)
+        self.assertEqual(self.stored_cart(1), {2: 1, 3: 2, 4: 1})
+        self.assertEqual(recovered.items(1), {2: 1, 3: 2, 4: 1})
+        recovered.close()
+        self.assertFalse(os.path.exists(self.journal_path))
+
+    def test_cart_tools_use_store(self):
+        """Test the cart tools are served by the store and checkout flushes the cart first."""
+        store = WriteBackCartStore(self.db_path, flush_interval=None)
+        with mock.patch.object(cart_tools, "db", self.db_path), mock.patch.object(order_tools, "db", self.db_path), \
+                mock.patch.object(cart_tools, "_cart_store", store):
+            self.assertEqual(cart_tools.add_to_cart(1, 3, 1), "Product 3 successfully added to your cart.")
+            self.assertEqual(cart_tools.update_cart_items(1, [(2, -1)]), "Cart updated: 1 products changed, 1 removed.")
+            summary = cart_tools.view_cart(1)
+            self.assertEqual([item["id"] for item in summary["items"]], [1, 3])
+            self.assertEqual(summary["grand_total"], 35.0)
+            self.assertEqual(self.stored_cart(1), {1: 2, 2: 1}, "Cart tools should not write through.")
+
+            self.assertEqual(cart_tools.remove_cart_items_matching(1, category="Category 2"),
+                             "Products 3 successfully removed from your cart.")
+            self.assertEqual(cart_tools.view_cart(1)["grand_total"], 20.0)
+
+            cart_tools.add_to_cart(1, 4, 1)
+            result = order_tools.checkout_order(1, "789 Test Street", "PayPal")
+            self.assertIn("Total amount: $45.00", result)
+            self.assertEqual(cart_tools.view_cart(1)["items"], [], "The checked-out cart should be reloaded.")
+        store.close()
+        self.assertEqual(self.stored_cart(1), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
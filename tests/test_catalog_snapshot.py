@@ -0,0 +1,152 @@
+"""
+@Time ： 2024-11-21
+@Auth ： Adam Lyu
+"""
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from scripts.initialize_db import create_tables
+from tests.test_database import populate_test_data
+from tools.catalog_snapshot import CatalogSnapshot, get_snapshot, np, refresh_snapshot
+from tools.product_tools import search_products_page
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestCatalogSnapshot(unittest.TestCase):
+    def setUp(self):
+        """Create a file-backed database and an empty snapshot directory."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.snapshot_dir = os.path.join(self.tmp_dir.name, "snapshot")
+        self.conn = sqlite3.connect(os.path.join(self.tmp_dir.name, "catalog.db"))
+        create_tables(self.conn.cursor())
+        populate_test_data(self.conn)
+        self.conn.executemany("""
+        INSERT INTO products (name, description, price, stock, category) VALUES (?, '', ?, ?, ?)
+        """, [(f"Gadget {i}", 5.0 + i % 7, i % 3, f"Category {1 + i % 3}") for i in range(50)])
+        self.conn.commit()
+        os.environ["CATALOG_SNAPSHOT_DIR"] = self.snapshot_dir
+
+    def tearDown(self):
+        os.environ.pop("CATALOG_SNAPSHOT_DIR", None)
+        self.conn.close()
+        self.tmp_dir.cleanup()
+
+    def search_all(self, engine, **kwargs):
+        """Collect every page of a search."""
+        items, cursor = [], None
+        while True:
+            page = search_products_page(cursor=cursor, page_size=4, engine=engine, conn=self.conn, **kwargs)
+            items.extend(page["items"])
+            cursor = page["next_cursor"]
+            if not cursor:
+                return items
+
+    def test_matches_sql_engine(self):
+        """Test snapshot searches return the same pages as SQL for filters ordered by price."""
+        for kwargs in (dict(), dict(category="Category 2"), dict(price_range="6-9"),
+                       dict(category="Category 1", price_range="5-10", fields=["name", "description"])):
+            with self.subTest(**kwargs):
+                self.assertEqual(self.search_all("snapshot", **kwargs), self.search_all("sql", **kwargs))
+
+    def test_name_substring(self):
+        """Test name filtering is a case-insensitive substring match."""
+        names = {item["name"] for item in self.search_all("snapshot", name="PRODUCT")}
+        self.assertEqual(names, {"Product A", "Product B", "Product C", "Product D"})
+        self.assertEqual(self.search_all("snapshot", name="t aG"), [], "Matches must not span two names.")
+
+    def test_incremental_refresh(self):
+        """Test only changed products are re-read and the new generation is published atomically."""
+        first = get_snapshot(self.conn)
+        self.assertEqual(len(first), 54)
+
+        self.conn.execute("UPDATE products SET price = 1.0, name = 'Cheapest' WHERE id = 4")
+        self.conn.execute("DELETE FROM products WHERE id = 5")
+        self.conn.execute("INSERT INTO products (name, price, stock, category) VALUES ('Brand New', 2.0, 1, 'New')")
+        self.conn.commit()
+
+        second = get_snapshot(self.conn)
+        self.assertNotEqual(first.directory, second.directory)
+        self.assertEqual(len(second), 54)
+        self.assertEqual(second.seq, CatalogSnapshot.load(self.snapshot_dir).seq)
+        page = search_products_page(page_size=2, engine="snapshot", conn=self.conn)
+        self.assertEqual([item["name"] for item in page["items"]], ["Cheapest", "Brand New"])
+        self.assertEqual(self.search_all("snapshot", category="New")[0]["category"], "New")
+
+        cursor = self.conn.execute("SELECT COUNT(*) FROM product_changes")
+        self.assertEqual(cursor.fetchone()[0], 0, "Applied changes should be pruned.")
+        self.assertIs(get_snapshot(self.conn), second, "An unchanged catalog should reuse the mapped snapshot.")
+
+    def test_price_and_stock_patched_in_place(self):
+        """Test price and stock changes are written into the mapped generation without publishing a new one."""
+        first = get_snapshot(self.conn)
+        generations = sorted(os.listdir(self.snapshot_dir))
+
+        self.conn.execute("UPDATE products SET price = 1.0, stock = 7 WHERE id = 2")
+        self.conn.commit()
+        second = get_snapshot(self.conn)
+        self.assertEqual(second.directory, first.directory)
+        self.assertEqual(sorted(os.listdir(self.snapshot_dir)), generations)
+        self.assertEqual(CatalogSnapshot.load(self.snapshot_dir).seq, second.seq)
+        self.assertEqual(first.rows([list(first.ids).index(2)], ["price", "stock"]), [{"price": 1.0, "stock": 7}],
+                         "Mapped readers should see the patch through the page cache.")
+        page = search_products_page(page_size=1, engine="snapshot", conn=self.conn)
+        self.assertEqual(page["items"][0]["name"], "Product B")
+        self.assertEqual(self.search_all("snapshot"), self.search_all("sql"))
+
+        self.conn.execute("UPDATE products SET name = 'Renamed' WHERE id = 2")
+        self.conn.commit()
+        self.assertNotEqual(get_snapshot(self.conn).directory, first.directory, "A rename needs a new generation.")
+
+    def test_change_log_needs_consumer(self):
+        """Test product updates are only logged once a snapshot consumes the log."""
+        self.conn.execute("UPDATE products SET stock = stock - 1 WHERE id = 1")
+        self.conn.commit()
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM product_changes").fetchone()[0], 0)
+
+        refresh_snapshot(self.conn, self.snapshot_dir)
+        self.conn.execute("UPDATE products SET stock = stock - 1 WHERE id = 1")
+        self.conn.commit()
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM product_changes").fetchone()[0], 1)
+        snapshot = refresh_snapshot(self.conn, self.snapshot_dir)
+        self.assertEqual(int(snapshot.stocks[list(snapshot.ids).index(1)]), 98)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM product_changes").fetchone()[0], 0)
+
+    def test_refresh_leaves_caller_transaction(self):
+        """Test refreshing never commits the caller's open transaction."""
+        self.conn.execute("UPDATE products SET name = 'Uncommitted' WHERE id = 1")
+        refresh_snapshot(self.conn, self.snapshot_dir)
+        self.assertTrue(self.conn.in_transaction)
+        self.conn.rollback()
+        self.assertEqual(self.conn.execute("SELECT name FROM products WHERE id = 1").fetchone()[0], "Product A")
+
+    def test_databases_sharing_a_directory(self):
+        """Test two databases using the same snapshot directory never see each other's catalog."""
+        other = sqlite3.connect(os.path.join(self.tmp_dir.name, "other.db"))
+        try:
+            create_tables(other.cursor())
+            populate_test_data(other)
+            self.assertEqual(len(get_snapshot(self.conn)), 54)
+            self.assertEqual(len(get_snapshot(other)), 4)
+            self.conn.execute("UPDATE products SET name = 'Renamed' WHERE id = 1")
+            self.conn.commit()
+            self.assertEqual(get_snapshot(self.conn).rows([list(get_snapshot(self.conn).ids).index(1)], ["name"]),
+                             [{"name": "Renamed"}])
+            snapshot = get_snapshot(other)
+            self.assertEqual(len(snapshot), 4)
+            self.assertEqual(snapshot.rows([list(snapshot.ids).index(1)], ["name"]), [{"name": "Product A"}])
+        finally:
+            other.close()
+
+    def test_full_rebuild_after_many_changes(self):
+        """Test a full export is used when most of the catalog changed."""
+        refresh_snapshot(self.conn, self.snapshot_dir)
+        self.conn.execute("UPDATE products SET stock = stock + 1")
+        self.conn.commit()
+        snapshot = refresh_snapshot(self.conn, self.snapshot_dir)
+        self.assertEqual(int(snapshot.stocks[list(snapshot.ids).index(1)]), 101)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,19 +2,41 @@
 @Time ： 2024-11-16
 @Auth ： Adam Lyu
 """
+import os
+import tempfile
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 import sqlite3
 from pprint import pprint
 from scripts.initialize_db import create_tables
-from tools.cart_tools import view_cart, add_to_cart, remove_from_cart
+from scripts.build_product_neighbors import rebuild_product_neighbors, refresh_product_neighbors
+from scripts.rebuild_sales_aggregates import rebuild_sales_aggregates
+from tools.cart_tools import (view_cart, add_to_cart, remove_from_cart, update_cart_items, scale_cart_quantities,
+                              remove_cart_items_matching, get_cart_cache_stats)
 from tools.order_tools import (
     checkout_order,
     search_orders,
     update_delivery_address,
     cancel_order,
-    get_recent_orders
+    get_recent_orders,
+    get_order_history,
+    get_order_cache_stats,
+    get_order_events,
+    get_user_order_summary
 )
-from tools.product_tools import list_categories, search_and_recommend_products
+from tools.product_tools import (
+    check_products_stock,
+    list_categories,
+    list_category_summaries,
+    get_product_facets,
+    get_search_cache_stats,
+    search_and_recommend_products,
+    SUMMARY_FIELDS
+)
+from tools.sales_tools import get_top_products, get_purchase_history, get_category_sales
+from tools import fuzzy_index
+from tools.tfidf_index import get_index, np
 
 
 def populate_test_data(conn):
@@ -101,7 +123,19 @@ class TestEcommerceSystem(unittest.TestCase):
         """Test viewing the cart."""
         result = view_cart(1, conn=self.conn)
         pprint(result)
-        self.assertTrue(len(result) > 0, "Cart should not be empty.")
+        self.assertTrue(len(result["items"]) > 0, "Cart should not be empty.")
+        self.assertEqual(result["items"][0]["subtotal"], 20.0)
+        self.assertEqual(result["item_count"], 3)
+        self.assertEqual(result["grand_total"], 40.0)
+        self.assertFalse(result["out_of_stock"])
+
+        self.conn.execute("UPDATE products SET stock = 1 WHERE id = 1")
+        self.conn.commit()
+        result = view_cart(1, conn=self.conn)
+        self.assertEqual([item["out_of_stock"] for item in result["items"]], [True, False])
+        self.assertTrue(result["out_of_stock"])
+        self.assertEqual(view_cart(2, conn=self.conn),
+                         {"items": [], "item_count": 0, "grand_total": 0, "out_of_stock": False})
 
     def test_add_to_cart(self):
         """Test adding an item to the cart."""
@@ -109,20 +143,145 @@ class TestEcommerceSystem(unittest.TestCase):
         self.assertEqual(result, "Product 3 successfully added to your cart.", "Product should be added successfully.")
         cart = view_cart(1, conn=self.conn)
         # Update field to match 'id' instead of 'product_id'
-        self.assertTrue(any(item["id"] == 3 for item in cart), "Product C should be in the cart.")
+        self.assertTrue(any(item["id"] == 3 for item in cart["items"]), "Product C should be in the cart.")
 
     def test_remove_from_cart(self):
         """Test removing an item from the cart."""
         result = remove_from_cart(1, 1, conn=self.conn)  # Remove Product A
         self.assertEqual(result, "Product removed from cart.", "Product should be removed successfully.")
         cart = view_cart(1, conn=self.conn)
-        self.assertFalse(any(item["product_id"] == 1 for item in cart), "Product A should not be in the cart.")
+        self.assertFalse(any(item["id"] == 1 for item in cart["items"]), "Product A should not be in the cart.")
+
+    def test_update_cart_items(self):
+        """Test applying several quantity deltas in one transaction."""
+        result = update_cart_items(1, [(1, -2), {"product_id": 2, "quantity": 3}, (3, 1), (3, 1)], conn=self.conn)
+        self.assertEqual(result, "Cart updated: 3 products changed, 1 removed.")
+        cart = {item["id"]: item["quantity"] for item in view_cart(1, conn=self.conn)["items"]}
+        self.assertEqual(cart, {2: 4, 3: 2}, "Product A should be removed and the deltas summed.")
+
+        # 任一产品不存在时整批不生效
+        result = update_cart_items(1, [(2, 1), (999, 1)], conn=self.conn)
+        self.assertIn("999", result)
+        cart = {item["id"]: item["quantity"] for item in view_cart(1, conn=self.conn)["items"]}
+        self.assertEqual(cart, {2: 4, 3: 2})
+        with self.assertRaises(ValueError):
+            update_cart_items(1, [("2", 1)], conn=self.conn)
+
+    def test_set_based_cart_operations(self):
+        """Test scaling the cart and removing products by category or name."""
+        self.assertEqual(scale_cart_quantities(1, 2, conn=self.conn),
+                         "Quantities of 2 products in your cart multiplied by 2.")
+        cart = {item["id"]: item["quantity"] for item in view_cart(1, conn=self.conn)["items"]}
+        self.assertEqual(cart, {1: 4, 2: 2})
+
+        self.assertEqual(remove_cart_items_matching(1, name="b", conn=self.conn),
+                         "Products 2 successfully removed from your cart.")
+        self.assertEqual(remove_cart_items_matching(1, category="category 2", conn=self.conn),
+                         "No products in your cart match.")
+        self.assertEqual(remove_cart_items_matching(1, category="Category 1", name="%", conn=self.conn),
+                         "No products in your cart match.", "LIKE wildcards should match literally.")
+        self.assertEqual(remove_cart_items_matching(1, category="Category 1", conn=self.conn),
+                         "Products 1 successfully removed from your cart.")
+        self.assertEqual(view_cart(1, conn=self.conn)["items"], [])
+        self.assertEqual(scale_cart_quantities(1, 3, conn=self.conn), "Your cart is empty.")
+
+    def test_cart_summary_cache(self):
+        """Test the cart summary is cached until the cart changes."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            conn = sqlite3.connect(os.path.join(tmp_dir, "cart.db"))
+            try:
+                create_tables(conn.cursor())
+                populate_test_data(conn)
+
+                def hits():
+                    return get_cart_cache_stats()["hits"]
+
+                first = view_cart(1, conn=conn)
+                before = hits()
+                self.assertEqual(view_cart(1, conn=conn), first)
+                self.assertEqual(hits(), before + 1, "An unchanged cart should be served from the cache.")
+
+                add_to_cart(1, 3, 1, conn=conn)
+                self.assertEqual(view_cart(1, conn=conn)["grand_total"], 55.0)
+                remove_from_cart(1, 3, conn=conn)
+                self.assertEqual(view_cart(1, conn=conn)["grand_total"], 40.0)
+                self.assertEqual(hits(), before + 1, "Every change to the cart should invalidate the summary.")
+                conn.execute("UPDATE products SET stock = stock - 1, price = 12.5 WHERE id = 1")
+                conn.commit()
+                self.assertEqual(view_cart(1, conn=conn)["grand_total"], 40.0)
+                self.assertEqual(hits(), before + 2, "Catalog changes should keep the summary until the cart changes.")
+                remove_from_cart(1, 2, conn=conn)
+                self.assertEqual(view_cart(1, conn=conn)["grand_total"], 25.0, "Prices are re-read with the cart.")
+                checkout_order(1, "789 Test Street", "PayPal", conn=conn)
+                self.assertEqual(view_cart(1, conn=conn)["items"], [])
+                self.assertEqual(hits(), before + 2, "Every change to the cart should invalidate the summary.")
+            finally:
+                conn.close()
 
     def test_checkout_order(self):
         """Test checkout process."""
         result = checkout_order(1, "789 Test Street", "PayPal", conn=self.conn)
         print(result)
         self.assertIn("Checkout successful", result, "Checkout should be successful.")
+        stock = dict(self.conn.execute("SELECT id, stock FROM products WHERE id IN (1, 2)").fetchall())
+        self.assertEqual(stock, {1: 98, 2: 49}, "Stock should be decremented exactly once.")
+
+    def test_checkout_insufficient_stock(self):
+        """Test a shortfall rolls the whole checkout back."""
+        self.conn.execute("UPDATE products SET stock = 0 WHERE id = 2")
+        self.conn.commit()
+        result = checkout_order(1, "789 Test Street", "PayPal", conn=self.conn)
+        self.assertIn("Product ID 2 only has 0 in stock (requested 1).", result)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0], 1)
+        self.assertEqual(self.conn.execute("SELECT stock FROM products WHERE id = 1").fetchone()[0], 100)
+        self.assertEqual(len(view_cart(1, conn=self.conn)["items"]), 2, "The cart should be kept.")
+
+    def test_checkout_idempotency(self):
+        """Test a replayed idempotency key returns the original result without a second order."""
+        first = checkout_order(1, "789 Test Street", "PayPal", conn=self.conn, idempotency_key="checkout-1")
+        self.assertIn("Checkout successful", first)
+        add_to_cart(1, 3, 1, conn=self.conn)
+        replay = checkout_order(1, "789 Test Street", "PayPal", conn=self.conn, idempotency_key="checkout-1")
+        self.assertEqual(replay, first)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0], 2)
+        self.assertEqual(self.conn.execute("SELECT stock FROM products WHERE id = 3").fetchone()[0], 30)
+        self.assertEqual(len(view_cart(1, conn=self.conn)["items"]), 1, "A replay must not touch the cart.")
+
+        # 过期的键被清理，同一个键重新结账
+        self.conn.execute("UPDATE checkout_idempotency SET created_at = datetime('now', '-2 days')")
+        self.conn.commit()
+        result = checkout_order(1, "789 Test Street", "PayPal", conn=self.conn, idempotency_key="checkout-1")
+        self.assertNotEqual(result, first)
+        self.assertIn("Total amount: $15.00", result)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM checkout_idempotency").fetchone()[0], 1)
+
+    def test_concurrent_checkouts(self):
+        """Test concurrent checkouts never oversell."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, "checkout.db")
+            conn = sqlite3.connect(db_path)
+            create_tables(conn.cursor())
+            conn.execute("INSERT INTO products (name, price, stock, category) VALUES ('Scarce', 5.0, 7, 'C')")
+            for user_id in range(1, 21):
+                add_to_cart(user_id, 1, 1, conn=conn)
+            conn.close()
+
+            def checkout(user_id):
+                worker = sqlite3.connect(db_path, timeout=30)
+                try:
+                    return checkout_order(user_id, "Address", "PayPal", conn=worker)
+                finally:
+                    worker.close()
+
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                results = list(pool.map(checkout, range(1, 21)))
+            conn = sqlite3.connect(db_path)
+            try:
+                self.assertEqual(sum("Checkout successful" in result for result in results), 7)
+                self.assertEqual(conn.execute("SELECT stock FROM products").fetchone()[0], 0)
+                self.assertEqual(conn.execute("SELECT COUNT(*) FROM order_products").fetchone()[0], 7)
+            finally:
+                conn.close()
 
     def test_search_orders(self):
         """Test searching orders."""
@@ -130,6 +289,112 @@ class TestEcommerceSystem(unittest.TestCase):
         pprint(result)
         self.assertTrue(len(result) > 0, "There should be at least one order.")
 
+    def test_search_orders_cache(self):
+        """Test order details are cached until the order is changed."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            conn = sqlite3.connect(os.path.join(tmp_dir, "orders.db"))
+            try:
+                create_tables(conn.cursor())
+                populate_test_data(conn)
+
+                def hits():
+                    return get_order_cache_stats()["hits"]
+
+                first = search_orders(1, conn=conn)
+                self.assertIn("Product A|2|$10.00", first)
+                before = hits()
+                self.assertEqual(search_orders(1, conn=conn), first)
+                self.assertEqual(hits(), before + 1, "An unchanged order should be served from the cache.")
+
+                update_delivery_address(1, "456 New Address", conn=conn)
+                self.assertIn("Delivery Address: 456 New Address", search_orders(1, conn=conn))
+                cancel_order(1, "Changed my mind.", conn=conn)
+                self.assertIn("Status: Cancelled", search_orders(1, conn=conn))
+                self.assertEqual(hits(), before + 1, "Changes should invalidate the cached order.")
+                self.assertEqual(search_orders(99, conn=conn), "No order found with ID 99.")
+            finally:
+                conn.close()
+
+    def test_order_events(self):
+        """Test order changes are appended as events and projected onto orders and the user summary."""
+        result = checkout_order(1, "789 Test Street", "PayPal", conn=self.conn)
+        order_id = int(result.split("order ID is ")[1].split(".")[0])
+        update_delivery_address(order_id, "456 New Address", conn=self.conn)
+        cancel_order(order_id, "Changed my mind.", conn=self.conn)
+        self.assertEqual(cancel_order(order_id, "Again.", conn=self.conn),
+                         f"Cannot cancel order {order_id} with status: Cancelled.")
+
+        events = get_order_events(order_id, conn=self.conn)
+        self.assertEqual([(event["Event"], event["Details"]) for event in events], [
+            ("created", {"total_amount": 40.0}),
+            ("address_changed", {"delivery_address": "456 New Address"}),
+            ("cancelled", {"reason": "Changed my mind."}),
+        ])
+        row = self.conn.execute("SELECT status, delivery_address, cancellation_reason FROM orders WHERE id = ?",
+                                (order_id,)).fetchone()
+        self.assertEqual(row, ("Cancelled", "456 New Address", "Changed my mind."))
+
+        summary = get_user_order_summary(1, conn=self.conn)
+        self.assertEqual((summary["order_count"], summary["cancelled_count"], summary["total_spent"]), (1, 1, 0))
+        self.assertEqual(get_user_order_summary(2, conn=self.conn)["order_count"], 0)
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.conn.execute("DELETE FROM order_events")
+        self.conn.rollback()
+
+    def sales_aggregates(self):
+        return [self.conn.execute(f"SELECT * FROM {table} ORDER BY 1, 2").fetchall()
+                for table in ("product_sales", "user_product_purchases", "category_daily_sales", "user_order_summary")]
+
+    def test_sales_aggregates(self):
+        """Test checkout and cancellation update the sales aggregates in their transactions, matching a rebuild."""
+        rebuild_sales_aggregates(self.conn.cursor())
+        self.conn.commit()
+        self.assertEqual([(p["id"], p["units_sold"], p["revenue"]) for p in get_top_products(conn=self.conn)],
+                         [(1, 2, 20.0), (2, 1, 20.0)])
+
+        result = checkout_order(1, "789 Test Street", "PayPal", conn=self.conn)
+        order_id = int(result.split("order ID is ")[1].split(".")[0])
+        self.assertEqual([(p["id"], p["units_sold"], p["revenue"]) for p in get_top_products(conn=self.conn)],
+                         [(1, 4, 40.0), (2, 2, 40.0)])
+        self.assertEqual(get_top_products("Category 2", conn=self.conn), [])
+        self.assertEqual([(p["id"], p["units"]) for p in get_purchase_history(1, conn=self.conn)], [(1, 4), (2, 2)])
+        sales = get_category_sales(conn=self.conn)
+        self.assertEqual([(s["category"], s["units"], s["revenue"]) for s in sales], [("Category 1", 6, 80.0)])
+        self.assertEqual(self.sales_aggregates(), self.sales_aggregates_after_rebuild())
+
+        cancel_order(order_id, "Changed my mind.", conn=self.conn)
+        cancel_order(1, "Changed my mind.", conn=self.conn)
+        self.assertEqual(get_top_products(conn=self.conn), [])
+        self.assertEqual(get_purchase_history(1, conn=self.conn), [])
+        self.assertEqual(get_category_sales(conn=self.conn), [])
+        self.assertEqual(self.sales_aggregates(), self.sales_aggregates_after_rebuild())
+
+    def test_sales_aggregates_recategorized_product(self):
+        """Test a product moved to another category after checkout is cancelled from its checkout category."""
+        rebuild_sales_aggregates(self.conn.cursor())
+        self.conn.commit()
+        result = checkout_order(1, "789 Test Street", "PayPal", conn=self.conn)
+        order_id = int(result.split("order ID is ")[1].split(".")[0])
+        self.conn.execute("UPDATE products SET category = 'Category 2' WHERE id IN (1, 2)")
+        self.conn.commit()
+        self.assertEqual(self.sales_aggregates(), self.sales_aggregates_after_rebuild())
+
+        cancel_order(order_id, "Changed my mind.", conn=self.conn)
+        sales = get_category_sales(conn=self.conn)
+        self.assertEqual([(s["category"], s["units"], s["revenue"]) for s in sales], [("Category 1", 3, 40.0)])
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM category_daily_sales WHERE units < 0").fetchone()[0],
+                         0)
+        self.assertEqual(self.sales_aggregates(), self.sales_aggregates_after_rebuild())
+
+    def sales_aggregates_after_rebuild(self):
+        incremental = self.sales_aggregates()
+        rebuild_sales_aggregates(self.conn.cursor())
+        rebuilt = self.sales_aggregates()
+        self.conn.rollback()
+        self.assertEqual(self.sales_aggregates(), incremental)
+        return rebuilt
+
     def test_update_delivery_address(self):
         """Test updating the delivery address."""
         result = update_delivery_address(1, "456 New Address", conn=self.conn)
@@ -140,24 +405,453 @@ class TestEcommerceSystem(unittest.TestCase):
         result = cancel_order(1, "Changed my mind.", conn=self.conn)
         self.assertEqual(result, "Order cancelled successfully.", "Order should be cancelled.")
 
+    def test_cancel_order_restocks_once(self):
+        """Test cancelling restores stock in the same transaction, and only for cancellable orders."""
+        result = cancel_order(1, "Changed my mind.", conn=self.conn)
+        self.assertIn("has been cancelled successfully", result)
+        self.assertFalse(self.conn.in_transaction)
+        stock = dict(self.conn.execute("SELECT id, stock FROM products WHERE id IN (1, 2)").fetchall())
+        self.assertEqual(stock, {1: 102, 2: 51})
+
+        self.assertEqual(cancel_order(1, "Again.", conn=self.conn), "Cannot cancel order 1 with status: Cancelled.")
+        self.conn.execute("UPDATE orders SET status = 'Shipped' WHERE id = 1")
+        self.conn.commit()
+        self.assertEqual(cancel_order(1, "Late.", conn=self.conn), "Cannot cancel order 1 with status: Shipped.")
+        self.assertEqual(cancel_order(99, "Missing.", conn=self.conn), "No order found with ID 99.")
+        stock = dict(self.conn.execute("SELECT id, stock FROM products WHERE id IN (1, 2)").fetchall())
+        self.assertEqual(stock, {1: 102, 2: 51}, "Stock must not be restored twice.")
+
     def test_get_recent_orders(self):
         """Test retrieving recent orders."""
         result = get_recent_orders(1, 30, conn=self.conn)
         pprint(result)
         self.assertTrue(len(result) > 0, "There should be recent orders.")
 
+    def test_order_history(self):
+        """Test keyset pagination of the order history and embedded line items."""
+        self.conn.executemany("""
+        INSERT INTO orders (user_id, total_amount, delivery_address, payment_method, created_at)
+        VALUES (1, ?, 'Address', 'PayPal', ?)
+        """, [(15.0, "2024-11-20 10:00:00"), (25.0, "2024-11-20 10:00:00"), (5.0, "2020-01-01 00:00:00")])
+        self.conn.execute("INSERT INTO order_products (order_id, product_id, quantity, price) VALUES (3, 3, 1, 15.0)")
+        self.conn.execute("UPDATE orders SET created_at = '2024-11-21 09:00:00' WHERE id = 1")
+        self.conn.commit()
+
+        ids, cursor = [], None
+        while True:
+            page = get_order_history(1, cursor=cursor, page_size=2, conn=self.conn)
+            ids.extend(order["Order ID"] for order in page["orders"])
+            self.assertNotIn("Products", page["orders"][0])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(ids, [1, 3, 2, 4], "Orders should be newest first, ties broken by ID.")
+
+        page = get_order_history(1, page_size=3, include_items=True, conn=self.conn)
+        products = {order["Order ID"]: order["Products"] for order in page["orders"]}
+        self.assertEqual([item["Name"] for item in products[1]], ["Product A", "Product B"])
+        self.assertEqual(products[3], [{"Product ID": 3, "Name": "Product C", "Quantity": 1, "Price": "$15.00"}])
+        self.assertEqual(products[2], [], "Orders without products should have an empty list.")
+
+        self.assertEqual(get_order_history(1, days=7, conn=self.conn)["orders"], [])
+        self.assertEqual(get_order_history(2, conn=self.conn), {"orders": [], "next_cursor": None})
+        with self.assertRaises(ValueError):
+            get_order_history(1, cursor="not-a-cursor", conn=self.conn)
+
     def test_list_categories(self):
         """Test listing product categories."""
         result = list_categories(conn=self.conn)
         pprint(result)
         self.assertTrue(len(result) > 0, "There should be categories listed.")
 
+    def test_check_products_stock(self):
+        """Test checking stock for many products in one call."""
+        result = check_products_stock([3, 1, 3, 999], conn=self.conn)
+        self.assertEqual([(item["id"], item["stock"]) for item in result], [(1, 100), (3, 30)])
+
+        self.conn.executemany("INSERT INTO products (name, price, stock, category) VALUES (?, 1.0, 1, 'Bulk')",
+                              [(f"Bulk {i}",) for i in range(5000)])
+        result = check_products_stock(list(range(1, 5005)), conn=self.conn)
+        self.assertEqual(len(result), 5004, "Thousands of IDs should be resolved in one call.")
+
+    def test_list_categories_cache(self):
+        """Test the category cache is reused until the products table changes."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            conn = sqlite3.connect(os.path.join(tmp_dir, "catalog.db"))
+            try:
+                create_tables(conn.cursor())
+                populate_test_data(conn)
+
+                summaries = list_category_summaries(conn=conn)
+                self.assertEqual(summaries[0], {"category": "Category 1", "product_count": 2,
+                                                "min_price": 10.0, "max_price": 20.0})
+
+                # 绕过触发器修改数据，缓存应当继续命中
+                conn.execute("DROP TRIGGER catalog_version_categories_au")
+                conn.execute("UPDATE products SET category = 'Hidden' WHERE id = 4")
+                conn.commit()
+                self.assertIn("Category 3", list_categories(conn=conn), "Unchanged version should hit the cache.")
+
+                conn.execute("INSERT INTO products (name, price, stock, category) VALUES ('Product E', 5.0, 1, 'Category 4')")
+                conn.commit()
+                categories = list_categories(conn=conn)
+                self.assertIn("Category 4", categories, "Inserts should invalidate the cache.")
+                self.assertNotIn("Category 3", categories)
+            finally:
+                conn.close()
+
     def test_search_and_recommend_products(self):
         """Test searching and recommending products."""
         result = search_and_recommend_products(name="Product", category="Category 1", price_range="10-30", conn=self.conn)
         pprint(result)
         self.assertTrue(len(result) > 0, "There should be at least one recommended product.")
 
+    def test_search_products_full_text(self):
+        """Test full-text search ranks name matches first and stays in sync with product updates."""
+        cursor = self.conn.cursor()
+        cursor.execute("""
+        INSERT INTO products (name, description, price, stock, category)
+        VALUES ('Blue Widget', 'Pairs well with any Product', 12.0, 5, 'Category 1')
+        """)
+        cursor.execute("UPDATE products SET name = 'Gadget A' WHERE id = 1")
+        self.conn.commit()
+
+        result = search_and_recommend_products(name="product", conn=self.conn)
+        names = [item["name"] for item in result["search_results"]]
+        self.assertEqual(names[:3], ["Product B", "Product C", "Product D"], "Name matches should rank first.")
+        self.assertIn("Blue Widget", names, "Description matches should be included.")
+        self.assertNotIn("Gadget A", names, "Renamed products should leave the index.")
+
+    def test_search_products_name_substring(self):
+        """Test a name search still finds products whose names only contain the text as a substring."""
+        self.conn.execute("""
+        INSERT INTO products (name, description, price, stock, category)
+        VALUES ('Smartphone X', 'Mobile device', 299.0, 5, 'Electronics'),
+               ('Phone Case', 'Accessory', 9.0, 5, 'Electronics')
+        """)
+        self.conn.commit()
+
+        result = search_and_recommend_products(name="phone", conn=self.conn)
+        names = [item["name"] for item in result["search_results"]]
+        self.assertEqual(names, ["Phone Case", "Smartphone X"], "Word matches should rank before substring matches.")
+        facets = get_product_facets(name="phone", conn=self.conn)
+        self.assertEqual(facets["total"], 2)
+
+    def test_search_products_without_trigram(self):
+        """Test name searches keep the FTS5 match and BM25 ranking when the trigram index is absent."""
+        cursor = self.conn.cursor()
+        cursor.execute("""
+        INSERT INTO products (name, description, price, stock, category)
+        VALUES ('Blue Widget', 'Pairs well with any Product', 12.0, 5, 'Category 1')
+        """)
+        cursor.execute("DROP TABLE products_name_trigram")
+        self.conn.commit()
+        result = search_and_recommend_products(name="product", conn=self.conn)
+        names = [item["name"] for item in result["search_results"]]
+        self.assertEqual(names[:4], ["Product A", "Product B", "Product C", "Product D"])
+        self.assertIn("Blue Widget", names, "Description matches come from the FTS5 index.")
+
+    def test_search_products_like_fallback(self):
+        """Test searching falls back to LIKE when the FTS5 index is absent."""
+        self.conn.execute("DROP TABLE products_fts")
+        result = search_and_recommend_products(name="duct", category="Category 1", conn=self.conn)
+        self.assertEqual({item["name"] for item in result["search_results"]}, {"Product A", "Product B"})
+
+    def test_search_products_pagination(self):
+        """Test keyset pagination walks every matching product once, in price order."""
+        self.conn.executemany("""
+        INSERT INTO products (name, description, price, stock, category)
+        VALUES (?, 'Paged product', ?, 1, 'Category 1')
+        """, [(f"Paged {i}", 20.0) for i in range(5)])
+        self.conn.commit()
+
+        seen, cursor = [], None
+        while True:
+            result = search_and_recommend_products(category="Category 1", cursor=cursor, page_size=2, conn=self.conn)
+            self.assertLessEqual(len(result["search_results"]), 2)
+            if cursor:
+                self.assertEqual(result["recommendations"], [], "Only the first page has recommendations.")
+            seen.extend(item["id"] for item in result["search_results"])
+            cursor = result["next_cursor"]
+            if not cursor:
+                break
+
+        self.assertEqual(seen, [1, 2, 5, 6, 7, 8, 9], "Pages should follow (price, id) order without gaps.")
+
+    def test_search_products_field_projection(self):
+        """Test search results default to summary fields and honour the requested field set."""
+        result = search_and_recommend_products(name="Product", conn=self.conn)
+        self.assertEqual(set(result["search_results"][0]), set(SUMMARY_FIELDS))
+
+        result = search_and_recommend_products(name="Product", fields=["name", "description"], conn=self.conn)
+        self.assertEqual(set(result["search_results"][0]), {"id", "name", "description"})
+
+    def test_search_products_fuzzy_fallback(self):
+        """Test misspelled, re-punctuated and CJK names fall back to the closest products."""
+        self.conn.executemany("""
+        INSERT INTO products (name, description, price, stock, category) VALUES (?, '', ?, 1, ?)
+        """, [("iPhone 15", 999.0, "Phones"), ("T-Shirt - 1234", 19.0, "Clothing"), ("无线蓝牙耳机", 199.0, "Audio")])
+        self.conn.commit()
+
+        for query, expected in (("iphnoe", "iPhone 15"), ("tshirt", "T-Shirt - 1234"), ("无线蓝芽耳机", "无线蓝牙耳机")):
+            with self.subTest(query=query):
+                results = search_and_recommend_products(name=query, conn=self.conn)["search_results"]
+                self.assertEqual(results[0]["name"], expected)
+                self.assertGreater(results[0]["similarity"], 0)
+
+        result = search_and_recommend_products(name="iphnoe", category="Clothing", conn=self.conn)
+        self.assertEqual(result["search_results"], [], "Filters should still apply to fuzzy matches.")
+        self.conn.executemany("""
+        INSERT INTO products (name, description, price, stock, category) VALUES (?, '', 5.0, 1, 'Accessories')
+        """, [(f"Iphnoe Case {i}",) for i in range(120)])
+        self.conn.commit()
+        results = search_and_recommend_products(name="iphnoe", category="Phones", conn=self.conn)["search_results"]
+        self.assertEqual([item["name"] for item in results], ["iPhone 15"],
+                         "Better matches in other categories should not crowd out filtered ones.")
+        result = search_and_recommend_products(name="Product", conn=self.conn)
+        self.assertNotIn("similarity", result["search_results"][0], "Exact matches are not fuzzy.")
+
+    def test_product_neighbors(self):
+        """Test recommendations come from the neighbor table and refresh incrementally."""
+        cursor = self.conn.cursor()
+        cursor.executemany("""
+        INSERT INTO products (name, description, price, stock, category)
+        VALUES (?, 'Neighbor', ?, ?, 'Category 1')
+        """, [("Widget E", 11.0, 5), ("Widget F", 9.5, 0)])
+        rebuild_product_neighbors(cursor)
+        self.conn.commit()
+
+        cursor.execute("SELECT neighbor_id FROM product_neighbors WHERE product_id = 1 ORDER BY rank")
+        self.assertEqual([row[0] for row in cursor.fetchall()], [5, 6], "In-stock, closest-priced first.")
+
+        result = search_and_recommend_products(name="Product A", conn=self.conn)
+        self.assertEqual([item["name"] for item in result["recommendations"]], ["Widget E", "Widget F"])
+
+        # 价格变化只刷新受影响的产品
+        cursor.execute("UPDATE products SET price = 100.0 WHERE id = 5")
+        refreshed = refresh_product_neighbors(cursor)
+        self.conn.commit()
+        self.assertLess(refreshed, 6, "Only affected products should be recomputed.")
+        cursor.execute("SELECT neighbor_id FROM product_neighbors WHERE product_id = 1 ORDER BY rank")
+        self.assertEqual([row[0] for row in cursor.fetchall()], [6])
+        cursor.execute("SELECT COUNT(*) FROM product_neighbors_dirty")
+        self.assertEqual(cursor.fetchone()[0], 0)
+
+        # 刷新过程中新加入队列的产品（用临时触发器模拟另一个写入者）保留到下次刷新
+        cursor.execute("UPDATE products SET price = 9.0 WHERE id = 6")
+        cursor.execute("""
+        CREATE TEMP TRIGGER mark_dirty_during_refresh AFTER INSERT ON product_neighbors BEGIN
+            INSERT OR IGNORE INTO product_neighbors_dirty (product_id) VALUES (2);
+        END
+        """)
+        refresh_product_neighbors(cursor)
+        cursor.execute("DROP TRIGGER mark_dirty_during_refresh")
+        cursor.execute("SELECT product_id FROM product_neighbors_dirty")
+        self.assertEqual(cursor.fetchall(), [(2,)])
+
+    def test_search_products_by_attributes(self):
+        """Test spec attribute filters match the indexed attributes and follow additional_specs changes."""
+        self.conn.executemany("""
+        INSERT INTO products (name, price, stock, category, additional_specs) VALUES (?, ?, 1, ?, ?)
+        """, [
+            ("Phone - 1", 799.0, "Electronics", '{"Brand": "Samsung", "Feature": "5G"}'),
+            ("Phone - 2", 699.0, "Electronics", '{"Brand": "Samsung", "Feature": "4K"}'),
+            ("Sweater - 3", 49.0, "Clothing", '{"Material": "Wool", "Fit": "Slim"}'),
+        ])
+        self.conn.commit()
+
+        result = search_and_recommend_products(attributes={"brand": "samsung", "Feature": "5G"}, conn=self.conn)
+        self.assertEqual([item["name"] for item in result["search_results"]], ["Phone - 1"])
+        result = search_and_recommend_products(name="sweater", attributes={"Material": "Wool"}, conn=self.conn)
+        self.assertEqual([item["name"] for item in result["search_results"]], ["Sweater - 3"])
+        facets = get_product_facets(attributes={"Brand": "Samsung"}, conn=self.conn)
+        self.assertEqual(facets["total"], 2)
+
+        self.conn.execute("""UPDATE products SET additional_specs = '{"Material": "Cotton"}' WHERE id = 7""")
+        self.conn.commit()
+        result = search_and_recommend_products(attributes={"Material": "Wool"}, conn=self.conn)
+        self.assertEqual(result["search_results"], [], "Attributes should follow additional_specs updates.")
+        result = search_and_recommend_products(attributes={"Material": ["Wool"]}, conn=self.conn)
+        self.assertEqual(result["search_results"], [], "Malformed attributes should be rejected.")
+
+    def test_search_cache(self):
+        """Test normalized searches share cache entries that are dropped only when their category changes."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            conn = sqlite3.connect(os.path.join(tmp_dir, "catalog.db"))
+            try:
+                create_tables(conn.cursor())
+                populate_test_data(conn)
+
+                def hits():
+                    return get_search_cache_stats()["hits"]
+
+                first = search_and_recommend_products(name="Product", category="Category 1", conn=conn)
+                before = hits()
+                again = search_and_recommend_products(name=" product ", category="Category 1", price_range=None,
+                                                      conn=conn)
+                self.assertEqual(again, first)
+                self.assertEqual(hits(), before + 1, "Normalized parameters should hit the cache.")
+
+                conn.execute("UPDATE products SET stock = 0 WHERE id = 3")  # Category 2
+                conn.commit()
+                search_and_recommend_products(name="Product", category="Category 1", conn=conn)
+                self.assertEqual(hits(), before + 2, "Other categories' changes should keep the entry.")
+
+                conn.execute("UPDATE products SET stock = stock - 1 WHERE id = 1")  # Category 1, still in stock
+                conn.commit()
+                result = search_and_recommend_products(name="Product", category="Category 1", conn=conn)
+                self.assertEqual(hits(), before + 3, "Stock levels that stay in stock should keep the entry.")
+                self.assertEqual(result["search_results"][0]["stock"], 99, "Cached stock should be re-read.")
+                self.assertEqual(first["search_results"][0]["stock"], 100, "The cached entry should not change.")
+
+                conn.execute("UPDATE products SET price = 12.5 WHERE id = 1")  # Category 1
+                conn.commit()
+                result = search_and_recommend_products(name="Product", category="Category 1", conn=conn)
+                self.assertEqual(hits(), before + 3, "Changes in the category should invalidate the entry.")
+                self.assertEqual(result["search_results"][0]["price"], 12.5)
+            finally:
+                conn.close()
+
+    def test_stock_updates_keep_catalog_versions(self):
+        """Test stock changes only bump the versions and neighbor marks that depend on stock status."""
+        def versions():
+            return (self.conn.execute("SELECT * FROM catalog_version ORDER BY scope").fetchall(),
+                    self.conn.execute("SELECT * FROM category_version ORDER BY category").fetchall(),
+                    self.conn.execute("SELECT * FROM product_neighbors_dirty ORDER BY product_id").fetchall())
+
+        self.conn.execute("DELETE FROM product_neighbors_dirty")
+        before = versions()
+        self.conn.execute("UPDATE products SET stock = stock - 1 WHERE id = 1")
+        self.conn.execute("UPDATE products SET price = price WHERE id = 2")
+        self.assertEqual(versions(), before, "Stock levels and unchanged values should not bump versions.")
+
+        self.conn.execute("UPDATE products SET stock = 0 WHERE id = 1")
+        catalog, categories, dirty = versions()
+        changed = {scope for (scope, version), (_, old) in zip(catalog, before[0]) if version != old}
+        self.assertEqual(changed, {"facets", "search"})
+        self.assertNotEqual(categories, before[1])
+        self.assertEqual(dirty, [(1,)], "Going out of stock should refresh the product's neighbors.")
+
+    def test_product_facets(self):
+        """Test facet counts for a filter set, and that the facet cache follows product changes."""
+        self.conn.executemany("""
+        INSERT INTO products (name, price, stock, category, color, size) VALUES (?, ?, ?, 'Category 1', ?, ?)
+        """, [("Product E", 60.0, 0, "Black", "Large"), ("Product F", 1200.5, 3, "Black", None)])
+        self.conn.commit()
+
+        facets = get_product_facets(name="product", category="Category 1", conn=self.conn)
+        self.assertEqual(facets["total"], 4)
+        self.assertEqual(facets["categories"], {"Category 1": 4})
+        self.assertEqual(facets["colors"], {"Black": 2})
+        self.assertEqual(facets["sizes"], {"Large": 1})
+        self.assertEqual(facets["stock"], {"in_stock": 3, "out_of_stock": 1})
+        self.assertEqual(facets["price_buckets"], [{"price_range": "0-25", "count": 2},
+                                                   {"price_range": "50-100", "count": 1},
+                                                   {"price_range": "1000-1201", "count": 1}])
+
+        facets = get_product_facets(price_range="10-20", conn=self.conn)
+        self.assertEqual(facets["categories"], {"Category 1": 2, "Category 2": 1})
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            conn = sqlite3.connect(os.path.join(tmp_dir, "catalog.db"))
+            try:
+                create_tables(conn.cursor())
+                populate_test_data(conn)
+                self.assertEqual(get_product_facets(conn=conn)["stock"]["out_of_stock"], 0)
+                conn.execute("UPDATE products SET stock = 0 WHERE id = 1")
+                conn.commit()
+                self.assertEqual(get_product_facets(conn=conn)["stock"]["out_of_stock"], 1,
+                                 "Stock changes should invalidate cached facets.")
+            finally:
+                conn.close()
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_search_products_semantic(self):
+        """Test semantic mode ranks products by TF-IDF similarity of name, description and specs."""
+        self.conn.executemany("""
+        INSERT INTO products (name, description, price, stock, category, additional_specs) VALUES (?, ?, ?, 1, ?, ?)
+        """, [
+            ("Headphones - 1", "Over-ear headphones", 199.0, "Electronics", '{"Brand": "Sony", "Feature": "Noise Cancelling"}'),
+            ("Headphones - 2", "Over-ear headphones", 99.0, "Electronics", '{"Brand": "HP", "Feature": "Bluetooth"}'),
+            ("Speaker - 3", "Portable speaker", 59.0, "Electronics", '{"Brand": "Sony", "Feature": "Bluetooth"}'),
+        ])
+        self.conn.commit()
+
+        result = search_and_recommend_products(name="noise cancelling sony headphones", search_mode="semantic",
+                                               conn=self.conn)
+        names = [item["name"] for item in result["search_results"]]
+        self.assertEqual(names, ["Headphones - 1", "Headphones - 2", "Speaker - 3"])
+        scores = [item["score"] for item in result["search_results"]]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+        seen, cursor = [], None
+        while True:
+            page = search_and_recommend_products(name="sony headphones", price_range="50-150", cursor=cursor,
+                                                 page_size=1, search_mode="semantic", conn=self.conn)
+            seen.extend(item["name"] for item in page["search_results"])
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+        self.assertEqual(seen, ["Headphones - 2", "Speaker - 3"], "Filters and pagination should apply.")
+
+        self.conn.executemany("""
+        INSERT INTO products (name, description, price, stock, category) VALUES (?, '', 10.0, 1, 'Accessories')
+        """, [(f"Sony Headphones Case {i}",) for i in range(1100)])
+        self.conn.commit()
+        result = search_and_recommend_products(name="sony headphones", category="Electronics", search_mode="semantic",
+                                               conn=self.conn)
+        self.assertEqual([item["name"] for item in result["search_results"]],
+                         ["Headphones - 1", "Headphones - 2", "Speaker - 3"],
+                         "Better matches in other categories should not crowd out filtered ones.")
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_tfidf_index_incremental(self):
+        """Test inserted products are appended to the TF-IDF index and other changes rebuild it."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            conn = sqlite3.connect(os.path.join(tmp_dir, "catalog.db"))
+            try:
+                create_tables(conn.cursor())
+                populate_test_data(conn)
+                first = get_index(conn)
+                self.assertIs(get_index(conn), first, "An unchanged catalog should reuse the index.")
+
+                conn.execute("INSERT INTO products (name, price, stock, category) VALUES ('Wool Sweater', 5.0, 1, 'C')")
+                conn.commit()
+                with mock.patch("tools.tfidf_index.build_index", side_effect=AssertionError("full rebuild")):
+                    second = get_index(conn)
+                self.assertEqual(len(second), 5)
+                self.assertEqual(second.search("sweaters")[0][0], 5)
+                self.assertEqual(len(first), 4, "The previous index must not be modified.")
+
+                conn.execute("UPDATE products SET name = 'Cotton Shirt' WHERE id = 5")
+                conn.commit()
+                self.assertEqual(get_index(conn).search("sweater"), [])
+            finally:
+                conn.close()
+
+    def test_fuzzy_index_incremental(self):
+        """Test inserted products are appended to the trigram index and renames rebuild it."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            conn = sqlite3.connect(os.path.join(tmp_dir, "catalog.db"))
+            try:
+                create_tables(conn.cursor())
+                populate_test_data(conn)
+                first = fuzzy_index.get_index(conn)
+                self.assertIs(fuzzy_index.get_index(conn), first, "An unchanged catalog should reuse the index.")
+
+                conn.execute("INSERT INTO products (name, price, stock, category) VALUES ('Wool Sweater', 5.0, 1, 'C')")
+                conn.commit()
+                with mock.patch("tools.fuzzy_index.build_index", side_effect=AssertionError("full rebuild")):
+                    second = fuzzy_index.get_index(conn)
+                self.assertEqual(second.search("swaeter")[0][0], 5)
+                self.assertEqual(first.search("swaeter"), [], "The previous index must not be modified.")
+
+                conn.execute("UPDATE products SET name = 'Cotton Shirt' WHERE id = 5")
+                conn.commit()
+                self.assertEqual(fuzzy_index.get_index(conn).search("swaeter"), [])
+            finally:
+                conn.close()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,110 @@
+"""
+@Time ： 2024-11-29
+@Auth ： Adam Lyu
+"""
+import os
+import sqlite3
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from scripts.initialize_db import create_tables
+from tests.test_database import populate_test_data
+from tools import cart_tools, order_tools
+from utils import group_commit
+from utils.db_utils import immediate_transaction
+from utils.group_commit import GroupCommitWriter
+
+
+def insert_then_fail(conn=None):
+    with immediate_transaction(conn) as cursor:
+        cursor.execute("INSERT INTO cart (user_id) VALUES (99)")
+    raise ValueError("Payment declined.")
+
+
+class TestGroupCommitWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "writes.db")
+        conn = sqlite3.connect(self.db_path)
+        create_tables(conn.cursor())
+        populate_test_data(conn)
+        conn.close()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def query(self, sql, params=()):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def test_batches_calls(self):
+        """Test queued calls are committed in one transaction and each caller gets its own result."""
+        writer = GroupCommitWriter(self.db_path, max_batch=64, max_delay=0.05)
+        futures = [writer.submit(cart_tools.add_to_cart, user_id, 3, user_id) for user_id in range(1, 11)]
+        writer.start()
+        self.assertEqual([future.result() for future in futures],
+                         ["Product 3 successfully added to your cart."] * 10)
+        writer.close()
+        self.assertEqual((writer.batches, writer.calls), (1, 10))
+        rows = self.query("""
+        SELECT c.user_id, cp.quantity FROM cart_products cp JOIN cart c ON c.id = cp.cart_id
+        WHERE cp.product_id = 3 ORDER BY c.user_id
+        """)
+        self.assertEqual(rows, [(user_id, user_id) for user_id in range(1, 11)])
+
+    def test_failed_call_rolls_back_alone(self):
+        """Test a failing call only undoes its own writes and the rest of the batch commits."""
+        writer = GroupCommitWriter(self.db_path, max_delay=0.05)
+        first = writer.submit(cart_tools.add_to_cart, 2, 3, 1)
+        failing = writer.submit(insert_then_fail)
+        last = writer.submit(cart_tools.add_to_cart, 3, 4, 1)
+        writer.start()
+        self.assertEqual(first.result(), "Product 3 successfully added to your cart.")
+        with self.assertRaisesRegex(ValueError, "Payment declined."):
+            failing.result()
+        self.assertEqual(last.result(), "Product 4 successfully added to your cart.")
+        writer.close()
+        self.assertEqual(writer.batches, 1)
+        self.assertEqual(self.query("SELECT user_id FROM cart WHERE user_id IN (2, 3, 99) ORDER BY user_id"),
+                         [(2,), (3,)])
+        with self.assertRaises(RuntimeError):
+            writer.submit(cart_tools.add_to_cart, 2, 3, 1)
+
+    def test_tools_use_writer(self):
+        """Test the cart and order tools write through the writer and invalidate caches after the commit."""
+        with mock.patch.object(group_commit, "DB_WRITER", "group"), \
+                mock.patch.object(cart_tools, "db", self.db_path), mock.patch.object(order_tools, "db", self.db_path):
+            try:
+                self.assertIn("Status: Pending", order_tools.search_orders(1))
+                with ThreadPoolExecutor(max_workers=8) as pool:
+                    added = list(pool.map(lambda user_id: cart_tools.add_to_cart(user_id, 4, 1), range(2, 12)))
+                self.assertEqual(added, ["Product 4 successfully added to your cart."] * 10)
+                self.assertEqual(cart_tools.update_cart_items(2, [(4, 2)]),
+                                 "Cart updated: 1 products changed, 0 removed.")
+
+                with ThreadPoolExecutor(max_workers=8) as pool:
+                    results = list(pool.map(lambda user_id: order_tools.checkout_order(user_id, "Address", "PayPal"),
+                                            range(2, 12)))
+                # 产品 D 库存 10：用户 2 买 3 件，其余用户各 1 件，只有一部分能结账，不能超卖
+                [(stock,)] = self.query("SELECT stock FROM products WHERE id = 4")
+                [(sold,)] = self.query("SELECT TOTAL(quantity) FROM order_products WHERE product_id = 4")
+                self.assertEqual(stock, 10 - sold)
+                self.assertGreaterEqual(stock, 0)
+                self.assertTrue(all("Checkout successful" in result or "insufficient stock" in result
+                                    for result in results))
+
+                self.assertEqual(order_tools.cancel_order(1, "Changed my mind."),
+                                 "Order 1 has been cancelled successfully. Reason: Changed my mind.")
+                self.assertIn("Status: Cancelled", order_tools.search_orders(1))
+                self.assertEqual(self.query("SELECT stock FROM products WHERE id = 1"), [(102,)])
+            finally:
+                group_commit.close_group_writers()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+"""
+@Time ： 2024-11-24
+@Auth ： Adam Lyu
+"""
+import sqlite3
+import unittest
+
+from scripts.initialize_db import create_base_tables, create_tables
+from scripts.migrations import apply_migrations, discover_migrations, get_schema_version
+from tools.cart_tools import add_to_cart
+
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_apply_once(self):
+        """Test every migration is applied once, in order, and recorded in schema_version."""
+        versions = [version for version, _ in discover_migrations()]
+        self.assertEqual(versions, sorted(versions))
+        self.assertEqual(create_tables(self.conn.cursor()), versions)
+        self.assertEqual(get_schema_version(self.conn.cursor()), versions[-1])
+        self.assertEqual(apply_migrations(self.conn), [], "Applied migrations must not run again.")
+        self.assertFalse(self.conn.in_transaction)
+
+    def test_upgrade_existing_database(self):
+        """Test a database created before migrations keeps its data and gains the later schema."""
+        cursor = self.conn.cursor()
+        create_base_tables(cursor)
+        cursor.execute("INSERT INTO products (name, price, stock, category, additional_specs) "
+                       "VALUES ('Old', 1.0, 1, 'C', '{\"Brand\": \"LG\"}')")
+        self.conn.commit()
+
+        create_tables(cursor)
+        cursor.execute("SELECT product_id FROM product_attributes WHERE name = 'Brand' AND value = 'LG'")
+        self.assertEqual(cursor.fetchall(), [(1,)], "Later migrations should backfill existing rows.")
+
+    def test_order_events_backfill(self):
+        """Test existing orders get their events and per-user summaries when order_events is added."""
+        cursor = self.conn.cursor()
+        create_base_tables(cursor)
+        cursor.executemany("""
+        INSERT INTO orders (user_id, total_amount, status, payment_method, cancellation_reason)
+        VALUES (?, ?, ?, 'PayPal', ?)
+        """, [(1, 10.0, "Pending", None), (1, 5.0, "Cancelled", "Too slow"), (2, 7.5, "Delivered", None)])
+        self.conn.commit()
+
+        create_tables(cursor)
+        cursor.execute("SELECT order_id, event_type FROM order_events ORDER BY id")
+        self.assertEqual(cursor.fetchall(), [(1, "created"), (2, "created"), (3, "created"), (2, "cancelled")])
+        cursor.execute("SELECT user_id, order_count, cancelled_count, total_spent FROM user_order_summary")
+        self.assertEqual(sorted(cursor.fetchall()), [(1, 2, 1, 10.0), (2, 1, 0, 7.5)])
+        cursor.execute("SELECT status, cancellation_reason FROM orders WHERE id = 2")
+        self.assertEqual(cursor.fetchone(), ("Cancelled", "Too slow"))
+
+    def test_add_to_cart_without_ddl(self):
+        """Test add_to_cart issues no schema statements and commits the new cart with the item."""
+        create_tables(self.conn.cursor())
+        statements = []
+        self.conn.set_trace_callback(statements.append)
+        add_to_cart(1, 1, 2, conn=self.conn)
+        self.conn.set_trace_callback(None)
+        self.assertFalse([s for s in statements if s.lstrip().upper().startswith(("PRAGMA", "CREATE"))])
+        self.assertEqual(statements.count("COMMIT"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+"""
+@Time ： 2024-11-23
+@Auth ： Adam Lyu
+"""
+import json
+import unittest
+from unittest import mock
+
+from utils import output_encoder
+from utils.output_encoder import encode_json, encode_output, encode_table, truncate_text
+
+
+class TestOutputEncoder(unittest.TestCase):
+    def test_table(self):
+        """Test records share one header line and cells are escaped."""
+        rows = [{"id": 1, "name": "A|B", "price": 10.0, "color": None},
+                {"id": 2, "name": "Line\nbreak", "price": 12.5, "size": "L"}]
+        self.assertEqual(encode_table(rows), "id|name|price|color|size\n1|A\\|B|10||\n2|Line\\nbreak|12.5||L")
+
+    def test_dict_sections(self):
+        """Test a search result becomes key lines with embedded tables."""
+        result = {"search_results": [{"id": 1, "name": "无线耳机"}], "recommendations": [], "next_cursor": None}
+        self.assertEqual(encode_output(result, "table"),
+                         "search_results:\nid|name\n1|无线耳机\nrecommendations: []\nnext_cursor: null")
+
+    def test_json_and_truncation(self):
+        """Test minified JSON keeps non-ASCII text and long text fields are cut."""
+        value = {"name": "耳机", "description": "x" * 500}
+        encoded = encode_json(value, max_length=20)
+        self.assertNotIn(" ", encoded)
+        decoded = json.loads(encoded)
+        self.assertEqual(decoded["name"], "耳机")
+        self.assertEqual(len(decoded["description"]), 20)
+        self.assertTrue(decoded["description"].endswith("…"))
+        self.assertEqual(truncate_text(["short"], 20), ["short"])
+        self.assertEqual(encode_output("already text"), "already text")
+
+    def test_json_non_string_keys(self):
+        """Test dicts with int keys encode like the standard library, with or without orjson."""
+        value = {1: "a", 2: {3: 4}}
+        self.assertEqual(encode_json(value), '{"1":"a","2":{"3":4}}')
+        with mock.patch.object(output_encoder, "orjson", None):
+            self.assertEqual(encode_json(value), '{"1":"a","2":{"3":4}}')
+        self.assertEqual(encode_output([{"id": 1, "units": {7: 2}}]), 'id|units\n1|{"7":2}')
+
+
+if __name__ == "__main__":
+    unittest.main()
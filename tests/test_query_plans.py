@@ -0,0 +1,171 @@
+"""
+@Time ： 2024-11-20
+@Auth ： Adam Lyu
+"""
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from dev_tools.query_plan import ALLOW_FULL_SCAN, collect_tool_sql, find_full_scans, trace_statements
+from scripts.initialize_db import create_tables
+from scripts.rebuild_sales_aggregates import rebuild_sales_aggregates
+from tools import cart_tools, order_tools, product_tools, sales_tools
+
+PRODUCT_COUNT = 20000
+USER_COUNT = 2000
+ORDER_COUNT = 5000
+
+
+def populate_synthetic_data(conn):
+    """
+    Fill the database with a catalog and order history large enough for the planner to matter.
+    Args:
+        conn: SQLite connection object.
+    """
+    rng = random.Random(42)
+    categories = [f"Category {i}" for i in range(20)]
+    conn.executemany("""
+    INSERT INTO products (name, description, price, stock, category, color, size, additional_specs)
+    VALUES (?, ?, ?, ?, ?, ?, ?, '{}')
+    """, [
+        (f"Item {i}", f"Synthetic product {i}", round(rng.uniform(1, 2000), 2), rng.randint(0, 100),
+         rng.choice(categories), rng.choice(["Black", "White", None]), rng.choice(["Small", "Large", None]))
+        for i in range(PRODUCT_COUNT)
+    ])
+    conn.executemany("INSERT INTO cart (user_id) VALUES (?)", [(user_id,) for user_id in range(1, USER_COUNT + 1)])
+    conn.executemany("""
+    INSERT OR IGNORE INTO cart_products (cart_id, product_id, quantity) VALUES (?, ?, ?)
+    """, [(rng.randint(1, USER_COUNT), rng.randint(1, PRODUCT_COUNT), rng.randint(1, 3)) for _ in range(10000)])
+    conn.executemany("""
+    INSERT INTO orders (user_id, total_amount, delivery_address, payment_method, created_at)
+    VALUES (?, ?, 'Synthetic Address', 'PayPal', datetime('now', ?))
+    """, [(rng.randint(1, USER_COUNT), rng.uniform(10, 500), f"-{rng.randint(0, 60)} days")
+          for _ in range(ORDER_COUNT)])
+    conn.executemany("""
+    INSERT INTO order_products (order_id, product_id, quantity, price) VALUES (?, ?, ?, ?)
+    """, [(rng.randint(1, ORDER_COUNT), rng.randint(1, PRODUCT_COUNT), rng.randint(1, 3), rng.uniform(1, 100))
+          for _ in range(15000)])
+    rebuild_sales_aggregates(conn.cursor())
+    conn.commit()
+
+
+class TestQueryPlans(unittest.TestCase):
+    """Every query issued by the tools must be answered from an index, never by a full table scan."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.db_path = os.path.join(cls.tmp_dir.name, "synthetic.db")
+        cls.conn = sqlite3.connect(cls.db_path)
+        create_tables(cls.conn.cursor())
+        populate_synthetic_data(cls.conn)
+
+        # 工具函数内部自行打开的连接也指向合成数据库
+        cls.patches = [mock.patch.object(module, "db", cls.db_path)
+                       for module in (cart_tools, order_tools, product_tools, sales_tools)]
+        for patch in cls.patches:
+            patch.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        for patch in cls.patches:
+            patch.stop()
+        cls.conn.close()
+        cls.tmp_dir.cleanup()
+
+    def assertNoFullScans(self, statements):
+        """Fail with the offending statements and their scanned tables."""
+        findings = []
+        for label, statement in statements:
+            if ALLOW_FULL_SCAN in statement:
+                continue
+            scanned = find_full_scans(self.conn, statement)
+            if scanned:
+                findings.append(f"{label}: full scan of {', '.join(scanned)}\n{statement.strip()}")
+        self.assertFalse(findings, "Queries fall back to full table scans:\n\n" + "\n\n".join(findings))
+
+    def test_literal_tool_sql(self):
+        """Every SQL literal in tools/*.py uses an index."""
+        statements = collect_tool_sql()
+        self.assertTrue(statements, "No SQL found in tools/.")
+        self.assertNoFullScans([(f"{file_name}:{line}", statement) for file_name, line, statement in statements])
+
+    def test_product_search_sql(self):
+        """Dynamically built product search and recommendation SQL uses an index."""
+        scenarios = [
+            dict(name="Item 12"),
+            dict(category="Category 3"),
+            dict(category="Category 3", price_range="100-200"),
+            dict(price_range="100-200"),
+            dict(attributes={"Brand": "Sony"}),
+            dict(category="Category 3", attributes={"Brand": "Sony", "Feature": "5G"}),
+            dict(),
+        ]
+        for kwargs in scenarios:
+            with self.subTest(**kwargs):
+                first = product_tools.search_and_recommend_products(page_size=5, conn=self.conn, **kwargs)
+                statements = trace_statements(self.conn, product_tools.search_and_recommend_products,
+                                              page_size=5, cursor=first["next_cursor"], **kwargs)
+                statements += trace_statements(self.conn, product_tools.search_and_recommend_products,
+                                               page_size=5, **kwargs)
+                self.assertNoFullScans([(str(kwargs), statement) for statement in statements])
+
+    def test_product_facet_sql(self):
+        """Facet aggregation is answered from an index, unfiltered facets from the covering index."""
+        for kwargs in (dict(category="Category 3"), dict(category="Category 3", price_range="100-200"),
+                       dict(price_range="100-200"), dict(name="Item 12"), dict()):
+            with self.subTest(**kwargs):
+                statements = trace_statements(self.conn, product_tools.get_product_facets, **kwargs)
+                self.assertNoFullScans([(str(kwargs), statement) for statement in statements])
+
+    def test_cart_and_order_sql(self):
+        """Cart and order tools use an index end to end."""
+        calls = [
+            (cart_tools.view_cart, (7,)),
+            (cart_tools.add_to_cart, (7, 11, 2)),
+            (cart_tools.remove_from_cart, (7, 11)),
+            (cart_tools.update_cart_items, (7, [(11, 2), (12, -1)])),
+            (cart_tools.scale_cart_quantities, (7, 2)),
+            (cart_tools.remove_cart_items_matching, (7, "Category 3", "Item")),
+            (order_tools.checkout_order, (7, "Address", "PayPal")),
+            (order_tools.search_orders, (3,)),
+            (order_tools.get_recent_orders, (7, 30)),
+            (order_tools.update_delivery_address, (3, "New Address")),
+            (order_tools.cancel_order, (3, "Changed my mind")),
+            (order_tools.get_order_events, (3,)),
+            (order_tools.get_user_order_summary, (7,)),
+            (product_tools.check_product_stock, (42,)),
+            (sales_tools.get_top_products, ()),
+            (sales_tools.get_top_products, ("Category 3",)),
+            (sales_tools.get_purchase_history, (7,)),
+            (sales_tools.get_category_sales, ()),
+            (sales_tools.get_category_sales, ("Category 3", 7)),
+        ]
+        for func, args in calls:
+            with self.subTest(func=func.__name__):
+                statements = trace_statements(self.conn, func, *args)
+                self.assertNoFullScans([(func.__name__, statement) for statement in statements])
+
+    def test_order_history_sql(self):
+        """Order history pages come from the (user_id, created_at) index, line items by order ID."""
+        first = order_tools.get_order_history(3, page_size=1, conn=self.conn)
+        for kwargs in (dict(), dict(days=30), dict(cursor=first["next_cursor"]), dict(include_items=True),
+                       dict(days=30, cursor=first["next_cursor"], include_items=True)):
+            with self.subTest(**kwargs):
+                statements = trace_statements(self.conn, order_tools.get_order_history, 3, **kwargs)
+                self.assertNoFullScans([(str(kwargs), statement) for statement in statements])
+
+    def test_checkout_idempotency_sql(self):
+        """Idempotent checkouts and their replays look keys up by primary key and purge by index."""
+        for attempt in ("checkout", "replay"):
+            with self.subTest(attempt=attempt):
+                statements = trace_statements(self.conn, order_tools.checkout_order, 8, "Address", "PayPal",
+                                              idempotency_key="checkout-8")
+                self.assertNoFullScans([(attempt, statement) for statement in statements])
+
+
+if __name__ == "__main__":
+    unittest.main()
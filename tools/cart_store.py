@@ -0,0 +1,332 @@
+"""
+@Time ： 2024-11-25
+@Auth ： Adam Lyu
+@Desc ： Write-back in-memory cart store.
+
+Active carts are kept in memory per user and every mutation is served from there; dirty carts
+are written to `cart` / `cart_products` in one batched transaction per flush, on an interval, on
+checkout and on shutdown. With a journal path the store runs in crash-safety mode: every mutation
+is first appended (and fsynced) to a JSON-lines journal of absolute quantities, which is replayed
+into the database on the next start.
+
+The store assumes it is the only writer of the carts of its database; code that changes
+`cart_products` with SQL must run inside `bypass(user_id)`.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from utils.logger import logger
+
+
+class WriteBackCartStore:
+    """
+    In-memory carts (user_id -> {product_id: quantity}, in insertion order) flushed to SQLite.
+    """
+
+    def __init__(self, db_path: str, flush_interval: Optional[float] = 5.0, journal_path: Optional[str] = None,
+                 max_idle: float = 1800.0):
+        """
+        Args:
+            db_path (str): SQLite database holding the carts.
+            flush_interval (float): Seconds between background flushes; None flushes only when asked.
+            journal_path (str): Append-only journal for crash safety; None keeps mutations in memory
+                only until the next flush.
+            max_idle (float): Seconds after which a clean, unused cart is dropped from memory.
+        """
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.journal_path = journal_path
+        self.max_idle = max_idle
+        self._carts: Dict[int, Dict[int, int]] = {}
+        self._last_used: Dict[int, float] = {}
+        self._dirty = set()
+        self._bypassed = set()
+        # 每个用户的购物车从内存中丢弃（bypass、淘汰）的次数；加载期间变化则丢弃加载结果
+        self._drops: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        # 同一时间只执行一次 flush，bypass 在 flush 返回时可确认数据已写入
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._journal = None
+        if journal_path:
+            self._recover()
+            self._journal = open(journal_path, "a", encoding="utf-8")
+
+    # ---- 读写购物车 ----
+
+    def items(self, user_id: int) -> Dict[int, int]:
+        """
+        Args:
+            user_id (int): The ID of the user.
+
+        Returns:
+            Dict[int, int]: A copy of the cart, product ID -> quantity, in insertion order.
+        """
+        with self._cond:
+            return dict(self._cart(user_id))
+
+    def update(self, user_id: int, changes: Dict[int, int]) -> List[int]:
+        """
+        Add quantity deltas to a cart; products whose quantity drops to zero or below are removed.
+
+        Args:
+            user_id (int): The ID of the user.
+            changes (Dict[int, int]): Product ID -> quantity delta.
+
+        Returns:
+            List[int]: IDs of the products removed from the cart.
+        """
+        with self._cond:
+            cart = self._cart(user_id)
+            quantities = {product_id: cart.get(product_id, 0) + delta for product_id, delta in changes.items()}
+            self._write(user_id, quantities)
+            return [product_id for product_id, quantity in quantities.items() if quantity <= 0]
+
+    def remove(self, user_id: int, product_id: int) -> bool:
+        """
+        Remove a product from a cart.
+
+        Returns:
+            bool: Whether the product was in the cart.
+        """
+        with self._cond:
+            if product_id not in self._cart(user_id):
+                return False
+            self._write(user_id, {product_id: 0})
+            return True
+
+    def scale(self, user_id: int, factor: int) -> int:
+        """
+        Multiply every quantity in a cart.
+
+        Returns:
+            int: Number of products whose quantity was scaled.
+        """
+        with self._cond:
+            cart = self._cart(user_id)
+            self._write(user_id, {product_id: quantity * factor for product_id, quantity in cart.items()})
+            return len(cart)
+
+    def _cart(self, user_id: int) -> Dict[int, int]:
+        # 调用方持有锁；购物车被 bypass 时等待 SQL 操作完成后再从数据库加载
+        while True:
+            while user_id in self._bypassed:
+                self._cond.wait()
+            cart = self._carts.get(user_id)
+            if cart is not None:
+                break
+            # 在锁外读取数据库，其他用户的操作不必等待；期间购物车被丢弃或已被他人加载则重试
+            drops = self._drops.get(user_id, 0)
+            self._lock.release()
+            try:
+                loaded = self._read_cart(user_id)
+            finally:
+                self._lock.acquire()
+            if user_id not in self._carts and user_id not in self._bypassed \
+                    and self._drops.get(user_id, 0) == drops:
+                cart = self._carts[user_id] = loaded
+                break
+        self._last_used[user_id] = time.monotonic()
+        return cart
+
+    def _drop(self, user_id: int):
+        # 调用方持有锁
+        self._carts.pop(user_id, None)
+        self._last_used.pop(user_id, None)
+        self._drops[user_id] = self._drops.get(user_id, 0) + 1
+
+    def _read_cart(self, user_id: int) -> Dict[int, int]:
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return dict(conn.execute("""
+            SELECT cp.product_id, cp.quantity FROM cart_products cp
+            WHERE cp.cart_id = (SELECT id FROM cart WHERE user_id = ?)
+            ORDER BY cp.id
+            """, (user_id,)).fetchall())
+        finally:
+            conn.close()
+
+    def _write(self, user_id: int, quantities: Dict[int, int]):
+        # 先写日志再改内存；日志记录绝对数量，重放是幂等的
+        if not quantities:
+            return
+        if self._journal is not None:
+            self._journal.write(json.dumps({"user_id": user_id, "quantities": quantities}) + "\n")
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+        cart = self._carts[user_id]
+        for product_id, quantity in quantities.items():
+            if quantity > 0:
+                cart[product_id] = quantity
+            else:
+                cart.pop(product_id, None)
+        self._dirty.add(user_id)
+
+    # ---- 写回数据库 ----
+
+    def flush(self) -> int:
+        """
+        Write every dirty cart to the database in one transaction.
+
+        Returns:
+            int: Number of carts written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = {user_id: dict(self._carts[user_id]) for user_id in self._dirty}
+                self._dirty.clear()
+                pending = self._rotate_journal() if batch else None
+            if batch:
+                try:
+                    self._write_carts(batch)
+                except Exception:
+                    with self._lock:
+                        # 写入失败：重新标记为脏，日志保留到下次 flush
+                        self._dirty.update(batch)
+                    logger.error(f"Failed to flush {len(batch)} carts.")
+                    raise
+                if pending:
+                    os.remove(pending)
+            # 写入成功后再淘汰：被淘汰的购物车都已持久化
+            with self._lock:
+                self._evict_idle()
+            if batch:
+                logger.info(f"Flushed {len(batch)} carts.")
+            return len(batch)
+
+    def _write_carts(self, carts: Dict[int, Dict[int, int]]):
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for user_id, items in carts.items():
+                    row = conn.execute("SELECT id FROM cart WHERE user_id = ?", (user_id,)).fetchone()
+                    cart_id = row[0] if row else conn.execute("INSERT INTO cart (user_id) VALUES (?)",
+                                                              (user_id,)).lastrowid
+                    conn.execute("""
+                    DELETE FROM cart_products
+                    WHERE cart_id = ? AND product_id NOT IN (SELECT value FROM json_each(?))
+                    """, (cart_id, json.dumps(list(items))))
+                    conn.executemany("""
+                    INSERT INTO cart_products (cart_id, product_id, quantity) VALUES (?, ?, ?)
+                    ON CONFLICT(cart_id, product_id) DO UPDATE SET quantity = excluded.quantity
+                    WHERE quantity != excluded.quantity
+                    """, [(cart_id, product_id, quantity) for product_id, quantity in items.items()])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+    def _rotate_journal(self) -> Optional[str]:
+        # 调用方持有锁。把当前日志并入 <journal>.flushing，写入成功后删除；新的修改写入新日志
+        if self._journal is None:
+            return None
+        pending = self.journal_path + ".flushing"
+        self._journal.close()
+        if os.path.exists(pending):
+            with open(pending, "a", encoding="utf-8") as target, open(self.journal_path, encoding="utf-8") as source:
+                target.write(source.read())
+                target.flush()
+                os.fsync(target.fileno())
+            os.remove(self.journal_path)
+        else:
+            os.replace(self.journal_path, pending)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        return pending
+
+    def _recover(self):
+        """Replay the journals left by a previous run into the database."""
+        carts: Dict[int, Dict[int, int]] = {}
+        paths = [path for path in (self.journal_path + ".flushing", self.journal_path) if os.path.exists(path)]
+        for path in paths:
+            with open(path, encoding="utf-8") as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 崩溃时写了一半的最后一行
+                        continue
+                    user_id = entry["user_id"]
+                    if user_id not in carts:
+                        carts[user_id] = self._read_cart(user_id)
+                    cart = carts[user_id]
+                    for product_id, quantity in entry["quantities"].items():
+                        if quantity > 0:
+                            cart[int(product_id)] = quantity
+                        else:
+                            cart.pop(int(product_id), None)
+        if carts:
+            self._write_carts(carts)
+            logger.info(f"Recovered {len(carts)} carts from the cart journal.")
+        for path in paths:
+            os.remove(path)
+
+    def _evict_idle(self):
+        # 调用方持有锁
+        deadline = time.monotonic() - self.max_idle
+        for user_id in [user_id for user_id, used in self._last_used.items()
+                        if used < deadline and user_id not in self._dirty]:
+            self._drop(user_id)
+
+    @contextmanager
+    def bypass(self, user_id: int):
+        """
+        Flush and drop a user's cart, and hold its mutations while the caller changes the cart
+        directly with SQL (e.g. checkout). The cart is reloaded from the database afterwards.
+
+        Args:
+            user_id (int): The ID of the user.
+        """
+        with self._cond:
+            while user_id in self._bypassed:
+                self._cond.wait()
+            self._bypassed.add(user_id)
+        try:
+            self.flush()
+            with self._lock:
+                self._drop(user_id)
+            yield
+        finally:
+            with self._cond:
+                self._bypassed.discard(user_id)
+                self._cond.notify_all()
+
+    # ---- 生命周期 ----
+
+    def start(self):
+        """Start flushing in a background thread every `flush_interval` seconds."""
+        if self.flush_interval is None or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="cart-store-flush", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Background cart flush failed: {e}")
+
+    def close(self):
+        """Stop the background thread and flush the remaining dirty carts."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+                # 全部写入后日志为空，删除以免下次启动重放
+                if os.path.exists(self.journal_path) and not os.path.getsize(self.journal_path):
+                    os.remove(self.journal_path)
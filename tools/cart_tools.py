@@ -2,51 +2,181 @@
 @Time ： 2024-11-15
 @Auth ： Adam Lyu
 """
-from typing import Union, Dict, List
+from typing import Union, Dict, List, Optional
 from langchain_core.tools import tool
+import atexit
+import json
+import re
 import sqlite3
 import os
+import threading
+from tools.cart_store import WriteBackCartStore
+from utils.cache import LRUCache
+from utils.db_utils import database_key, write_transaction
+from utils.group_commit import get_group_writer
 from utils.logger import logger
+from utils.output_encoder import encode_output
 
 # 定义数据库路径
 db = os.path.join(os.path.dirname(__file__), "../data/ecommerce.db")
 
+# 购物车汇总缓存：按购物车缓存 view_cart 的结果，版本号为 cart.version
+_cart_cache = LRUCache(max_bytes=int(os.getenv("CART_CACHE_MAX_BYTES", 1024 * 1024)))
 
-def view_cart(user_id: int, conn=None) -> List[Dict]:
+# 购物车存储："sqlite" 每次修改直接写库；"memory" 使用写回内存存储 (tools/cart_store.py)，只作用于默认数据库
+CART_STORE = os.getenv("CART_STORE", "sqlite")
+CART_FLUSH_INTERVAL = float(os.getenv("CART_FLUSH_INTERVAL", 5))
+# 崩溃安全模式的日志文件；为空时内存中的修改只在下次 flush 后持久化
+CART_JOURNAL = os.getenv("CART_JOURNAL", "")
+
+_cart_store = None
+_cart_store_lock = threading.Lock()
+
+
+def get_cart_store(conn=None):
     """
-    View the contents of the user's shopping cart.
+    Return the write-back cart store serving the default database, starting it on first use.
+
+    Args:
+        conn: The connection the caller was given; calls on an explicit connection use SQL directly.
+    Returns:
+        WriteBackCartStore: The store, or None when carts are read and written with SQL.
+    """
+    global _cart_store
+    if conn is not None:
+        return None
+    if _cart_store is None and CART_STORE == "memory":
+        with _cart_store_lock:
+            if _cart_store is None:
+                store = WriteBackCartStore(db, flush_interval=CART_FLUSH_INTERVAL, journal_path=CART_JOURNAL or None)
+                store.start()
+                # 进程退出时写回剩余的修改
+                atexit.register(store.close)
+                _cart_store = store
+    return _cart_store
+
+
+def _empty_cart_summary() -> Dict:
+    return {"items": [], "item_count": 0, "grand_total": 0, "out_of_stock": False}
+
+
+def view_cart(user_id: int, conn=None) -> Dict:
+    """
+    View the contents of the user's shopping cart with its totals computed by the database.
+
+    The summary is cached per cart under `cart.version`, which the cart_products triggers bump on
+    every change to the cart (add_to_cart, remove_from_cart, checkout_order, ...). Prices and
+    out-of-stock flags are those read when the cart last changed; checkout_order re-reads both
+    before charging.
 
     Args:
         user_id (int): The ID of the user.
         conn:
     Returns:
-        List[Dict]: A list of products in the user's cart with their quantities.
+        Dict: `items` (id, name, price, quantity, subtotal and out_of_stock, true when the stock
+        cannot cover the quantity), `item_count` (total quantity), `grand_total` and
+        `out_of_stock` (true if any item is out of stock).
     """
-    if not conn:
+    store = get_cart_store(conn)
+    if store is not None:
+        return _view_stored_cart(store, user_id)
+
+    close_conn = conn is None
+    if close_conn:
         logger.info(f"Retrieving cart contents for user {user_id}.")
         conn = sqlite3.connect(db)
     cursor = conn.cursor()
 
     try:
-        query = """
-        SELECT p.id, p.name, p.price, cp.quantity
-        FROM cart_products cp
-        JOIN products p ON cp.product_id = p.id
-        WHERE cp.cart_id = (SELECT id FROM cart WHERE user_id = ?)
-        """
-        cursor.execute(query, (user_id,))
-        results = cursor.fetchall()
-        cart_items = [dict(zip([column[0] for column in cursor.description], row)) for row in results]
-        logger.info(f"User {user_id}'s cart contains {len(cart_items)} items.")
-        return cart_items
+        cursor.execute("SELECT id, version FROM cart WHERE user_id = ?", (user_id,))
+        cart = cursor.fetchone()
+        if not cart:
+            logger.info(f"User {user_id} does not have a cart.")
+            return _empty_cart_summary()
+        cart_id, cart_version = cart
+
+        # 命中缓存：购物车内容未变化（cart.version 由 cart_products 上的触发器递增）
+        db_key = database_key(conn)
+        cache_key = (db_key, cart_id)
+        if db_key is not None:
+            summary = _cart_cache.get(cache_key, cart_version)
+            if summary is not None:
+                return summary
+
+        # 一次查询同时得到明细行与整车汇总（窗口聚合）
+        cursor.execute(
+            """
+            SELECT p.id, p.name, p.price, cp.quantity,
+                   ROUND(p.price * cp.quantity, 2) AS subtotal,
+                   p.stock < cp.quantity AS out_of_stock,
+                   SUM(cp.quantity) OVER () AS item_count,
+                   ROUND(SUM(p.price * cp.quantity) OVER (), 2) AS grand_total
+            FROM cart_products cp
+            JOIN products p ON cp.product_id = p.id
+            WHERE cp.cart_id = ?
+            ORDER BY cp.id
+            """,
+            (cart_id,),
+        )
+        rows = cursor.fetchall()
+        summary = _empty_cart_summary()
+        for product_id, name, price, quantity, subtotal, out_of_stock, item_count, grand_total in rows:
+            summary["items"].append({"id": product_id, "name": name, "price": price, "quantity": quantity,
+                                     "subtotal": subtotal, "out_of_stock": bool(out_of_stock)})
+            summary["item_count"], summary["grand_total"] = item_count, grand_total
+        summary["out_of_stock"] = any(item["out_of_stock"] for item in summary["items"])
+
+        if db_key is not None:
+            _cart_cache.put(cache_key, summary, cart_version)
+        logger.info(f"User {user_id}'s cart contains {len(summary['items'])} items.")
+        return summary
     except Exception as e:
         logger.error(f"Error viewing cart: {e}")
         raise
     finally:
-        if not conn:
+        if close_conn:
             conn.close()
 
 
+def _view_stored_cart(store: WriteBackCartStore, user_id: int) -> Dict:
+    """Build the view_cart summary from an in-memory cart, reading only the product details."""
+    quantities = store.items(user_id)
+    summary = _empty_cart_summary()
+    if not quantities:
+        return summary
+    conn = sqlite3.connect(db)
+    try:
+        rows = conn.execute(
+            """
+            SELECT p.id, p.name, p.price, p.stock
+            FROM json_each(?) j
+            JOIN products p ON p.id = j.value
+            ORDER BY j.key
+            """,
+            (json.dumps(list(quantities)),),
+        ).fetchall()
+    finally:
+        conn.close()
+    for product_id, name, price, stock in rows:
+        quantity = quantities[product_id]
+        summary["items"].append({"id": product_id, "name": name, "price": price, "quantity": quantity,
+                                 "subtotal": round(price * quantity, 2), "out_of_stock": stock < quantity})
+    summary["item_count"] = sum(item["quantity"] for item in summary["items"])
+    summary["grand_total"] = round(sum(item["price"] * item["quantity"] for item in summary["items"]), 2)
+    summary["out_of_stock"] = any(item["out_of_stock"] for item in summary["items"])
+    return summary
+
+
+def get_cart_cache_stats() -> Dict[str, int]:
+    """
+    Report the cart summary cache counters.
+
+    Returns:
+        Dict[str, int]: `hits`, `misses`, `evictions`, `entries`, `bytes` and `max_bytes`.
+    """
+    return _cart_cache.stats()
+
+
 def add_to_cart(user_id: int, product_id: int, quantity: int = 1, conn=None) -> str:
     """
     Add a product to the user's shopping cart.
@@ -58,48 +188,43 @@ def add_to_cart(user_id: int, product_id: int, quantity: int = 1, conn=None) ->
     Returns:
         str: Confirmation message.
     """
-    if conn is None:
+    store = get_cart_store(conn)
+    if store is not None:
+        store.update(user_id, {product_id: quantity})
+        logger.info(f"Product {product_id} added to cart.")
+        return f"Product {product_id} successfully added to your cart."
+
+    writer = get_group_writer(db, conn)
+    if writer is not None:
+        return writer.call(add_to_cart, user_id, product_id, quantity)
+
+    close_conn = conn is None
+    if close_conn:
         logger.info(f"Connecting to database to retrieve cart for user {user_id}.")
         conn = sqlite3.connect(db)
-    cursor = conn.cursor()
 
     try:
-        # 获取用户的购物车 ID
-        cursor.execute("SELECT id FROM cart WHERE user_id = ?", (user_id,))
-        cart_id = cursor.fetchone()
-
-        if not cart_id:
-            # 如果用户购物车不存在，创建新的购物车
-            cursor.execute("INSERT INTO cart (user_id) VALUES (?)", (user_id,))
-            conn.commit()  # 提交以确保 ID 可用
-            cart_id = cursor.lastrowid
-        else:
-            cart_id = cart_id[0]
-
-        # 确保 cart_products 表具有唯一约束
-        cursor.execute("""
-            PRAGMA index_list(cart_products);
-        """)
-        indexes = cursor.fetchall()
-        unique_constraint_found = any("cart_id" in idx[1] and "product_id" in idx[1] for idx in indexes)
-
-        if not unique_constraint_found:
-            cursor.execute("""
-                CREATE UNIQUE INDEX IF NOT EXISTS idx_cart_product 
-                ON cart_products(cart_id, product_id);
-            """)
-            conn.commit()
-
-        # 添加或更新购物车中的产品
-        cursor.execute(
-            """
-            INSERT INTO cart_products (cart_id, product_id, quantity)
-            VALUES (?, ?, ?)
-            ON CONFLICT(cart_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
-            """,
-            (cart_id, product_id, quantity),
-        )
-        conn.commit()
+        with write_transaction(conn) as cursor:
+            # 获取用户的购物车 ID
+            cursor.execute("SELECT id FROM cart WHERE user_id = ?", (user_id,))
+            cart_id = cursor.fetchone()
+
+            if not cart_id:
+                # 如果用户购物车不存在，创建新的购物车（与添加产品在同一事务中提交）
+                cursor.execute("INSERT INTO cart (user_id) VALUES (?)", (user_id,))
+                cart_id = cursor.lastrowid
+            else:
+                cart_id = cart_id[0]
+
+            # 添加或更新购物车中的产品（唯一索引 idx_cart_product 由迁移 0002 创建）
+            cursor.execute(
+                """
+                INSERT INTO cart_products (cart_id, product_id, quantity)
+                VALUES (?, ?, ?)
+                ON CONFLICT(cart_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+                """,
+                (cart_id, product_id, quantity),
+            )
         logger.info(f"Product {product_id} added to cart.")
         return f"Product {product_id} successfully added to your cart."
     except sqlite3.OperationalError as op_err:
@@ -109,7 +234,7 @@ def add_to_cart(user_id: int, product_id: int, quantity: int = 1, conn=None) ->
         logger.error(f"Error adding to cart: {e}")
         raise
     finally:
-        if not conn:
+        if close_conn:
             conn.close()
 
 
@@ -125,25 +250,38 @@ def remove_from_cart(user_id: int, product_id: int, conn=None) -> str:
     Returns:
         str: Confirmation message.
     """
-    if not conn:
+    store = get_cart_store(conn)
+    if store is not None:
+        if store.remove(user_id, product_id):
+            logger.info(f"Product {product_id} removed from cart.")
+            return f"Product {product_id} successfully removed from your cart."
+        logger.warning(f"Product {product_id} not found in cart.")
+        return f"Product {product_id} is not in your cart."
+
+    writer = get_group_writer(db, conn)
+    if writer is not None:
+        return writer.call(remove_from_cart, user_id, product_id)
+
+    close_conn = conn is None
+    if close_conn:
         logger.info(f"Retrieving cart contents for user {user_id}.")
         conn = sqlite3.connect(db)
-    cursor = conn.cursor()
 
     try:
-        # 获取用户的购物车 ID
-        cursor.execute("SELECT id FROM cart WHERE user_id = ?", (user_id,))
-        cart_id = cursor.fetchone()
+        with write_transaction(conn) as cursor:
+            # 获取用户的购物车 ID
+            cursor.execute("SELECT id FROM cart WHERE user_id = ?", (user_id,))
+            cart_id = cursor.fetchone()
 
-        if not cart_id:
-            logger.warning(f"User {user_id} does not have a cart.")
-            return f"No cart found for user {user_id}."
+            if not cart_id:
+                logger.warning(f"User {user_id} does not have a cart.")
+                return f"No cart found for user {user_id}."
 
-        # 删除购物车中的产品
-        cursor.execute("DELETE FROM cart_products WHERE cart_id = ? AND product_id = ?", (cart_id[0], product_id))
-        conn.commit()
+            # 删除购物车中的产品
+            cursor.execute("DELETE FROM cart_products WHERE cart_id = ? AND product_id = ?", (cart_id[0], product_id))
+            removed = cursor.rowcount
 
-        if cursor.rowcount > 0:
+        if removed > 0:
             logger.info(f"Product {product_id} removed from cart.")
             return f"Product {product_id} successfully removed from your cart."
         else:
@@ -153,12 +291,247 @@ def remove_from_cart(user_id: int, product_id: int, conn=None) -> str:
         logger.error(f"Error removing from cart: {e}")
         raise
     finally:
-        if not conn:
+        if close_conn:
+            conn.close()
+
+
+def _merge_quantity_changes(changes: List[Union[Dict, tuple, list]]) -> Dict[int, int]:
+    """
+    Normalize (product_id, quantity delta) pairs and sum the deltas of repeated products.
+
+    Args:
+        changes: Dicts with `product_id` and `quantity`, or (product_id, quantity) pairs.
+    Returns:
+        Dict[int, int]: Summed quantity delta per product ID, in first-seen order.
+    Raises:
+        ValueError: If a change is malformed.
+    """
+    merged: Dict[int, int] = {}
+    for change in changes:
+        if isinstance(change, dict):
+            product_id, delta = change.get("product_id"), change.get("quantity")
+        elif isinstance(change, (tuple, list)) and len(change) == 2:
+            product_id, delta = change
+        else:
+            raise ValueError(f"Invalid cart change: {change!r}")
+        if isinstance(product_id, bool) or not isinstance(product_id, int) \
+                or isinstance(delta, bool) or not isinstance(delta, int):
+            raise ValueError(f"Invalid cart change: {change!r}")
+        merged[product_id] = merged.get(product_id, 0) + delta
+    return merged
+
+
+def update_cart_items(user_id: int, changes: List[Union[Dict, tuple, list]], conn=None) -> str:
+    """
+    Apply several quantity changes to the user's shopping cart in one transaction.
+
+    Positive deltas add products (or increase their quantity), negative deltas decrease it;
+    products whose quantity drops to zero or below are removed. Either every change is applied
+    or none is.
+
+    Args:
+        user_id (int): The ID of the user.
+        changes: Dicts with `product_id` and `quantity` (the delta), or (product_id, quantity) pairs.
+        conn:
+    Returns:
+        str: Confirmation message.
+    """
+    merged = _merge_quantity_changes(changes)
+    if not merged:
+        return "No cart changes to apply."
+
+    store = get_cart_store(conn)
+    writer = get_group_writer(db, conn) if store is None else None
+    if writer is not None:
+        return writer.call(update_cart_items, user_id, changes)
+
+    close_conn = conn is None
+    if close_conn:
+        logger.info(f"Connecting to database to update cart for user {user_id}.")
+        conn = sqlite3.connect(db)
+    cursor = conn.cursor()
+
+    try:
+        # 一次查询校验所有产品是否存在
+        cursor.execute(
+            """
+            SELECT j.value FROM json_each(?) j
+            WHERE NOT EXISTS (SELECT 1 FROM products p WHERE p.id = j.value)
+            """,
+            (json.dumps(list(merged)),),
+        )
+        missing = [row[0] for row in cursor.fetchall()]
+        if missing:
+            logger.warning(f"Cart update for user {user_id} references unknown products {missing}.")
+            return f"Products {', '.join(map(str, missing))} do not exist. No changes were made to your cart."
+
+        if store is not None:
+            removed = len(store.update(user_id, merged))
+            logger.info(f"Applied {len(merged)} cart changes for user {user_id}, {removed} products removed.")
+            return f"Cart updated: {len(merged)} products changed, {removed} removed."
+
+        with write_transaction(conn) as cursor:
+            cursor.execute("SELECT id FROM cart WHERE user_id = ?", (user_id,))
+            cart_id = cursor.fetchone()
+            if not cart_id:
+                cursor.execute("INSERT INTO cart (user_id) VALUES (?)", (user_id,))
+                cart_id = cursor.lastrowid
+            else:
+                cart_id = cart_id[0]
+
+            # 所有增量在同一事务中写入，数量归零或为负的产品随后一次性删除
+            cursor.executemany(
+                """
+                INSERT INTO cart_products (cart_id, product_id, quantity)
+                VALUES (?, ?, ?)
+                ON CONFLICT(cart_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+                """,
+                [(cart_id, product_id, delta) for product_id, delta in merged.items()],
+            )
+            cursor.execute("DELETE FROM cart_products WHERE cart_id = ? AND quantity <= 0", (cart_id,))
+            removed = cursor.rowcount
+        logger.info(f"Applied {len(merged)} cart changes for user {user_id}, {removed} products removed.")
+        return f"Cart updated: {len(merged)} products changed, {removed} removed."
+    except sqlite3.OperationalError as op_err:
+        logger.error(f"Database operational error: {op_err}")
+        return "Database operation failed. Please try again."
+    except Exception as e:
+        logger.error(f"Error updating cart: {e}")
+        raise
+    finally:
+        if close_conn:
+            conn.close()
+
+
+def scale_cart_quantities(user_id: int, factor: int, conn=None) -> str:
+    """
+    Multiply the quantity of every product in the user's shopping cart, e.g. factor 2 doubles it.
+
+    Args:
+        user_id (int): The ID of the user.
+        factor (int): Positive whole multiplier.
+        conn:
+    Returns:
+        str: Confirmation message.
+    """
+    if isinstance(factor, bool) or not isinstance(factor, int) or factor < 1:
+        raise ValueError("factor must be a positive integer.")
+
+    store = get_cart_store(conn)
+    if store is not None:
+        updated = store.scale(user_id, factor)
+        if not updated:
+            logger.warning(f"User {user_id}'s cart is empty, nothing to scale.")
+            return "Your cart is empty."
+        logger.info(f"Scaled {updated} cart items by {factor} for user {user_id}.")
+        return f"Quantities of {updated} products in your cart multiplied by {factor}."
+
+    writer = get_group_writer(db, conn)
+    if writer is not None:
+        return writer.call(scale_cart_quantities, user_id, factor)
+
+    close_conn = conn is None
+    if close_conn:
+        logger.info(f"Connecting to database to scale cart for user {user_id}.")
+        conn = sqlite3.connect(db)
+
+    try:
+        with write_transaction(conn) as cursor:
+            cursor.execute(
+                """
+                UPDATE cart_products SET quantity = quantity * ?
+                WHERE cart_id = (SELECT id FROM cart WHERE user_id = ?)
+                """,
+                (factor, user_id),
+            )
+            updated = cursor.rowcount
+        if not updated:
+            logger.warning(f"User {user_id}'s cart is empty, nothing to scale.")
+            return "Your cart is empty."
+        logger.info(f"Scaled {updated} cart items by {factor} for user {user_id}.")
+        return f"Quantities of {updated} products in your cart multiplied by {factor}."
+    except Exception as e:
+        logger.error(f"Error scaling cart: {e}")
+        raise
+    finally:
+        if close_conn:
+            conn.close()
+
+
+def remove_cart_items_matching(user_id: int, category: Optional[str] = None, name: Optional[str] = None,
+                               conn=None) -> str:
+    """
+    Remove every product in the user's shopping cart that matches a category and/or a name fragment.
+
+    Args:
+        user_id (int): The ID of the user.
+        category (str): Exact category (case-insensitive).
+        name (str): Text contained in the product name (case-insensitive), e.g. "phone".
+        conn:
+    Returns:
+        str: Confirmation message listing the removed product IDs.
+    """
+    if not category and not name:
+        raise ValueError("category or name is required.")
+
+    conditions, params = [], [user_id]
+    if category:
+        conditions.append("p.category = ? COLLATE NOCASE")
+        params.append(category)
+    if name:
+        # 转义 LIKE 通配符，按名称片段匹配
+        conditions.append("p.name LIKE ? ESCAPE '\\'")
+        params.append("%" + re.sub(r"([%_\\])", r"\\\1", name) + "%")
+
+    store = get_cart_store(conn)
+    if store is not None:
+        # 按产品属性匹配需要 SQL：先写回并暂停该用户的内存购物车，删除后重新加载
+        with store.bypass(user_id):
+            return _remove_cart_items_matching(user_id, conditions, params, category, name, conn)
+    return _remove_cart_items_matching(user_id, conditions, params, category, name, conn)
+
+
+def _remove_cart_items_matching(user_id, conditions, params, category, name, conn=None) -> str:
+    writer = get_group_writer(db, conn)
+    if writer is not None:
+        return writer.call(_remove_cart_items_matching, user_id, conditions, params, category, name)
+
+    close_conn = conn is None
+    if close_conn:
+        logger.info(f"Connecting to database to remove matching cart items for user {user_id}.")
+        conn = sqlite3.connect(db)
+
+    try:
+        with write_transaction(conn) as cursor:
+            # 单条语句删除：逐行按主键关联产品，只检查购物车内的产品
+            cursor.execute(
+                f"""
+                DELETE FROM cart_products
+                WHERE cart_id = (SELECT id FROM cart WHERE user_id = ?)
+                AND EXISTS (
+                    SELECT 1 FROM products p
+                    WHERE p.id = cart_products.product_id AND {' AND '.join(conditions)}
+                )
+                RETURNING product_id
+                """,
+                params,
+            )
+            removed = sorted(row[0] for row in cursor.fetchall())
+        if not removed:
+            logger.warning(f"No products in user {user_id}'s cart match category={category!r} name={name!r}.")
+            return "No products in your cart match."
+        logger.info(f"Removed products {removed} from user {user_id}'s cart.")
+        return f"Products {', '.join(map(str, removed))} successfully removed from your cart."
+    except Exception as e:
+        logger.error(f"Error removing matching products from cart: {e}")
+        raise
+    finally:
+        if close_conn:
             conn.close()
 
 
 @tool
-def view_cart_tool(user_id: int) -> List[Dict]:
+def view_cart_tool(user_id: int) -> str:
     """
     Retrieve the contents of a user's shopping cart.
 
@@ -166,9 +539,11 @@ def view_cart_tool(user_id: int) -> List[Dict]:
         user_id (int): The ID of the user.
 
     Returns:
-        List[Dict]: A list of products in the user's cart with their details.
+        str: The products in the user's cart as a table (a header line, then one `|`-separated
+        line per product with its subtotal and out_of_stock flag), followed by the item count, the
+        grand total and whether any product is out of stock. Report these totals as given.
     """
-    return view_cart(user_id)
+    return encode_output(view_cart(user_id))
 
 
 @tool
@@ -202,6 +577,65 @@ def remove_from_cart_tool(user_id: int, product_id: int) -> str:
     return remove_from_cart(user_id, product_id)
 
 
+@tool
+def update_cart_items_tool(user_id: int, changes: List[Dict[str, int]]) -> str:
+    """
+    Apply several cart changes at once, in a single confirmation, instead of calling
+    add_to_cart_tool / remove_from_cart_tool once per product.
+
+    Args:
+        user_id (int): The ID of the user.
+        changes (List[Dict[str, int]]): One entry per product: {"product_id": 5, "quantity": 2}.
+            The quantity is a delta: positive adds, negative removes that many; a product whose
+            quantity reaches zero leaves the cart.
+
+    Returns:
+        str: A confirmation message indicating success or failure.
+    """
+    try:
+        return update_cart_items(user_id, changes)
+    except ValueError as e:
+        return str(e)
+
+
+@tool
+def scale_cart_tool(user_id: int, factor: int) -> str:
+    """
+    Multiply the quantity of every product in a user's cart, e.g. factor 2 to double the cart.
+
+    Args:
+        user_id (int): The ID of the user.
+        factor (int): Positive whole multiplier.
+
+    Returns:
+        str: A confirmation message indicating success or failure.
+    """
+    try:
+        return scale_cart_quantities(user_id, factor)
+    except ValueError as e:
+        return str(e)
+
+
+@tool
+def remove_matching_from_cart_tool(user_id: int, category: Optional[str] = None, name: Optional[str] = None) -> str:
+    """
+    Remove every product in a user's cart of a category and/or whose name contains a text,
+    e.g. name="phone" to remove phone-related products.
+
+    Args:
+        user_id (int): The ID of the user.
+        category (str, optional): Category of the products to remove.
+        name (str, optional): Text the product names contain.
+
+    Returns:
+        str: A confirmation message listing the removed product IDs.
+    """
+    try:
+        return remove_cart_items_matching(user_id, category, name)
+    except ValueError as e:
+        return str(e)
+
+
 if __name__ == "__main__":
     # 测试代码
     # user_id: 1
@@ -0,0 +1,500 @@
+"""
+@Time ： 2024-11-21
+@Auth ： Adam Lyu
+@Desc ： Memory-mapped columnar snapshot of the product catalog for vectorized filtering.
+
+The snapshot stores id, price, stock and category code as NumPy arrays, and product names as an
+offsets + bytes buffer. Each generation is written to its own directory and published by
+atomically replacing the CURRENT pointer, so every worker process maps the same files read-only
+and shares them through the page cache. A refresh only re-reads the products listed in
+`product_changes` since the previous one. When those changes only touch prices and stocks, the
+values are written into the current generation's mapped files in place; a new generation is only
+published when products are added, removed, renamed or recategorized, or on a full export.
+
+Each snapshot directory registers itself in `product_change_consumers`; the change log is only
+written while a consumer exists and is pruned up to the oldest consumer's applied change.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import re
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from utils.db_utils import database_key, immediate_transaction
+from utils.logger import logger
+
+try:
+    import numpy as np
+except ImportError:  # numpy 是可选依赖，没有时搜索使用 SQL
+    np = None
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl，原地更新时不加文件锁
+    fcntl = None
+
+# 默认快照目录，每个数据库使用其中的一个子目录
+SNAPSHOT_DIR = os.path.join(os.path.dirname(__file__), "../data/catalog_snapshot")
+# 快照中的列，对应 products 表
+SNAPSHOT_FIELDS = ("id", "name", "price", "stock", "category")
+# 变更超过快照行数的该比例时全量重建
+FULL_REBUILD_RATIO = 0.25
+# 保留的历史版本数量（其他进程可能仍在读取）
+KEEP_GENERATIONS = 2
+
+_snapshots: Dict[Tuple[str, str], "CatalogSnapshot"] = {}
+_snapshots_lock = threading.Lock()
+
+
+def _gather_segments(offsets, buffer, rows):
+    """
+    Copy the variable-length segments of the given rows into a new offsets + bytes buffer.
+
+    Args:
+        offsets: Start offsets of every segment, with the buffer length appended.
+        buffer: The bytes buffer as a uint8 array.
+        rows: Row indices to keep, in output order.
+
+    Returns:
+        Tuple: The new offsets and buffer.
+    """
+    starts = offsets[rows]
+    lengths = offsets[rows + 1] - starts
+    new_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+    positions = np.repeat(starts - new_offsets[:-1], lengths) + np.arange(new_offsets[-1], dtype=np.int64)
+    return new_offsets, np.asarray(buffer)[positions]
+
+
+def _encode_segments(texts: List[str], separator: bytes = b""):
+    """
+    Encode strings into an offsets + bytes buffer.
+
+    Args:
+        texts (List[str]): The strings to encode.
+        separator (bytes): Bytes appended to every segment.
+
+    Returns:
+        Tuple: The offsets and buffer.
+    """
+    encoded = [text.encode("utf-8") + separator for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(segment) for segment in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+class CatalogSnapshot:
+    """
+    One generation of the columnar catalog.
+
+    Rows are in no particular order; searches sort by (price, id) like the SQL path. Ids, names and
+    categories never change once published; prices and stocks are patched in place, so a search
+    running during a patch may see part of the new values.
+    """
+
+    def __init__(self, directory: str, seq: int, categories: List[str], columns: Dict):
+        self.directory = directory
+        self.seq = seq
+        self.categories = categories
+        self.ids = columns["ids"]
+        self.prices = columns["prices"]
+        self.stocks = columns["stocks"]
+        self.category_codes = columns["category_codes"]
+        self.name_offsets = columns["name_offsets"]
+        self.name_bytes = columns["name_bytes"]
+        # 用于不区分大小写匹配的名称，每个名称以 \0 结尾，避免匹配跨越两个名称
+        self.folded_offsets = columns["folded_offsets"]
+        self.folded_bytes = columns["folded_bytes"]
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def load(cls, root: str, database: Optional[str] = None) -> Optional["CatalogSnapshot"]:
+        """
+        Memory-map the generation published in `root/CURRENT`.
+
+        Args:
+            root (str): The snapshot directory.
+            database (str): Only load a generation exported from this database file.
+
+        Returns:
+            Optional[CatalogSnapshot]: The snapshot, or None if nothing (for `database`) has been published.
+        """
+        try:
+            with open(os.path.join(root, "CURRENT"), encoding="utf-8") as pointer:
+                directory = os.path.join(root, pointer.read().strip())
+            with open(os.path.join(directory, "meta.json"), encoding="utf-8") as meta_file:
+                meta = json.load(meta_file)
+        except FileNotFoundError:
+            return None
+        if database is not None and meta.get("database") != database:
+            return None
+
+        columns = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            for name in ("ids", "prices", "stocks", "category_codes", "name_offsets", "name_bytes",
+                         "folded_offsets", "folded_bytes")
+        }
+        return cls(directory, meta["seq"], meta["categories"], columns)
+
+    def name(self, row: int) -> str:
+        return bytes(self.name_bytes[self.name_offsets[row]:self.name_offsets[row + 1]]).decode("utf-8")
+
+    def match_name(self, text: str):
+        """
+        Find the rows whose name contains `text`, ignoring case.
+
+        Args:
+            text (str): The substring to look for.
+
+        Returns:
+            The matching row indices.
+        """
+        needle = re.escape(text.casefold().encode("utf-8"))
+        positions = np.fromiter(
+            (match.start() for match in re.finditer(needle, memoryview(self.folded_bytes))), dtype=np.int64
+        )
+        return np.unique(np.searchsorted(self.folded_offsets, positions, side="right") - 1)
+
+    def search(
+            self,
+            name: Optional[str] = None,
+            category: Optional[str] = None,
+            min_price: Optional[float] = None,
+            max_price: Optional[float] = None,
+            after: Optional[Tuple[float, int]] = None,
+            limit: int = 20,
+    ):
+        """
+        Filter, sort by (price, id) and take the first `limit` rows, all vectorized.
+
+        Args:
+            name (str): Case-insensitive substring of the product name.
+            category (str): Exact category.
+            min_price (float): Lowest price, inclusive.
+            max_price (float): Highest price, inclusive.
+            after (Tuple[float, int]): Keyset position (price, id) to continue after.
+            limit (int): Maximum number of rows.
+
+        Returns:
+            The row indices in (price, id) order.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if category:
+            if category not in self.categories:
+                return np.zeros(0, dtype=np.int64)
+            mask &= self.category_codes == self.categories.index(category)
+        if min_price is not None:
+            mask &= self.prices >= min_price
+        if max_price is not None:
+            mask &= self.prices <= max_price
+        if after is not None:
+            after_price, after_id = after
+            mask &= (self.prices > after_price) | ((self.prices == after_price) & (self.ids > after_id))
+        if name:
+            name_mask = np.zeros(len(self), dtype=bool)
+            name_mask[self.match_name(name)] = True
+            mask &= name_mask
+
+        rows = np.flatnonzero(mask)
+        prices = self.prices[rows]
+        if len(rows) > limit:
+            # 先按价格取前 k 个（包含并列价格），再精确排序
+            threshold = prices[np.argpartition(prices, limit - 1)[:limit]].max()
+            rows = rows[prices <= threshold]
+            prices = self.prices[rows]
+        order = np.lexsort((self.ids[rows], prices))
+        return rows[order][:limit]
+
+    def rows(self, rows, fields: List[str]) -> List[Dict]:
+        """
+        Materialize rows as dictionaries with the requested snapshot fields.
+
+        Args:
+            rows: Row indices.
+            fields (List[str]): Fields from SNAPSHOT_FIELDS.
+
+        Returns:
+            List[Dict]: One dictionary per row.
+        """
+        getters = {
+            "id": lambda row: int(self.ids[row]),
+            "name": self.name,
+            "price": lambda row: float(self.prices[row]),
+            "stock": lambda row: int(self.stocks[row]),
+            "category": lambda row: self.categories[self.category_codes[row]],
+        }
+        return [{field: getters[field](row) for field in fields} for row in rows]
+
+
+def _database_tag(database: str) -> str:
+    return hashlib.sha1(database.encode("utf-8")).hexdigest()[:12]
+
+
+def _consumer_seq(cursor, consumer: str) -> Optional[int]:
+    # 消费者已应用的最后变更序号；未登记时返回 None
+    cursor.execute("SELECT seq FROM product_change_consumers WHERE consumer = ?", (consumer,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _acknowledge_changes(database: str, consumer: str, seq: int):
+    """
+    Record that `consumer` has applied the changes up to `seq` (registering it on first use) and
+    prune the log up to the oldest consumer, in a transaction on a connection of our own.
+    """
+    conn = sqlite3.connect(database)
+    try:
+        with immediate_transaction(conn) as cursor:
+            cursor.execute("""
+            INSERT INTO product_change_consumers (consumer, seq) VALUES (?, ?)
+            ON CONFLICT (consumer) DO UPDATE SET seq = MAX(seq, excluded.seq)
+            """, (consumer, seq))
+            cursor.execute("""
+            DELETE FROM product_changes WHERE seq <= (SELECT MIN(seq) FROM product_change_consumers)
+            """)
+    finally:
+        conn.close()
+
+
+def _latest_change_seq(cursor) -> int:
+    # sqlite_sequence 保留最后分配的序号，清理过的变更日志不会让它回退
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'product_changes'")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def _columns_from_rows(rows: List[Tuple], categories: List[str]) -> Dict:
+    """
+    Build snapshot columns from (id, name, price, stock, category) rows, extending `categories` in place.
+    """
+    codes = {category: code for code, category in enumerate(categories)}
+    for row in rows:
+        if row[4] not in codes:
+            codes[row[4]] = len(categories)
+            categories.append(row[4])
+
+    name_offsets, name_bytes = _encode_segments([row[1] for row in rows])
+    folded_offsets, folded_bytes = _encode_segments([row[1].casefold() for row in rows], b"\0")
+    return {
+        "ids": np.array([row[0] for row in rows], dtype=np.int64),
+        "prices": np.array([row[2] for row in rows], dtype=np.float64),
+        "stocks": np.array([row[3] for row in rows], dtype=np.int64),
+        "category_codes": np.array([codes[row[4]] for row in rows], dtype=np.int32),
+        "name_offsets": name_offsets,
+        "name_bytes": name_bytes,
+        "folded_offsets": folded_offsets,
+        "folded_bytes": folded_bytes,
+    }
+
+
+def _merge_columns(snapshot: CatalogSnapshot, changed_ids, rows: List[Tuple], categories: List[str]) -> Dict:
+    """
+    Copy the unchanged rows of `snapshot` and append the re-read changed rows.
+    """
+    keep = np.flatnonzero(~np.isin(snapshot.ids, changed_ids))
+    added = _columns_from_rows(rows, categories)
+
+    merged = {
+        name: np.concatenate([np.asarray(getattr(snapshot, name))[keep], added[name]])
+        for name in ("ids", "prices", "stocks", "category_codes")
+    }
+    for prefix in ("name", "folded"):
+        offsets, buffer = _gather_segments(
+            np.asarray(getattr(snapshot, f"{prefix}_offsets")), getattr(snapshot, f"{prefix}_bytes"), keep
+        )
+        merged[f"{prefix}_offsets"] = np.concatenate([offsets, offsets[-1] + added[f"{prefix}_offsets"][1:]])
+        merged[f"{prefix}_bytes"] = np.concatenate([buffer, added[f"{prefix}_bytes"]])
+    return merged
+
+
+def _patch_positions(snapshot: CatalogSnapshot, changed_ids, rows: List[Tuple]):
+    """
+    Find the snapshot rows of the re-read products if the changes only touched prices and stocks.
+
+    Returns:
+        The row positions in the order of `rows`, or None if a product was added, removed, renamed
+        or moved to another category.
+    """
+    positions = np.flatnonzero(np.isin(snapshot.ids, changed_ids))
+    # 新增的产品不在快照中，删除的产品读不到；两者都需要发布新版本
+    if not len(positions) == len(rows) == len(changed_ids):
+        return None
+    positions = positions[np.argsort(snapshot.ids[positions])]
+    rows = sorted(rows)
+    for position, row in zip(positions, rows):
+        if snapshot.name(position) != row[1] or snapshot.categories[snapshot.category_codes[position]] != row[4]:
+            return None
+    return positions, rows
+
+
+@contextmanager
+def _generation_lock(directory: str):
+    # 同一版本的原地更新在进程间串行执行
+    with open(os.path.join(directory, "patch.lock"), "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def _patch_in_place(snapshot: CatalogSnapshot, seq: int, positions, rows: List[Tuple]) -> CatalogSnapshot:
+    """
+    Write the new prices and stocks into the mapped files of `snapshot` and advance its seq.
+
+    Every process mapping the generation sees the new values through the shared page cache.
+    A patch older than the one already applied is skipped.
+    """
+    meta_path = os.path.join(snapshot.directory, "meta.json")
+    with _generation_lock(snapshot.directory):
+        with open(meta_path, encoding="utf-8") as meta_file:
+            meta = json.load(meta_file)
+        if meta["seq"] < seq:
+            for name, values in (("prices", [row[2] for row in rows]), ("stocks", [row[3] for row in rows])):
+                column = np.load(os.path.join(snapshot.directory, f"{name}.npy"), mmap_mode="r+")
+                column[positions] = values
+                column.flush()
+                del column
+
+            meta["seq"] = seq
+            staging = os.path.join(snapshot.directory, f"meta.{uuid.uuid4().hex}")
+            with open(staging, "w", encoding="utf-8") as meta_file:
+                json.dump(meta, meta_file, ensure_ascii=False)
+            os.replace(staging, meta_path)
+    return CatalogSnapshot(snapshot.directory, max(meta["seq"], seq), snapshot.categories, {
+        name: getattr(snapshot, name)
+        for name in ("ids", "prices", "stocks", "category_codes", "name_offsets", "name_bytes",
+                     "folded_offsets", "folded_bytes")
+    })
+
+
+def _publish(root: str, database: str, seq: int, categories: List[str], columns: Dict) -> CatalogSnapshot:
+    """
+    Write a generation into a fresh directory and atomically point CURRENT at it.
+    """
+    os.makedirs(root, exist_ok=True)
+    staging = os.path.join(root, f"tmp-{os.getpid()}-{uuid.uuid4().hex}")
+    os.makedirs(staging)
+    for name, array in columns.items():
+        np.save(os.path.join(staging, f"{name}.npy"), array)
+    with open(os.path.join(staging, "meta.json"), "w", encoding="utf-8") as meta_file:
+        json.dump({"seq": seq, "database": database, "categories": categories}, meta_file, ensure_ascii=False)
+
+    generation = f"gen-{seq:012d}-{_database_tag(database)}"
+    try:
+        os.rename(staging, os.path.join(root, generation))
+    except OSError:
+        # 其他进程已经发布了相同版本
+        shutil.rmtree(staging, ignore_errors=True)
+
+    pointer = os.path.join(root, f"CURRENT.{uuid.uuid4().hex}")
+    with open(pointer, "w", encoding="utf-8") as pointer_file:
+        pointer_file.write(generation)
+    os.replace(pointer, os.path.join(root, "CURRENT"))
+
+    # 清理旧版本；已映射旧文件的进程在 Linux/macOS 上仍可继续读取
+    generations = sorted(entry for entry in os.listdir(root) if entry.startswith("gen-"))
+    for stale in generations[:-KEEP_GENERATIONS]:
+        shutil.rmtree(os.path.join(root, stale), ignore_errors=True)
+    return CatalogSnapshot.load(root, database)
+
+
+def refresh_snapshot(conn, root: str = SNAPSHOT_DIR) -> CatalogSnapshot:
+    """
+    Bring the snapshot in `root` up to date with the database.
+
+    Only products changed since the published generation are re-read; a full export is done when
+    there is no snapshot yet, when the change log does not cover it or when too many products changed.
+    Price and stock changes are patched into the published generation instead of publishing a new one.
+    The change log is registered, acknowledged and pruned on a separate connection, and skipped
+    while `conn` is inside a transaction; `conn` itself is only read.
+
+    Args:
+        conn: SQLite connection to a database file.
+        root (str): The snapshot directory.
+
+    Returns:
+        CatalogSnapshot: The current snapshot.
+    """
+    database = database_key(conn)
+    root = os.path.abspath(root)
+    cursor = conn.cursor()
+    acknowledged = _consumer_seq(cursor, root)
+    track_changes = not conn.in_transaction
+    if acknowledged is None and track_changes:
+        # 先登记再导出：登记之后的变更都会写入日志
+        _acknowledge_changes(database, root, _latest_change_seq(cursor))
+
+    seq = _latest_change_seq(cursor)
+    snapshot = CatalogSnapshot.load(root, database)
+    # 只有日志保留了快照之后的全部变更时才能增量刷新
+    incremental = snapshot is not None and acknowledged is not None and snapshot.seq >= acknowledged
+    if incremental and snapshot.seq == seq:
+        return snapshot
+
+    changed_ids = []
+    if incremental:
+        cursor.execute("SELECT DISTINCT product_id FROM product_changes WHERE seq > ? AND seq <= ?",
+                       (snapshot.seq, seq))
+        changed_ids = [row[0] for row in cursor.fetchall()]
+
+    if not incremental or len(changed_ids) > max(len(snapshot), 1) * FULL_REBUILD_RATIO:
+        logger.info(f"Building full catalog snapshot at change {seq}.")
+        cursor.execute("""
+        SELECT id, name, price, stock, category FROM products -- allow-full-scan: full snapshot export
+        """)
+        categories = []
+        snapshot = _publish(root, database, seq, categories, _columns_from_rows(cursor.fetchall(), categories))
+    else:
+        cursor.execute("""
+        SELECT id, name, price, stock, category FROM products
+        WHERE id IN (SELECT value FROM json_each(?))
+        """, (json.dumps(changed_ids),))
+        rows = cursor.fetchall()
+        changed_ids = np.array(changed_ids, dtype=np.int64)
+        patch = _patch_positions(snapshot, changed_ids, rows)
+        if patch is not None:
+            logger.info(f"Patching {len(rows)} prices and stocks in catalog snapshot at change {seq}.")
+            snapshot = _patch_in_place(snapshot, seq, *patch)
+        else:
+            logger.info(f"Applying {len(rows)} product changes to catalog snapshot at change {seq}.")
+            categories = list(snapshot.categories)
+            snapshot = _publish(root, database, seq, categories,
+                                _merge_columns(snapshot, changed_ids, rows, categories))
+
+    # 调用方在事务中时不另开连接写入（会等待调用方持有的写锁）
+    if track_changes:
+        _acknowledge_changes(database, root, seq)
+    return snapshot
+
+
+def get_snapshot(conn, root: Optional[str] = None) -> Optional[CatalogSnapshot]:
+    """
+    Return an up-to-date snapshot for the connected database, reusing the mapped one when possible.
+
+    Args:
+        conn: SQLite database connection.
+        root (str): The snapshot directory; defaults to CATALOG_SNAPSHOT_DIR, or a directory per
+            database under SNAPSHOT_DIR.
+
+    Returns:
+        Optional[CatalogSnapshot]: The snapshot, or None if numpy is missing or the database is in memory.
+    """
+    database = database_key(conn)
+    if np is None or database is None:
+        return None
+    root = os.path.abspath(root or os.getenv("CATALOG_SNAPSHOT_DIR")
+                           or os.path.join(SNAPSHOT_DIR, _database_tag(database)))
+
+    seq = _latest_change_seq(conn.cursor())
+    with _snapshots_lock:
+        snapshot = _snapshots.get((database, root))
+        if snapshot is None or snapshot.seq != seq:
+            snapshot = refresh_snapshot(conn, root)
+            _snapshots[(database, root)] = snapshot
+    return snapshot
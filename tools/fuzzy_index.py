@@ -0,0 +1,215 @@
+"""
+@Time ： 2024-11-22
+@Auth ： Adam Lyu
+@Desc ： In-memory trigram index over product names for misspelled and partial queries.
+
+Latin words are split into padded character trigrams (like PostgreSQL pg_trgm); runs of CJK
+characters, which have no spaces between words, are split into character bigrams. The index is
+cached per database file and follows the `names` catalog version: if only inserts happened since
+the last build, the new products are appended instead of rebuilding.
+"""
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from utils.db_utils import database_key, get_catalog_version
+from utils.logger import logger
+
+# 结果的最低相似度
+SIMILARITY_THRESHOLD = 0.3
+
+# 平假名/片假名、CJK 统一汉字（含扩展 A）、韩文音节、CJK 兼容汉字
+_CJK_RANGES = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+CJK_WORD = re.compile(f"[{_CJK_RANGES}]")
+_WORD = re.compile(f"[{_CJK_RANGES}]+|(?:(?![{_CJK_RANGES}])[^\\W_])+")
+
+_indexes: Dict[str, Tuple[int, "TrigramIndex"]] = {}
+_indexes_lock = threading.Lock()
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize text for matching: NFKC (full-width to ASCII), case folding, punctuation to spaces.
+
+    Args:
+        text (str): Raw text.
+
+    Returns:
+        str: Normalized text, e.g. "T-Shirt" -> "t shirt".
+    """
+    return " ".join(_WORD.findall(unicodedata.normalize("NFKC", text).casefold()))
+
+
+def text_ngrams(text: str) -> Set[str]:
+    """
+    Split text into trigrams (Latin words) and bigrams (CJK runs).
+
+    Args:
+        text (str): Raw text.
+
+    Returns:
+        Set[str]: The n-grams of the text.
+    """
+    grams = set()
+    for word in normalize_text(text).split():
+        if CJK_WORD.match(word):
+            grams.update(word[i:i + 2] for i in range(max(len(word) - 1, 1)))
+        else:
+            padded = f"  {word} "
+            grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """
+    Inverted index from n-gram to product IDs.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, List[int]] = defaultdict(list)
+        self.gram_counts: Dict[int, int] = {}
+        self.max_id = 0
+
+    def add(self, product_id: int, name: str):
+        grams = text_ngrams(name)
+        self.gram_counts[product_id] = len(grams)
+        self.max_id = max(self.max_id, product_id)
+        for gram in grams:
+            self.postings[gram].append(product_id)
+
+    def extended(self, products: List[Tuple[int, str]]) -> "TrigramIndex":
+        """
+        Return a copy of the index with more products added; this index is not modified, so
+        searches running on it are not affected.
+
+        Args:
+            products (List[Tuple[int, str]]): (id, name) rows to add.
+
+        Returns:
+            TrigramIndex: The new index.
+        """
+        index = TrigramIndex()
+        index.postings.update(self.postings)
+        index.gram_counts.update(self.gram_counts)
+        index.max_id = self.max_id
+        # 只复制新产品涉及的倒排列表，其余列表与原索引共享
+        copied = set()
+        for product_id, name in products:
+            for gram in text_ngrams(name):
+                if gram not in copied:
+                    index.postings[gram] = list(index.postings.get(gram, ()))
+                    copied.add(gram)
+            index.add(product_id, name)
+        return index
+
+    def search(self, text: str, limit: Optional[int] = 20,
+               threshold: float = SIMILARITY_THRESHOLD) -> List[Tuple[int, float]]:
+        """
+        Find the names closest to `text`.
+
+        Similarity is the share of the query's n-grams found in the name, so a partial name
+        ("phone" in "Smartphone - 1234") scores as well as a typo of the full name; ties are
+        broken by how much of the name the query covers.
+
+        Args:
+            text (str): The query.
+            limit (int): Maximum number of matches; None for every match above the threshold.
+            threshold (float): Minimum similarity in [0, 1].
+
+        Returns:
+            List[Tuple[int, float]]: (product ID, similarity) pairs, best first.
+        """
+        grams = text_ngrams(text)
+        if not grams:
+            return []
+        overlaps = Counter()
+        for gram in grams:
+            overlaps.update(self.postings.get(gram, ()))
+
+        scored = []
+        for product_id, overlap in overlaps.items():
+            similarity = overlap / len(grams)
+            if similarity >= threshold:
+                jaccard = overlap / (len(grams) + self.gram_counts[product_id] - overlap)
+                scored.append((-similarity, -jaccard, product_id))
+        scored.sort()
+        return [(product_id, round(-similarity, 3)) for similarity, _, product_id in scored[:limit]]
+
+
+def build_index(cursor) -> TrigramIndex:
+    """
+    Build a trigram index over every product name.
+
+    Args:
+        cursor: SQLite cursor.
+
+    Returns:
+        TrigramIndex: The index.
+    """
+    index = TrigramIndex()
+    cursor.execute("SELECT id, name FROM products -- allow-full-scan: trigram index build")
+    for product_id, name in cursor.fetchall():
+        index.add(product_id, name)
+    logger.info(f"Built trigram index over {len(index.gram_counts)} product names.")
+    return index
+
+
+def get_index(conn) -> TrigramIndex:
+    """
+    Return the trigram index for the connected database, bringing it up to date first.
+
+    The `names` catalog version grows by one per inserted, deleted or renamed product. When it grew
+    by exactly the number of products above the indexed maximum ID, only inserts happened and those
+    products are appended; otherwise the index is rebuilt. Reading and building happen outside the
+    module lock, so other searches are not blocked. In-memory databases get a fresh index on every call.
+
+    Args:
+        conn: SQLite database connection.
+
+    Returns:
+        TrigramIndex: The index.
+    """
+    cursor = conn.cursor()
+    cache_key = database_key(conn)
+    version = get_catalog_version(cursor, "names") if cache_key else None
+    if version is None:
+        return build_index(cursor)
+
+    cached = _indexes.get(cache_key)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    index = None
+    if cached:
+        cached_version, cached_index = cached
+        cursor.execute("SELECT id, name FROM products WHERE id > ? ORDER BY id", (cached_index.max_id,))
+        inserted = cursor.fetchall()
+        if version - cached_version == len(inserted):
+            index = cached_index.extended(inserted)
+            logger.info(f"Added {len(inserted)} product names to the trigram index.")
+    if index is None:
+        index = build_index(cursor)
+
+    # 并发构建时保留版本号较新的索引
+    with _indexes_lock:
+        current = _indexes.get(cache_key)
+        if current is None or current[0] < version:
+            _indexes[cache_key] = (version, index)
+    return index
+
+
+def fuzzy_match_products(text: str, limit: Optional[int] = 20, conn=None) -> List[Tuple[int, float]]:
+    """
+    Find the products whose names are closest to a possibly misspelled or partial query.
+
+    Args:
+        text (str): The query.
+        limit (int): Maximum number of matches; None for every match above the threshold.
+        conn: SQLite database connection.
+
+    Returns:
+        List[Tuple[int, float]]: (product ID, similarity) pairs, best first.
+    """
+    return get_index(conn).search(text, limit)
@@ -6,134 +6,341 @@
 @Time ： 2024-11-15
 @Auth ： Adam Lyu
 """
+import base64
+import itertools
 import json
 import sqlite3
 import os
+import threading
+from typing import Dict, List, Optional, Tuple
 from langchain_core.tools import tool
+from tools.cart_tools import get_cart_store
+from utils.cache import LRUCache
+from utils.db_utils import database_key, immediate_transaction, run_after_commit
+from utils.group_commit import get_group_writer
 from utils.logger import logger
+from utils.output_encoder import encode_output
 
 # 定义数据库路径
 db = os.path.join(os.path.dirname(__file__), "../data/ecommerce.db")
 
+VALID_PAYMENT_METHODS = ["Credit Card", "PayPal", "Apple Pay", "Google Pay", "Bank Transfer"]
+# 订单详情缓存：按订单ID缓存 search_orders 的结果。本模块修改订单并提交后递增该订单的代数，
+# 旧代数的缓存随即失效；TTL 兜底其他进程对订单的修改
+_order_cache = LRUCache(max_bytes=int(os.getenv("ORDER_CACHE_MAX_BYTES", 4 * 1024 * 1024)),
+                        ttl=float(os.getenv("ORDER_CACHE_TTL", 60)))
+_order_generations: Dict[Tuple, int] = {}
+_order_generations_lock = threading.Lock()
+_order_generation_counter = itertools.count(1)
+
+# 各类订单事件允许追加时订单所处的状态
+_EVENT_STATUS_GUARDS = {
+    "created": "",
+    "address_changed": "AND status NOT IN ('Shipped', 'Delivered', 'Cancelled')",
+    "status_changed": "AND status != 'Cancelled'",
+    "cancelled": "AND status NOT IN ('Shipped', 'Delivered', 'Cancelled')",
+}
+
+# 订单历史分页大小
+DEFAULT_ORDER_PAGE_SIZE = 10
+MAX_ORDER_PAGE_SIZE = 50
+# 结账幂等键的有效期（秒），过期后同一个键会被当作新的结账
+CHECKOUT_IDEMPOTENCY_TTL = int(os.getenv("CHECKOUT_IDEMPOTENCY_TTL", 24 * 60 * 60))
+
+
+class InsufficientStockError(Exception):
+    """Raised inside the checkout transaction to roll it back when stock cannot cover the cart."""
+
+    def __init__(self, shortfalls: List[Tuple[int, int, int]]):
+        """
+        Args:
+            shortfalls: (product_id, requested quantity, stock) of every product that is short.
+        """
+        self.shortfalls = shortfalls
+        super().__init__("\n".join(
+            f"Product ID {product_id} only has {stock} in stock (requested {quantity})."
+            for product_id, quantity, stock in shortfalls
+        ))
+
+
+def find_checkout_result(cursor, user_id: int, idempotency_key: str) -> Optional[str]:
+    """
+    Look up the result of a successful checkout recorded under an idempotency key.
+
+    Args:
+        cursor: SQLite cursor.
+        user_id (int): The ID of the user.
+        idempotency_key (str): The key the checkout was submitted with.
+
+    Returns:
+        Optional[str]: The original checkout result, or None if the key is unknown or expired.
+    """
+    cursor.execute("""
+    SELECT result FROM checkout_idempotency
+    WHERE user_id = ? AND idempotency_key = ? AND created_at > datetime('now', ?)
+    """, (user_id, idempotency_key, f"-{CHECKOUT_IDEMPOTENCY_TTL} seconds"))
+    row = cursor.fetchone()
+    return row[0] if row else None
 
-def checkout_order(user_id: int, address: str, payment_method: str, conn=None) -> str:
+
+def purge_expired_idempotency_keys(cursor) -> int:
+    """
+    Delete the idempotency keys older than CHECKOUT_IDEMPOTENCY_TTL.
+
+    Args:
+        cursor: SQLite cursor.
+
+    Returns:
+        int: Number of keys deleted.
+    """
+    cursor.execute("DELETE FROM checkout_idempotency WHERE created_at <= datetime('now', ?)",
+                   (f"-{CHECKOUT_IDEMPOTENCY_TTL} seconds",))
+    return cursor.rowcount
+
+
+def checkout_order(user_id: int, address: str, payment_method: str, conn=None,
+                   idempotency_key: Optional[str] = None) -> str:
     """
     Proceed to checkout for the user's cart with a delivery address and payment method.
 
+    With an idempotency key, a successful checkout is recorded under the key and a repeated call
+    with the same key returns the original result without touching the cart or stock.
+
     Args:
         user_id (int): The ID of the user.
         address (str): The delivery address for the order.
         payment_method (str): The selected payment method for the order.
         conn: Optional database connection.
+        idempotency_key (str): Optional key identifying this checkout request.
 
     Returns:
         str: Confirmation of the checkout process.
     """
-    if not conn:
+    store = get_cart_store(conn)
+    if store is not None:
+        # 结账直接读取并清空 cart_products：先写回该用户的内存购物车，结账期间暂停其修改
+        with store.bypass(user_id):
+            writer = get_group_writer(db)
+            if writer is not None:
+                return writer.call(checkout_order, user_id, address, payment_method, idempotency_key=idempotency_key)
+            conn = sqlite3.connect(db)
+            try:
+                return checkout_order(user_id, address, payment_method, conn=conn, idempotency_key=idempotency_key)
+            finally:
+                conn.close()
+
+    writer = get_group_writer(db, conn)
+    if writer is not None:
+        return writer.call(checkout_order, user_id, address, payment_method, idempotency_key=idempotency_key)
+
+    close_conn = conn is None
+    if close_conn:
         logger.info(f"Retrieving cart contents for user {user_id}.")
         conn = sqlite3.connect(db)
-    cursor = conn.cursor()
 
     try:
-        # Retrieve cart contents
-        cursor.execute("""
-        SELECT p.id, p.price, cp.quantity, p.stock 
-        FROM cart_products cp
-        JOIN products p ON cp.product_id = p.id
-        WHERE cp.cart_id = (
-            SELECT id FROM cart WHERE user_id = ?
-        )
-        """, (user_id,))
-        cart_contents = cursor.fetchall()
-
-        if not cart_contents:
-            logger.warning("Cart is empty.")
-            return "Your cart is empty. Please add items before checking out."
-
-        # Check stock availability
-        insufficient_stock = [
-            (product_id, quantity, stock)
-            for product_id, price, quantity, stock in cart_contents
-            if stock < quantity
-        ]
-        if insufficient_stock:
-            issues = "\n".join(
-                f"Product ID {product_id} only has {stock} in stock (requested {quantity})."
-                for product_id, quantity, stock in insufficient_stock
-            )
-            logger.warning(f"Insufficient stock for some items: {issues}")
-            return f"Checkout failed due to insufficient stock:\n{issues}"
+        if idempotency_key:
+            # 重复提交：按主键直接返回原结果，不加写锁
+            replay = find_checkout_result(conn.cursor(), user_id, idempotency_key)
+            if replay is not None:
+                logger.info(f"Checkout {idempotency_key!r} for user {user_id} was already processed.")
+                return replay
+
+        # 整个结账在一个 BEGIN IMMEDIATE 事务中完成：先取得写锁再读取购物车与库存，
+        # 其他结账无法在检查与扣减之间修改库存；任何缺货都会回滚整个事务
+        with immediate_transaction(conn) as cursor:
+            if idempotency_key:
+                # 加锁后再次检查，同一个键的并发请求只有一个会执行结账
+                replay = find_checkout_result(cursor, user_id, idempotency_key)
+                if replay is not None:
+                    logger.info(f"Checkout {idempotency_key!r} for user {user_id} was already processed.")
+                    return replay
+                purge_expired_idempotency_keys(cursor)
 
-        # Validate payment method
-        valid_payment_methods = ["Credit Card", "PayPal", "Apple Pay", "Google Pay", "Bank Transfer"]
-        if payment_method not in valid_payment_methods:
-            logger.warning(f"Invalid payment method selected: {payment_method}.")
-            return f"Invalid payment method. Available methods are: {', '.join(valid_payment_methods)}."
-
-        # Calculate total amount
-        total_amount = sum(price * quantity for _, price, quantity, _ in cart_contents)
-
-        # Create an order with the given address and payment method
-        cursor.execute("""
-        INSERT INTO orders (user_id, total_amount, delivery_address, payment_method, created_at) 
-        VALUES (?, ?, ?, ?, datetime('now'))
-        """, (user_id, total_amount, address, payment_method))
-        order_id = cursor.lastrowid
-
-        # Insert order products and update stock
-        for product_id, price, quantity, stock in cart_contents:
             cursor.execute("""
-            INSERT INTO order_products (order_id, product_id, quantity, price) 
-            VALUES (?, ?, ?, ?)
-            """, (order_id, product_id, quantity, price))
+            SELECT p.id, p.price, cp.quantity, p.stock
+            FROM cart_products cp
+            JOIN products p ON cp.product_id = p.id
+            WHERE cp.cart_id = (
+                SELECT id FROM cart WHERE user_id = ?
+            )
+            """, (user_id,))
+            cart_contents = cursor.fetchall()
+
+            if not cart_contents:
+                logger.warning("Cart is empty.")
+                return "Your cart is empty. Please add items before checking out."
+
+            # Check stock availability
+            insufficient_stock = [
+                (product_id, quantity, stock)
+                for product_id, price, quantity, stock in cart_contents
+                if stock < quantity
+            ]
+            if insufficient_stock:
+                raise InsufficientStockError(insufficient_stock)
+
+            # Validate payment method
+            if payment_method not in VALID_PAYMENT_METHODS:
+                logger.warning(f"Invalid payment method selected: {payment_method}.")
+                return f"Invalid payment method. Available methods are: {', '.join(VALID_PAYMENT_METHODS)}."
+
+            # Calculate total amount
+            total_amount = sum(price * quantity for _, price, quantity, _ in cart_contents)
+
+            # Create an order with the given address and payment method
             cursor.execute("""
-            UPDATE products SET stock = stock - ? WHERE id = ?
-            """, (quantity, product_id))
-
-        # Clear the cart
-        cursor.execute("""
-        DELETE FROM cart_products WHERE cart_id = (
-            SELECT id FROM cart WHERE user_id = ?
-        )
-        """, (user_id,))
-        conn.commit()
-
+            INSERT INTO orders (user_id, total_amount, delivery_address, payment_method, created_at)
+            VALUES (?, ?, ?, ?, datetime('now'))
+            """, (user_id, total_amount, address, payment_method))
+            order_id = cursor.lastrowid
+
+            # 订单行记录下单时的类别，类别销售汇总按它计入
+            cursor.executemany("""
+            INSERT INTO order_products (order_id, product_id, quantity, price, category)
+            VALUES (?, ?, ?, ?, (SELECT category FROM products WHERE id = ?))
+            """, [(order_id, product_id, quantity, price, product_id)
+                  for product_id, price, quantity, _ in cart_contents])
+            # 在订单行写入之后记录事件：触发器据此增量更新销售汇总
+            append_order_event(cursor, order_id, "created", {"total_amount": total_amount})
+
+            # 带条件的扣减：库存不足的行不会被修改，受影响行数不足即回滚
+            cursor.executemany("""
+            UPDATE products SET stock = stock - ? WHERE id = ? AND stock >= ?
+            """, [(quantity, product_id, quantity) for product_id, _, quantity, _ in cart_contents])
+            if cursor.rowcount != len(cart_contents):
+                cursor.execute("""
+                SELECT p.id, json_extract(j.value, '$[1]'), p.stock
+                FROM json_each(?) j JOIN products p ON p.id = json_extract(j.value, '$[0]')
+                WHERE p.stock < json_extract(j.value, '$[1]')
+                """, (json.dumps([[product_id, quantity] for product_id, _, quantity, _ in cart_contents]),))
+                raise InsufficientStockError(cursor.fetchall())
+
+            # Clear the cart
+            cursor.execute("""
+            DELETE FROM cart_products WHERE cart_id = (
+                SELECT id FROM cart WHERE user_id = ?
+            )
+            """, (user_id,))
+
+            result = f"Checkout successful! Your order ID is {order_id}. Total amount: ${total_amount:.2f}."
+            if idempotency_key:
+                cursor.execute("""
+                INSERT INTO checkout_idempotency (user_id, idempotency_key, order_id, result)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (user_id, idempotency_key) DO UPDATE SET
+                    order_id = excluded.order_id, result = excluded.result, created_at = CURRENT_TIMESTAMP
+                """, (user_id, idempotency_key, order_id, result))
+
+        invalidate_order_cache(conn, order_id)
         logger.info(f"Checkout complete for user {user_id}. Order ID: {order_id}.")
-        update_stock_on_order(order_id)
-        return f"Checkout successful! Your order ID is {order_id}. Total amount: ${total_amount:.2f}."
+        return result
 
+    except InsufficientStockError as e:
+        logger.warning(f"Insufficient stock for some items: {e}")
+        return f"Checkout failed due to insufficient stock:\n{e}"
     except Exception as e:
         logger.error(f"Error during checkout for user {user_id}: {e}")
-        conn.rollback()
         raise
     finally:
-        if not conn:
+        if close_conn:
             conn.close()
 
 
+def append_order_event(cursor, order_id: int, event_type: str, payload: Dict) -> bool:
+    """
+    Append an event to `order_events`; the projection triggers apply it to `orders` and
+    `user_order_summary` in the same statement.
+
+    `address_changed` and `cancelled` are only appended while the order is still open (not
+    Shipped, Delivered or Cancelled), `status_changed` while it is not Cancelled.
+
+    Args:
+        cursor: SQLite cursor, inside the caller's transaction.
+        order_id (int): The ID of the order.
+        event_type (str): "created", "address_changed", "status_changed" or "cancelled".
+        payload (Dict): Event data, e.g. {"reason": ...} for "cancelled".
+
+    Returns:
+        bool: Whether the event was appended (False if the order is missing or closed).
+    """
+    cursor.execute(f"""
+    INSERT INTO order_events (order_id, user_id, event_type, payload)
+    SELECT id, user_id, ?, ? FROM orders WHERE id = ? {_EVENT_STATUS_GUARDS[event_type]}
+    """, (event_type, json.dumps(payload, ensure_ascii=False), order_id))
+    return cursor.rowcount > 0
+
+
+def invalidate_order_cache(conn, order_id: int):
+    """
+    Drop the cached details of an order once a change to it is committed (on the group-commit
+    writer's connection, when the batch containing the change commits).
+
+    Args:
+        conn: The connection the change was made on.
+        order_id (int): The ID of the changed order.
+    """
+    key = (database_key(conn), order_id)
+    if key[0] is None:
+        return
+
+    def bump_generation():
+        with _order_generations_lock:
+            _order_generations[key] = next(_order_generation_counter)
+
+    run_after_commit(conn, bump_generation)
+
+
+def get_order_cache_stats() -> Dict[str, int]:
+    """
+    Report the order details cache counters.
+
+    Returns:
+        Dict[str, int]: `hits`, `misses`, `evictions`, `entries`, `bytes` and `max_bytes`.
+    """
+    return _order_cache.stats()
 
 
 def search_orders(order_id: int, conn=None) -> str:
     """
     Get the details of a specific order.
 
+    The order and its products are read by one statement, so they always come from the same
+    snapshot, and cached until the order is changed through this module.
+
     Args:
         order_id (int): The ID of the order.
         conn
     Returns:
         str: The order details.
     """
-    if not conn:
+    close_conn = conn is None
+    if close_conn:
         logger.info(f"Retrieving cart contents for order {order_id}.")
         conn = sqlite3.connect(db)
     cursor = conn.cursor()
 
     try:
-        # Query order information
+        cache_key = (database_key(conn), order_id)
+        if cache_key[0] is not None:
+            # 读取前记录代数：读取期间提交的修改会递增代数，使本次写入的缓存失效
+            with _order_generations_lock:
+                generation = _order_generations.get(cache_key, 0)
+            order_details = _order_cache.get(cache_key, generation)
+            if order_details is not None:
+                return encode_output(order_details)
+
+        # 订单与其产品由一条语句读取（单条语句在同一读快照中执行），不会看到只应用了一半的修改
         cursor.execute("""
-        SELECT id, user_id, total_amount, status, delivery_address, cancellation_reason, created_at, updated_at 
-        FROM orders
-        WHERE id = ?
+        SELECT o.id, o.user_id, o.total_amount, o.status, o.delivery_address, o.cancellation_reason,
+               o.created_at, o.updated_at,
+               json_group_array(json_object('Name', p.name, 'Quantity', op.quantity, 'Price', op.price))
+               FILTER (WHERE op.id IS NOT NULL)
+        FROM orders o
+        LEFT JOIN order_products op ON op.order_id = o.id
+        LEFT JOIN products p ON p.id = op.product_id
+        WHERE o.id = ?
+        GROUP BY o.id
         """, (order_id,))
         order = cursor.fetchone()
 
@@ -145,31 +352,23 @@ def search_orders(order_id: int, conn=None) -> str:
         order_details = dict(zip(
             ["Order ID", "User ID", "Total Amount", "Status", "Delivery Address", "Cancellation Reason", "Created At",
              "Updated At"],
-            order
+            order[:8]
         ))
-
-        # Query order products
-        cursor.execute("""
-        SELECT p.name, op.quantity, op.price 
-        FROM order_products op
-        JOIN products p ON op.product_id = p.id
-        WHERE op.order_id = ?
-        """, (order_id,))
-        products = cursor.fetchall()
-
         order_details["Products"] = [
-            {"Name": name, "Quantity": quantity, "Price": f"${price:.2f}"}
-            for name, quantity, price in products
+            {"Name": product["Name"], "Quantity": product["Quantity"], "Price": f"${product['Price']:.2f}"}
+            for product in json.loads(order[8])
         ]
 
+        if cache_key[0] is not None:
+            _order_cache.put(cache_key, order_details, generation)
         logger.info(f"Order details retrieved successfully for order {order_id}.")
-        return json.dumps(order_details, indent=4)
+        return encode_output(order_details)
 
     except Exception as e:
         logger.error(f"Error retrieving order details for order {order_id}: {e}")
         raise
     finally:
-        if not conn:
+        if close_conn:
             conn.close()
 
 
@@ -184,32 +383,28 @@ def update_delivery_address(order_id: int, new_address: str, conn=None) -> str:
     Returns:
         str: Confirmation of the update.
     """
-    if not conn:
+    writer = get_group_writer(db, conn)
+    if writer is not None:
+        return writer.call(update_delivery_address, order_id, new_address)
+
+    close_conn = conn is None
+    if close_conn:
         logger.info(f"Updating delivery address for order {order_id}.")
         conn = sqlite3.connect(db)
-    cursor = conn.cursor()
 
     try:
-        # Check if the order exists
-        cursor.execute("SELECT status FROM orders WHERE id = ?", (order_id,))
-        result = cursor.fetchone()
-
-        if not result:
-            logger.warning(f"Order {order_id} not found.")
-            return f"No order found with ID {order_id}."
-
-        if result[0] in ("Shipped", "Delivered", "Cancelled"):
-            logger.warning(f"Cannot update address for order {order_id} with status: {result[0]}.")
-            return f"Cannot update address for order {order_id} with status: {result[0]}."
-
-        # Update the delivery address
-        cursor.execute("""
-        UPDATE orders 
-        SET delivery_address = ?, updated_at = CURRENT_TIMESTAMP 
-        WHERE id = ?
-        """, (new_address, order_id))
-        conn.commit()
-
+        with immediate_transaction(conn) as cursor:
+            # 追加 address_changed 事件，触发器将新地址投影到 orders
+            if not append_order_event(cursor, order_id, "address_changed", {"delivery_address": new_address}):
+                cursor.execute("SELECT status FROM orders WHERE id = ?", (order_id,))
+                result = cursor.fetchone()
+                if not result:
+                    logger.warning(f"Order {order_id} not found.")
+                    return f"No order found with ID {order_id}."
+                logger.warning(f"Cannot update address for order {order_id} with status: {result[0]}.")
+                return f"Cannot update address for order {order_id} with status: {result[0]}."
+
+        invalidate_order_cache(conn, order_id)
         logger.info(f"Delivery address updated successfully for order {order_id}.")
         return f"Delivery address for order {order_id} has been updated successfully."
 
@@ -217,13 +412,16 @@ def update_delivery_address(order_id: int, new_address: str, conn=None) -> str:
         logger.error(f"Error updating delivery address for order {order_id}: {e}")
         raise
     finally:
-        if not conn:
+        if close_conn:
             conn.close()
 
 
 def cancel_order(order_id: int, reason: str, conn=None) -> str:
     """
-    Cancel an order and provide a cancellation reason.
+    Cancel an order, provide a cancellation reason and restore the stock of its products.
+
+    The status check, the status change and the restock run in one transaction, so stock is only
+    restored for an order that this call actually cancelled.
 
     Args:
         order_id (int): The ID of the order.
@@ -232,32 +430,41 @@ def cancel_order(order_id: int, reason: str, conn=None) -> str:
     Returns:
         str: Confirmation of the cancellation.
     """
-    if not conn:
+    writer = get_group_writer(db, conn)
+    if writer is not None:
+        return writer.call(cancel_order, order_id, reason)
+
+    close_conn = conn is None
+    if close_conn:
         logger.info(f"Cancelling order {order_id}.")
         conn = sqlite3.connect(db)
-    cursor = conn.cursor()
 
     try:
-        # Check if the order exists
-        cursor.execute("SELECT status FROM orders WHERE id = ?", (order_id,))
-        result = cursor.fetchone()
-
-        if not result:
-            logger.warning(f"Order {order_id} not found.")
-            return f"No order found with ID {order_id}."
-
-        if result[0] in ("Shipped", "Delivered", "Cancelled"):
-            logger.warning(f"Cannot cancel order {order_id} with status: {result[0]}.")
-            return f"Cannot cancel order {order_id} with status: {result[0]}."
-
-        # Update the order status to "Cancelled" and record the reason
-        cursor.execute("""
-        UPDATE orders 
-        SET status = 'Cancelled', cancellation_reason = ?, updated_at = CURRENT_TIMESTAMP 
-        WHERE id = ?
-        """, (reason, order_id))
-        conn.commit()
-
+        with immediate_transaction(conn) as cursor:
+            # 只有未发货、未取消的订单才会追加 cancelled 事件，触发器将其投影到 orders
+            if not append_order_event(cursor, order_id, "cancelled", {"reason": reason}):
+                cursor.execute("SELECT status FROM orders WHERE id = ?", (order_id,))
+                result = cursor.fetchone()
+                if not result:
+                    logger.warning(f"Order {order_id} not found.")
+                    return f"No order found with ID {order_id}."
+                logger.warning(f"Cannot cancel order {order_id} with status: {result[0]}.")
+                return f"Cannot cancel order {order_id} with status: {result[0]}."
+
+            # 一条语句恢复订单中所有产品的库存（同一产品的多行先合并）
+            cursor.execute("""
+            UPDATE products
+            SET stock = stock + op.quantity
+            FROM (
+                SELECT product_id, SUM(quantity) AS quantity
+                FROM order_products
+                WHERE order_id = ?
+                GROUP BY product_id
+            ) AS op
+            WHERE products.id = op.product_id
+            """, (order_id,))
+
+        invalidate_order_cache(conn, order_id)
         logger.info(f"Order {order_id} cancelled successfully.")
         return f"Order {order_id} has been cancelled successfully. Reason: {reason}"
 
@@ -265,7 +472,7 @@ def cancel_order(order_id: int, reason: str, conn=None) -> str:
         logger.error(f"Error cancelling order {order_id}: {e}")
         raise
     finally:
-        if not conn:
+        if close_conn:
             conn.close()
 
 
@@ -278,7 +485,7 @@ def get_recent_orders(user_id: int, days: int = 7, conn=None) -> str:
         days (int): The number of days to look back. Default is 7 days.
         conn
     Returns:
-        str: JSON-formatted list of recent orders.
+        str: Recent orders as a compact table (see utils/output_encoder.py).
     """
     if not conn:
         logger.info(f"Retrieving recent orders for user {user_id} within the last {days} days.")
@@ -313,7 +520,7 @@ def get_recent_orders(user_id: int, days: int = 7, conn=None) -> str:
         ]
 
         logger.info(f"Found {len(recent_orders)} recent orders for user {user_id}.")
-        return json.dumps(recent_orders, indent=4)
+        return encode_output(recent_orders)
 
     except Exception as e:
         logger.error(f"Error retrieving recent orders for user {user_id}: {e}")
@@ -322,112 +529,199 @@ def get_recent_orders(user_id: int, days: int = 7, conn=None) -> str:
         if not conn:
             conn.close()
 
-def update_stock_on_order(order_id: int, conn=None):
+def encode_order_cursor(created_at: str, order_id: int) -> str:
     """
-    Update product stock when an order is activated or completed.
+    Encode the keyset position of the last returned order as an opaque cursor.
 
     Args:
-        order_id (int): The ID of the order.
-        conn: SQLite database connection.
+        created_at (str): Creation time of the last returned order.
+        order_id (int): The ID of the last returned order.
+
+    Returns:
+        str: A URL-safe cursor string.
+    """
+    payload = json.dumps([created_at, order_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_order_cursor(cursor: str) -> Tuple[str, int]:
     """
-    logger.info(f"Updating stock for order {order_id}.")
+    Decode a cursor produced by `encode_order_cursor`.
+
+    Args:
+        cursor (str): The cursor string.
 
+    Returns:
+        Tuple[str, int]: The creation time and ID of the last order of the previous page.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
     try:
-        # 打开数据库连接
-        if not conn:
-            conn = sqlite3.connect(db)
-        cursor = conn.cursor()
+        created_at, order_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(created_at), int(order_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid order cursor: {cursor}") from e
 
-        # 查询订单中产品及其数量
-        query = """
-        SELECT product_id, quantity 
-        FROM order_products
-        WHERE order_id = ?
-        """
-        cursor.execute(query, (order_id,))
-        products = cursor.fetchall()
 
-        # 更新库存
-        for product_id, quantity in products:
-            cursor.execute("""
-            UPDATE products
-            SET stock = stock - ?
-            WHERE id = ?
-            AND stock >= ?
-            """, (quantity, product_id, quantity))
+def get_order_history(user_id: int, days: Optional[int] = None, cursor: Optional[str] = None,
+                      page_size: int = DEFAULT_ORDER_PAGE_SIZE, include_items: bool = False, conn=None) -> Dict:
+    """
+    Retrieve a user's orders, newest first, one page at a time.
 
-            if cursor.rowcount == 0:
-                logger.warning(f"Product {product_id} has insufficient stock for order {order_id}.")
+    Pages are read from the `orders (user_id, created_at)` index with keyset pagination, so every
+    page costs the same no matter how deep it is. With `include_items`, each order's line items are
+    embedded through a single JOIN aggregated with json_group_array instead of one query per order.
 
-        # 提交更改
-        conn.commit()
-        logger.info(f"Stock updated successfully for order {order_id}.")
+    Args:
+        user_id (int): The ID of the user.
+        days (int): Only orders from the last `days` days; None for all orders.
+        cursor (str): The `next_cursor` of the previous page, or None for the first page.
+        page_size (int): Number of orders per page (capped at MAX_ORDER_PAGE_SIZE).
+        include_items (bool): Whether to embed each order's products.
+        conn: Optional database connection.
 
-    except sqlite3.Error as e:
-        logger.error(f"Database error while updating stock for order {order_id}: {e}")
-        conn.rollback()
+    Returns:
+        Dict: {"orders": [...], "next_cursor": str or None}
 
-    except Exception as e:
-        logger.error(f"Unexpected error while updating stock for order {order_id}: {e}")
-        conn.rollback()
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    page_size = max(1, min(int(page_size), MAX_ORDER_PAGE_SIZE))
+    conditions, params = ["user_id = ?"], [user_id]
+    if days is not None:
+        conditions.append("created_at >= datetime('now', ?)")
+        params.append(f"-{int(days)} days")
+    if cursor:
+        created_at, order_id = decode_order_cursor(cursor)
+        conditions.append("(created_at < ? OR (created_at = ? AND id < ?))")
+        params.extend([created_at, created_at, order_id])
+    # 多取一行判断是否还有下一页；排序与索引 (user_id, created_at, rowid) 一致，无需额外排序
+    page_query = f"""
+        SELECT id, total_amount, status, delivery_address, created_at, updated_at
+        FROM orders
+        WHERE {' AND '.join(conditions)}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    """
+    params.append(page_size + 1)
+
+    if include_items:
+        query = f"""
+        SELECT o.id, o.total_amount, o.status, o.delivery_address, o.created_at, o.updated_at,
+               json_group_array(json_object('Product ID', op.product_id, 'Name', p.name,
+                                            'Quantity', op.quantity, 'Price', op.price))
+               FILTER (WHERE op.id IS NOT NULL)
+        FROM ({page_query}) o
+        LEFT JOIN order_products op ON op.order_id = o.id
+        LEFT JOIN products p ON p.id = op.product_id
+        GROUP BY o.id
+        ORDER BY o.created_at DESC, o.id DESC
+        """
+    else:
+        query = page_query
+
+    close_conn = conn is None
+    if close_conn:
+        logger.info(f"Retrieving order history for user {user_id}.")
+        conn = sqlite3.connect(db)
 
+    try:
+        rows = conn.execute(query, params).fetchall()
+    except Exception as e:
+        logger.error(f"Error retrieving order history for user {user_id}: {e}")
+        raise
     finally:
-        if not conn:
+        if close_conn:
             conn.close()
 
-
-def update_stock_on_cancellation(order_id: int, conn=None):
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    orders = []
+    for row in rows:
+        order = {
+            "Order ID": row[0],
+            "Total Amount": f"${row[1]:.2f}",
+            "Status": row[2],
+            "Delivery Address": row[3],
+            "Created At": row[4],
+            "Updated At": row[5],
+        }
+        if include_items:
+            order["Products"] = [{**item, "Price": f"${item['Price']:.2f}"} for item in json.loads(row[6])]
+        orders.append(order)
+    next_cursor = encode_order_cursor(rows[-1][4], rows[-1][0]) if has_more else None
+    logger.info(f"Found {len(orders)} orders for user {user_id}.")
+    return {"orders": orders, "next_cursor": next_cursor}
+
+
+def get_order_events(order_id: int, conn=None) -> List[Dict]:
     """
-    Restore product stock when an order is cancelled.
+    Retrieve the history of an order from the append-only event log, oldest first.
 
     Args:
-        order_id (int): The ID of the cancelled order.
-        conn: SQLite database connection.
+        order_id (int): The ID of the order.
+        conn: Optional database connection.
+
+    Returns:
+        List[Dict]: One entry per event with its type, data and time.
     """
-    logger.info(f"Restoring stock for cancelled order {order_id}.")
+    close_conn = conn is None
+    if close_conn:
+        logger.info(f"Retrieving events for order {order_id}.")
+        conn = sqlite3.connect(db)
 
     try:
-        # 打开数据库连接
-        if not conn:
-            conn = sqlite3.connect(db)
-        cursor = conn.cursor()
-
-        # 查询订单中产品及其数量
-        query = """
-        SELECT product_id, quantity 
-        FROM order_products
+        rows = conn.execute("""
+        SELECT event_type, payload, created_at FROM order_events
         WHERE order_id = ?
-        """
-        cursor.execute(query, (order_id,))
-        products = cursor.fetchall()
+        ORDER BY id
+        """, (order_id,)).fetchall()
+        return [{"Event": event_type, "Details": json.loads(payload), "At": created_at}
+                for event_type, payload, created_at in rows]
+    except Exception as e:
+        logger.error(f"Error retrieving events for order {order_id}: {e}")
+        raise
+    finally:
+        if close_conn:
+            conn.close()
 
-        # 恢复库存
-        for product_id, quantity in products:
-            cursor.execute("""
-            UPDATE products
-            SET stock = stock + ?
-            WHERE id = ?
-            """, (quantity, product_id))
 
-        # 提交更改
-        conn.commit()
-        logger.info(f"Stock restored successfully for cancelled order {order_id}.")
+def get_user_order_summary(user_id: int, conn=None) -> Dict:
+    """
+    Retrieve a user's order totals, maintained incrementally from the order events.
+
+    Args:
+        user_id (int): The ID of the user.
+        conn: Optional database connection.
 
-    except sqlite3.Error as e:
-        logger.error(f"Database error while restoring stock for order {order_id}: {e}")
-        conn.rollback()
+    Returns:
+        Dict: `order_count`, `cancelled_count`, `total_spent` (orders not cancelled) and `last_order_at`.
+    """
+    close_conn = conn is None
+    if close_conn:
+        logger.info(f"Retrieving order summary for user {user_id}.")
+        conn = sqlite3.connect(db)
 
+    try:
+        row = conn.execute("""
+        SELECT order_count, cancelled_count, total_spent, last_order_at
+        FROM user_order_summary WHERE user_id = ?
+        """, (user_id,)).fetchone()
     except Exception as e:
-        logger.error(f"Unexpected error while restoring stock for order {order_id}: {e}")
-        conn.rollback()
-
+        logger.error(f"Error retrieving order summary for user {user_id}: {e}")
+        raise
     finally:
-        if not conn:
+        if close_conn:
             conn.close()
+    order_count, cancelled_count, total_spent, last_order_at = row or (0, 0, 0, None)
+    return {"order_count": order_count, "cancelled_count": cancelled_count,
+            "total_spent": round(total_spent, 2), "last_order_at": last_order_at}
 
 
 @tool
-def checkout_order_tool(user_id: int, address: str, payment_method: str, conn=None) -> str:
+def checkout_order_tool(user_id: int, address: str, payment_method: str, conn=None,
+                        idempotency_key: Optional[str] = None) -> str:
     """
     Proceed to checkout for the user's cart with a delivery address.
 
@@ -436,10 +730,13 @@ def checkout_order_tool(user_id: int, address: str, payment_method: str, conn=No
         address (str): The delivery address for the order.
         payment_method (str): The selected payment method for the order.
         conn
+        idempotency_key (str): A unique key for this checkout request, e.g. "checkout-<user_id>-<time>".
+            Reuse the same key when retrying the same checkout: a repeated key returns the original
+            order instead of placing a new one.
     Returns:
         str: Confirmation of the checkout process.
     """
-    ret = checkout_order(user_id, address, payment_method)
+    ret = checkout_order(user_id, address, payment_method, idempotency_key=idempotency_key)
     return ret
 
 @tool
@@ -474,7 +771,7 @@ def update_delivery_address_tool(order_id: int, new_address: str) -> str:
 @tool
 def cancel_order_tool(order_id: int, reason: str) -> str:
     """
-    Cancel an order and provide a cancellation reason.
+    Cancel an order, provide a cancellation reason and restore the stock of its products.
 
     Args:
         order_id (int): The ID of the order.
@@ -483,9 +780,7 @@ def cancel_order_tool(order_id: int, reason: str) -> str:
     Returns:
         str: Confirmation of the cancellation.
     """
-    ret = cancel_order(order_id, reason)
-    update_stock_on_cancellation(order_id)
-    return ret
+    return cancel_order(order_id, reason)
 
 
 @tool
@@ -498,6 +793,62 @@ def get_recent_orders_tool(user_id: int, days: int = 7) -> str:
         days (int): The number of days to look back. Default is 7 days.
 
     Returns:
-        str: JSON-formatted list of recent orders.
+        str: Recent orders as a table: a header line, then one `|`-separated line per order.
     """
     return get_recent_orders(user_id, days)
+
+
+@tool
+def get_order_events_tool(order_id: int) -> str:
+    """
+    Retrieve the history of an order: when it was created, address changes, status changes and cancellation.
+
+    Args:
+        order_id (int): The ID of the order.
+
+    Returns:
+        str: The events as a table, oldest first, or a message if the order has none.
+    """
+    events = get_order_events(order_id)
+    if not events:
+        return f"No history found for order {order_id}."
+    return encode_output(events)
+
+
+@tool
+def get_user_order_summary_tool(user_id: int) -> str:
+    """
+    Retrieve how many orders a user has placed and cancelled, how much they have spent and when they last ordered.
+
+    Args:
+        user_id (int): The ID of the user.
+
+    Returns:
+        str: One `key: value` line per total.
+    """
+    return encode_output(get_user_order_summary(user_id))
+
+
+@tool
+def get_order_history_tool(user_id: int, days: Optional[int] = None, cursor: Optional[str] = None,
+                           page_size: int = DEFAULT_ORDER_PAGE_SIZE, include_items: bool = False) -> str:
+    """
+    Retrieve a user's orders, newest first, a page at a time, optionally with their products.
+
+    Use include_items=True instead of calling search_orders_tool once per order.
+
+    Args:
+        user_id (int): The ID of the user.
+        days (int, optional): Only orders from the last `days` days. Default is all orders.
+        cursor (str, optional): The `next_cursor` returned with the previous page; omit for the first page.
+        page_size (int): Number of orders per page. Default is 10, at most 50.
+        include_items (bool): Whether to include each order's products (name, quantity, price).
+
+    Returns:
+        str: `orders:` followed by a table of orders (products as JSON when included), and
+        `next_cursor:` with the cursor of the next page, or null when there are no more orders.
+    """
+    try:
+        return encode_output(get_order_history(user_id, days, cursor, page_size, include_items))
+    except ValueError as e:
+        return str(e)
@@ -2,41 +2,193 @@
 @Time ： 2024-11-15
 @Auth ： Adam Lyu
 """
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
 from langchain_core.tools import tool
+import base64
+import json
+import math
 import sqlite3
 import os
+import re
+import threading
+from tools.catalog_snapshot import SNAPSHOT_FIELDS, get_snapshot
+from tools.fuzzy_index import fuzzy_match_products
+from tools.tfidf_index import tfidf_search_products
+from utils.cache import LRUCache
+from utils.db_utils import database_key, get_catalog_version, get_category_version
 from utils.logger import logger
+from utils.output_encoder import encode_output
 
 # 定义数据库路径
 db = os.path.join(os.path.dirname(__file__), "../data/ecommerce.db")
 
+# BM25 列权重：name、description、category
+FTS_BM25_WEIGHTS = (10.0, 1.0, 2.0)
 
-def list_categories(conn=None) -> List[str]:
+# 产品表所有列，以及默认返回给 LLM 的精简字段
+PRODUCT_FIELDS = (
+    "id", "name", "description", "price", "stock", "category", "color", "size",
+    "additional_specs", "image_url", "created_at", "updated_at",
+)
+SUMMARY_FIELDS = ("id", "name", "price", "stock", "category")
+
+# 分页大小
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# 搜索引擎："sql"（默认）或 "snapshot"（内存映射的列式目录快照，需要 numpy）
+CATALOG_ENGINE = os.getenv("CATALOG_ENGINE", "sql")
+
+# 搜索模式："keyword"（关键词/子串匹配）或 "semantic"（名称、描述、附加规格的 TF-IDF 相似度）
+SEARCH_MODES = ("keyword", "semantic")
+
+# 每次搜索返回的推荐数量
+RECOMMENDATION_LIMIT = 5
+
+# 分面统计的价格直方图边界：[0, 25), [25, 50), ... [1000, 最高价]
+PRICE_BUCKET_EDGES = (0, 25, 50, 100, 250, 500, 1000)
+# 分面缓存：(数据库文件路径, 过滤条件) -> 分面统计，以 facets 版本号校验，按最近使用淘汰
+_facet_cache = LRUCache(max_bytes=int(os.getenv("FACET_CACHE_MAX_BYTES", 4 * 1024 * 1024)))
+
+# 搜索结果缓存：按规范化的搜索参数缓存 search_and_recommend_products 的结果。
+# 带类别过滤的结果只依赖该类别的版本号，其他搜索依赖整个目录的 search 版本号；TTL 兜底推荐近邻表的离线刷新
+_search_cache = LRUCache(max_bytes=int(os.getenv("SEARCH_CACHE_MAX_BYTES", 16 * 1024 * 1024)),
+                         ttl=float(os.getenv("SEARCH_CACHE_TTL", 300)))
+
+# 类别缓存：数据库文件路径 -> (catalog 版本号, 类别汇总)
+_category_cache: Dict[str, Tuple[int, List[Dict]]] = {}
+_category_cache_lock = threading.Lock()
+
+
+def has_product_fts(cursor) -> bool:
     """
-    List all available product categories in the database.
+    Check whether the FTS5 product index exists in the connected database.
+
+    Args:
+        cursor: SQLite cursor.
 
     Returns:
-        List[str]: A list of unique product categories.
+        bool: True if `products_fts` is available.
     """
-    logger.info("Starting list_categories tool.")
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'")
+    return cursor.fetchone() is not None
+
 
+def has_product_name_trigram(cursor) -> bool:
+    """
+    Check whether the trigram index on product names exists in the connected database.
+
+    Args:
+        cursor: SQLite cursor.
+
+    Returns:
+        bool: True if `products_name_trigram` is available.
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_name_trigram'")
+    return cursor.fetchone() is not None
+
+
+def build_name_match(cursor, name: str) -> Optional[Tuple[str, List]]:
+    """
+    Build a subquery of the products matching a name search, with their BM25 score.
+
+    A product matches when the FTS5 index matches its words or when its name contains the
+    text as a substring, as the LIKE search did ("phone" finds "Smartphone"). Substring-only
+    matches score 0, after every FTS match (BM25 scores are negative). Without the trigram
+    index (SQLite before 3.34) only the FTS5 word matches are returned.
+
+    Args:
+        cursor: SQLite cursor.
+        name (str): The user's search text.
+
+    Returns:
+        Optional[Tuple[str, List]]: The subquery with `product_id` and `score` columns and its parameters,
+        or None if the FTS5 index is absent or the text has no searchable words.
+    """
+    fts_query = build_fts_query(name)
+    if not fts_query or not has_product_fts(cursor):
+        return None
+    if not has_product_name_trigram(cursor):
+        query = """
+        SELECT rowid AS product_id, bm25(products_fts, ?, ?, ?) AS score FROM products_fts WHERE products_fts MATCH ?
+        """
+        return query, [*FTS_BM25_WEIGHTS, fts_query]
+    # 全文匹配与名称子串匹配（trigram 索引）合并，同一产品取较好的得分
+    query = """
+    SELECT product_id, MIN(score) AS score FROM (
+        SELECT rowid AS product_id, bm25(products_fts, ?, ?, ?) AS score FROM products_fts WHERE products_fts MATCH ?
+        UNION ALL
+        SELECT rowid, 0.0 FROM products_name_trigram WHERE name LIKE ?
+    ) GROUP BY product_id
+    """
+    return query, [*FTS_BM25_WEIGHTS, fts_query, f"%{name}%"]
+
+
+def build_fts_query(text: str) -> Optional[str]:
+    """
+    Turn free text into a safe FTS5 MATCH expression.
+
+    Every word becomes a quoted prefix term, so "t-shirt" matches "T-Shirt - 1234" and
+    FTS5 operators typed by the user are never interpreted.
+
+    Args:
+        text (str): The user's search text.
+
+    Returns:
+        Optional[str]: The MATCH expression, or None if the text has no searchable words.
+    """
+    tokens = re.findall(r"\w+", text.lower())
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+def list_category_summaries(conn=None) -> List[Dict]:
+    """
+    List every product category with its product count and price range.
+
+    The result is cached per database file and reused until the `categories` catalog version
+    changes, so a cache hit costs a single primary-key read instead of a scan of `products`.
+
+    Returns:
+        List[Dict]: One entry per category with `category`, `product_count`, `min_price` and `max_price`.
+    """
+    logger.info("Starting list_category_summaries.")
+
+    close_conn = conn is None
     try:
         # 打开数据库连接
-        if not conn:
+        if close_conn:
             conn = sqlite3.connect(db)
         cursor = conn.cursor()
 
-        # 查询所有类别
-        query = "SELECT DISTINCT category FROM products WHERE category IS NOT NULL"
+        # 命中缓存：版本号未变化
+        cache_key = database_key(conn)
+        version = get_catalog_version(cursor, "categories") if cache_key else None
+        if version is not None:
+            with _category_cache_lock:
+                cached = _category_cache.get(cache_key)
+            if cached and cached[0] == version:
+                logger.debug(f"Category cache hit at catalog version {version}.")
+                return [dict(summary) for summary in cached[1]]
+
+        # 查询所有类别及其数量和价格范围
+        query = """
+        SELECT category, COUNT(*) AS product_count, MIN(price) AS min_price, MAX(price) AS max_price
+        FROM products
+        WHERE category IS NOT NULL
+        GROUP BY category
+        ORDER BY category
+        """
         logger.debug(f"Executing query: {query}")
         cursor.execute(query)
-        results = cursor.fetchall()
+        summaries = [dict(zip([column[0] for column in cursor.description], row)) for row in cursor.fetchall()]
+        logger.info(f"Found {len(summaries)} categories.")
 
-        # 提取类别名称
-        categories = [row[0] for row in results]
-        logger.info(f"Found {len(categories)} categories.")
-        return categories
+        if version is not None:
+            with _category_cache_lock:
+                _category_cache[cache_key] = (version, summaries)
+        return [dict(summary) for summary in summaries]
 
     except sqlite3.Error as e:
         logger.error(f"Database error: {e}")
@@ -47,106 +199,760 @@ def list_categories(conn=None) -> List[str]:
         return []
 
     finally:
-        # 确保关闭连接
-        if 'conn' in locals():
+        # 只关闭本函数打开的连接
+        if close_conn:
             conn.close()
 
 
-def search_and_recommend_products(
+def list_categories(conn=None) -> List[str]:
+    """
+    List all available product categories in the database.
+
+    Returns:
+        List[str]: A list of unique product categories.
+    """
+    logger.info("Starting list_categories tool.")
+    return [summary["category"] for summary in list_category_summaries(conn)]
+
+
+def build_attribute_filter(attributes: Optional[Dict[str, str]]) -> Tuple[str, List]:
+    """
+    Build the SQL conditions that restrict `products p` to those with every given spec attribute.
+
+    Each attribute is looked up in the indexed `product_attributes` table (case-insensitive),
+    never by parsing `additional_specs`.
+
+    Args:
+        attributes (Dict[str, str]): Spec name -> value, e.g. {"Brand": "Samsung", "Feature": "5G"}.
+
+    Returns:
+        Tuple[str, List]: Conditions to append to a WHERE clause, and their parameters.
+
+    Raises:
+        ValueError: If attributes is not a mapping of names to scalar values.
+    """
+    if not attributes:
+        return "", []
+    if not isinstance(attributes, dict) or any(isinstance(value, (dict, list)) for value in attributes.values()):
+        raise ValueError("Invalid attributes. Expected a mapping of spec names to values, e.g. {\"Brand\": \"Sony\"}.")
+
+    conditions, params = "", []
+    for name, value in sorted(attributes.items()):
+        conditions += " AND p.id IN (SELECT product_id FROM product_attributes WHERE name = ? AND value = ?)"
+        params.extend([str(name), str(value)])
+    return conditions, params
+
+
+def get_product_facets(
         name: Optional[str] = None,
         category: Optional[str] = None,
         price_range: Optional[str] = None,
+        attributes: Optional[Dict[str, str]] = None,
         conn=None,
-) -> Dict[str, List[Dict]]:
+) -> Dict:
     """
-    Search for products based on name, category, and price range, and recommend related products.
+    Count the products matching a search by category, color, size, price bucket and stock status.
+
+    All facets come from one aggregate query grouped by every facet at once; the per-facet counts
+    are rolled up from its rows. Results are cached per filter set until the `facets` catalog
+    version changes.
 
     Args:
         name (str): The product name or partial name to search for.
         category (str): The category to filter products by.
         price_range (str): A price range in the format "min-max".
-        conn
+        attributes (Dict[str, str]): Spec attributes the products must have, e.g. {"Material": "Wool"}.
+        conn: SQLite database connection.
+
     Returns:
-        Dict[str, List[Dict]]: A dictionary with search results and recommendations.
+        Dict: `total`, `categories`, `colors` and `sizes` (value -> count), `price_buckets`
+        (list of {"price_range", "count"}, buckets include their lower bound only) and `stock`
+        ({"in_stock", "out_of_stock"}).
     """
-    logger.info("Starting search_and_recommend_products with parameters.")
-    logger.debug(f"Parameters: name={name}, category={category}, price_range={price_range}")
+    logger.info("Starting get_product_facets.")
+    logger.debug(f"Parameters: name={name}, category={category}, price_range={price_range}, attributes={attributes}")
+    empty = {"total": 0, "categories": {}, "colors": {}, "sizes": {}, "price_buckets": [],
+             "stock": {"in_stock": 0, "out_of_stock": 0}}
 
+    close_conn = conn is None
     try:
         # 打开数据库连接
-        if not conn:
+        if close_conn:
             conn = sqlite3.connect(db)
         cursor = conn.cursor()
 
-        # 构建查询
-        query = "SELECT * FROM products WHERE 1=1"
-        params = []
-
-        if name:
-            query += " AND name LIKE ?"
-            params.append(f"%{name}%")
-        if category:
-            query += " AND category = ?"
-            params.append(category)
+        min_price = max_price = None
         if price_range:
             try:
                 min_price, max_price = map(float, price_range.split('-'))
-                query += " AND price BETWEEN ? AND ?"
-                params.extend([min_price, max_price])
             except ValueError:
                 logger.error("Invalid price_range format. Expected format is 'min-max'.")
-                return {"search_results": [], "recommendations": []}
+                return empty
+        try:
+            attribute_conditions, attribute_params = build_attribute_filter(attributes)
+        except ValueError as e:
+            logger.error(str(e))
+            return empty
+
+        # 命中缓存：同一过滤条件且版本号未变化
+        cache_key = database_key(conn)
+        filter_key = (cache_key, " ".join(name.lower().split()) if name else None, category, min_price, max_price,
+                      tuple(attribute_params))
+        version = get_catalog_version(cursor, "facets") if cache_key else None
+        if version is not None:
+            cached = _facet_cache.get(filter_key, version)
+            if cached is not None:
+                logger.debug(f"Facet cache hit at catalog version {version}.")
+                return cached
 
-        # 执行查询
-        logger.debug(f"Executing query: {query} with params: {params}")
+        # 一次聚合：按所有分面的组合分组，再在内存中汇总各分面
+        bucket_cases = " ".join(f"WHEN p.price < {edge} THEN {i}" for i, edge in enumerate(PRICE_BUCKET_EDGES[1:]))
+        query = f"""
+        SELECT p.category, p.color, p.size, CASE {bucket_cases} ELSE {len(PRICE_BUCKET_EDGES) - 1} END AS bucket,
+               p.stock > 0 AS in_stock, COUNT(*) AS product_count, MAX(p.price) AS max_price
+        """
+        name_match = build_name_match(cursor, name) if name else None
+        if name_match:
+            match_query, params = name_match
+            query += f" FROM ({match_query}) m JOIN products p ON p.id = m.product_id WHERE 1=1"
+        else:
+            query += " FROM products p WHERE 1=1"
+            params = []
+            if name:
+                query += " AND p.name LIKE ?"
+                params.append(f"%{name}%")
+        if category:
+            query += " AND p.category = ?"
+            params.append(category)
+        if price_range:
+            query += " AND p.price BETWEEN ? AND ?"
+            params.extend([min_price, max_price])
+        query += attribute_conditions
+        params.extend(attribute_params)
+        query += " GROUP BY p.category, p.color, p.size, bucket, in_stock"
+
+        logger.debug(f"Executing facet query: {query} with params: {params}")
         cursor.execute(query, params)
-        results = cursor.fetchall()
-
-        # 构建结果
-        products = [dict(zip([column[0] for column in cursor.description], row)) for row in results]
-
-        # 如果没有找到产品，则不执行推荐逻辑
-        if not products:
-            logger.info("No products found. Skipping recommendation.")
-            return {"search_results": [], "recommendations": []}
-
-        # 推荐系统：基于类别和价格范围推荐替代产品
-        recommendations_query = """
-        SELECT * FROM products 
-        WHERE category = ? 
-        AND price BETWEEN ? AND ? 
-        AND name NOT LIKE ? 
-        LIMIT 5
+
+        facets = {"total": 0, "categories": {}, "colors": {}, "sizes": {}, "stock": {"in_stock": 0, "out_of_stock": 0}}
+        bucket_counts, bucket_max = {}, {}
+        for row_category, color, size, bucket, in_stock, count, row_max_price in cursor.fetchall():
+            facets["total"] += count
+            for facet, value in (("categories", row_category), ("colors", color), ("sizes", size)):
+                if value is not None:
+                    facets[facet][value] = facets[facet].get(value, 0) + count
+            facets["stock"]["in_stock" if in_stock else "out_of_stock"] += count
+            bucket_counts[bucket] = bucket_counts.get(bucket, 0) + count
+            bucket_max[bucket] = max(bucket_max.get(bucket, row_max_price), row_max_price)
+
+        facets["price_buckets"] = []
+        for bucket in sorted(bucket_counts):
+            lower = PRICE_BUCKET_EDGES[bucket]
+            upper = PRICE_BUCKET_EDGES[bucket + 1] if bucket + 1 < len(PRICE_BUCKET_EDGES) \
+                else math.ceil(bucket_max[bucket])
+            facets["price_buckets"].append({"price_range": f"{lower}-{upper}", "count": bucket_counts[bucket]})
+        for facet in ("categories", "colors", "sizes"):
+            facets[facet] = dict(sorted(facets[facet].items(), key=lambda item: (-item[1], item[0])))
+        logger.info(f"Computed facets for {facets['total']} products.")
+
+        if version is not None:
+            _facet_cache.put(filter_key, facets, version)
+        return facets
+
+    except sqlite3.Error as e:
+        logger.error(f"Database error: {e}")
+        return empty
+
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        return empty
+
+    finally:
+        # 只关闭本函数打开的连接
+        if close_conn:
+            conn.close()
+
+
+def encode_search_cursor(sort_key: str, sort_value: float, product_id: int) -> str:
+    """
+    Encode the keyset position of the last returned product as an opaque cursor.
+
+    Args:
+        sort_key (str): The ordering the cursor belongs to ("rank" or "price").
+        sort_value (float): The sort value of the last returned product.
+        product_id (int): The ID of the last returned product.
+
+    Returns:
+        str: A URL-safe cursor string.
+    """
+    payload = json.dumps([sort_key, sort_value, product_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_search_cursor(cursor: str) -> Tuple[str, float, int]:
+    """
+    Decode a cursor produced by `encode_search_cursor`.
+
+    Args:
+        cursor (str): The cursor string.
+
+    Returns:
+        Tuple[str, float, int]: The sort key, sort value and product ID.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        sort_key, sort_value, product_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(sort_key), float(sort_value), int(product_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid search cursor: {cursor}") from e
+
+
+def resolve_product_fields(fields: Optional[List[str]] = None) -> List[str]:
+    """
+    Resolve the requested product fields, defaulting to the compact summary.
+
+    Unknown fields are dropped, and `id` is always returned so results can be referenced later.
+
+    Args:
+        fields (List[str]): Requested product columns.
+
+    Returns:
+        List[str]: The columns to select.
+    """
+    if not fields:
+        return list(SUMMARY_FIELDS)
+    unknown = [field for field in fields if field not in PRODUCT_FIELDS]
+    if unknown:
+        logger.warning(f"Ignoring unknown product fields: {unknown}")
+    resolved = [field for field in PRODUCT_FIELDS if field in fields]
+    if "id" not in resolved:
+        resolved.insert(0, "id")
+    return resolved
+
+
+def search_snapshot_page(
+        name: Optional[str],
+        category: Optional[str],
+        min_price: Optional[float],
+        max_price: Optional[float],
+        cursor: Optional[str],
+        page_size: int,
+        columns: List[str],
+        conn,
+) -> Optional[Dict]:
+    """
+    Serve one search page from the memory-mapped catalog snapshot, without a SQL round-trip
+    when only snapshot columns are requested.
+
+    Returns:
+        Optional[Dict]: The page, or None if the snapshot cannot be used.
+    """
+    snapshot = get_snapshot(conn)
+    if snapshot is None:
+        return None
+
+    after = None
+    if cursor:
+        cursor_key, cursor_value, cursor_id = decode_search_cursor(cursor)
+        if cursor_key != "price":
+            raise ValueError("Search cursor does not belong to this query.")
+        after = (cursor_value, cursor_id)
+
+    rows = snapshot.search(name, category, min_price, max_price, after, page_size + 1)
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    items = snapshot.rows(rows, [column for column in columns if column in SNAPSHOT_FIELDS])
+
+    # 快照中没有的列按 ID 一次查询补齐
+    extra_columns = [column for column in columns if column not in SNAPSHOT_FIELDS]
+    if extra_columns and items:
+        db_cursor = conn.cursor()
+        db_cursor.execute(f"""
+        SELECT id, {", ".join(extra_columns)} FROM products
+        WHERE id IN (SELECT value FROM json_each(?))
+        """, (json.dumps([item["id"] for item in items]),))
+        extra = {row[0]: dict(zip(extra_columns, row[1:])) for row in db_cursor.fetchall()}
+        items = [{column: {**item, **extra.get(item["id"], {})}.get(column) for column in columns}
+                 for item in items]
+
+    next_cursor = None
+    if has_more:
+        next_cursor = encode_search_cursor("price", float(snapshot.prices[rows[-1]]), int(snapshot.ids[rows[-1]]))
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def search_semantic_page(
+        name: str,
+        category: Optional[str],
+        min_price: Optional[float],
+        max_price: Optional[float],
+        cursor: Optional[str],
+        page_size: int,
+        columns: List[str],
+        attributes: Optional[Dict[str, str]],
+        conn,
+) -> Optional[Dict]:
+    """
+    Serve one search page ranked by TF-IDF cosine similarity between the query and each
+    product's name, description and additional_specs.
+
+    Returns:
+        Optional[Dict]: The page, with a `score` on every item, or None if the TF-IDF index is
+        unavailable.
+    """
+    ranked = tfidf_search_products(name, conn=conn)
+    if ranked is None:
+        return None
+
+    # 游标分页：排序键为 (-score, id)
+    if cursor:
+        cursor_key, cursor_value, cursor_id = decode_search_cursor(cursor)
+        if cursor_key != "score":
+            raise ValueError("Search cursor does not belong to this query.")
+        ranked = [(product_id, score) for product_id, score in ranked
+                  if (-score, product_id) > (cursor_value, cursor_id)]
+    # 有过滤条件时全部候选交给 SQL 过滤后再截断；否则只需前 page_size + 1 个
+    if not (category or min_price is not None or attributes):
+        ranked = ranked[:page_size + 1]
+    if not ranked:
+        return {"items": [], "next_cursor": None}
+    scores = dict(ranked)
+
+    # 按相似度顺序一次取回候选产品，并应用其余过滤条件
+    query = f"""
+    SELECT {", ".join(f"p.{column}" for column in columns)}
+    FROM json_each(?) AS j
+    JOIN products p ON p.id = j.value
+    WHERE 1=1
+    """
+    params = [json.dumps(list(scores))]
+    if category:
+        query += " AND p.category = ?"
+        params.append(category)
+    if min_price is not None:
+        query += " AND p.price BETWEEN ? AND ?"
+        params.extend([min_price, max_price])
+    attribute_conditions, attribute_params = build_attribute_filter(attributes)
+    query += attribute_conditions
+    params.extend(attribute_params)
+    query += " ORDER BY j.key LIMIT ?"
+    params.append(page_size + 1)
+
+    logger.debug(f"Executing semantic search query: {query} with params: {params}")
+    db_cursor = conn.cursor()
+    db_cursor.execute(query, params)
+    items = [dict(zip(columns, row)) for row in db_cursor.fetchall()]
+
+    has_more = len(items) > page_size
+    items = items[:page_size]
+    for item in items:
+        item["score"] = scores[item["id"]]
+    next_cursor = encode_search_cursor("score", -items[-1]["score"], items[-1]["id"]) if has_more else None
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def search_products_page(
+        name: Optional[str] = None,
+        category: Optional[str] = None,
+        price_range: Optional[str] = None,
+        cursor: Optional[str] = None,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        fields: Optional[List[str]] = None,
+        engine: Optional[str] = None,
+        mode: str = "keyword",
+        attributes: Optional[Dict[str, str]] = None,
+        conn=None,
+) -> Dict:
+    """
+    Return one page of product search results using keyset pagination.
+
+    Name searches are ordered by BM25 rank, products matching only as a name substring last;
+    everything else by price. Ties are broken by id.
+    With the "snapshot" engine every search is a name substring filter ordered by price.
+    In "semantic" mode a name search is ranked by TF-IDF similarity instead.
+
+    Args:
+        name (str): The product name or partial name to search for.
+        category (str): The category to filter products by.
+        price_range (str): A price range in the format "min-max".
+        cursor (str): The `next_cursor` of the previous page, or None for the first page.
+        page_size (int): Number of products per page (capped at MAX_PAGE_SIZE).
+        fields (List[str]): Product columns to return; defaults to SUMMARY_FIELDS.
+        engine (str): "sql" or "snapshot"; defaults to the CATALOG_ENGINE environment variable.
+        mode (str): "keyword" or "semantic".
+        attributes (Dict[str, str]): Spec attributes the products must have, e.g. {"Brand": "Samsung"}.
+        conn: SQLite database connection.
+
+    Returns:
+        Dict: {"items": [...], "next_cursor": str or None}
+
+    Raises:
+        ValueError: If price_range, cursor, mode or attributes is malformed.
+    """
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Invalid search mode '{mode}'. Expected one of {', '.join(SEARCH_MODES)}.")
+    page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+    columns = resolve_product_fields(fields)
+    min_price = max_price = None
+    if price_range:
+        try:
+            min_price, max_price = map(float, price_range.split('-'))
+        except ValueError as e:
+            raise ValueError("Invalid price_range format. Expected format is 'min-max'.") from e
+
+    # 语义搜索：TF-IDF 索引不可用时（缺少 numpy）继续使用关键词搜索
+    if mode == "semantic" and name:
+        page = search_semantic_page(name, category, min_price, max_price, cursor, page_size, columns, attributes, conn)
+        if page is not None:
+            return page
+        logger.warning("TF-IDF index is unavailable, searching by keyword.")
+
+    # 列式快照引擎：不可用时（缺少 numpy、内存数据库）或按规格过滤时继续使用 SQL
+    if (engine or CATALOG_ENGINE) == "snapshot" and not attributes:
+        page = search_snapshot_page(name, category, min_price, max_price, cursor, page_size, columns, conn)
+        if page is not None:
+            return page
+        logger.warning("Catalog snapshot is unavailable, searching with SQL.")
+
+    select_list = ", ".join(f"p.{column}" for column in columns)
+    db_cursor = conn.cursor()
+
+    # 构建查询：优先使用 FTS5 全文索引并按 BM25 排序（名称子串匹配排在其后），不可用时回退到 LIKE
+    name_match = build_name_match(db_cursor, name) if name else None
+    if name_match:
+        sort_key = "rank"
+        match_query, params = name_match
+        query = f"""
+        SELECT {select_list}, m.score AS sort_value
+        FROM ({match_query}) m
+        JOIN products p ON p.id = m.product_id
+        WHERE 1=1
         """
-        # 推荐的价格范围为原价格上下浮动 20%
-        recommended_params = [
-            category or products[0]["category"],
-            products[0]["price"] * 0.8,
-            products[0]["price"] * 1.2,
-            f"%{name or ''}%"
-        ]
-        logger.debug(f"Executing recommendation query: {recommendations_query} with params: {recommended_params}")
-        cursor.execute(recommendations_query, recommended_params)
-        recommendations_results = cursor.fetchall()
-        recommendations = [
-            dict(zip([column[0] for column in cursor.description], row)) for row in recommendations_results
-        ]
-
-        logger.info(
-            f"search_and_recommend_products found {len(products)} search results and {len(recommendations)} recommendations.")
-        return {"search_results": products, "recommendations": recommendations}
+    else:
+        sort_key = "price"
+        query = f"SELECT {select_list}, p.price AS sort_value FROM products p WHERE 1=1"
+        params = []
+        if name:
+            query += " AND p.name LIKE ?"
+            params.append(f"%{name}%")
+
+    if category:
+        query += " AND p.category = ?"
+        params.append(category)
+    if price_range:
+        query += " AND p.price BETWEEN ? AND ?"
+        params.extend([min_price, max_price])
+    attribute_conditions, attribute_params = build_attribute_filter(attributes)
+    query += attribute_conditions
+    params.extend(attribute_params)
+
+    # 游标分页：从上一页最后一条记录之后继续
+    if cursor:
+        cursor_key, cursor_value, cursor_id = decode_search_cursor(cursor)
+        if cursor_key != sort_key:
+            raise ValueError("Search cursor does not belong to this query.")
+        query = f"SELECT * FROM ({query}) WHERE (sort_value, id) > (?, ?)"
+        params.extend([cursor_value, cursor_id])
+
+    query += " ORDER BY sort_value, id LIMIT ?"
+    params.append(page_size + 1)
+
+    logger.debug(f"Executing query: {query} with params: {params}")
+    db_cursor.execute(query, params)
+    rows = db_cursor.fetchall()
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    items = [dict(zip(columns, row[:-1])) for row in rows]
+    next_cursor = encode_search_cursor(sort_key, rows[-1][-1], rows[-1][0]) if has_more else None
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def fuzzy_search_products(
+        name: str,
+        category: Optional[str] = None,
+        price_range: Optional[str] = None,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        fields: Optional[List[str]] = None,
+        attributes: Optional[Dict[str, str]] = None,
+        conn=None,
+) -> List[Dict]:
+    """
+    Find the products whose names are closest to a misspelled or partial name.
+
+    Used when the exact search finds nothing. The category, price and attribute filters apply to
+    every match above the similarity threshold before the results are cut to `page_size`.
+
+    Args:
+        name (str): The product name as typed by the user.
+        category (str): The category to filter products by.
+        price_range (str): A price range in the format "min-max".
+        page_size (int): Maximum number of products to return.
+        fields (List[str]): Product columns to return; defaults to SUMMARY_FIELDS.
+        attributes (Dict[str, str]): Spec attributes the products must have.
+        conn: SQLite database connection.
+
+    Returns:
+        List[Dict]: The closest products, best first, each with a `similarity` in [0, 1].
+
+    Raises:
+        ValueError: If price_range or attributes is malformed.
+    """
+    page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+    columns = resolve_product_fields(fields)
+    # 有过滤条件时取回全部超过阈值的候选，由 SQL 过滤后再截断；否则只需前 page_size 个
+    filtered = bool(category or price_range or attributes)
+    matches = dict(fuzzy_match_products(name, None if filtered else page_size, conn=conn))
+    if not matches:
+        return []
+
+    # 按相似度顺序一次取回候选产品，并应用其余过滤条件
+    query = f"""
+    SELECT {", ".join(f"p.{column}" for column in columns)}
+    FROM json_each(?) AS j
+    JOIN products p ON p.id = j.value
+    WHERE 1=1
+    """
+    params = [json.dumps(list(matches))]
+    if category:
+        query += " AND p.category = ?"
+        params.append(category)
+    if price_range:
+        try:
+            min_price, max_price = map(float, price_range.split('-'))
+        except ValueError as e:
+            raise ValueError("Invalid price_range format. Expected format is 'min-max'.") from e
+        query += " AND p.price BETWEEN ? AND ?"
+        params.extend([min_price, max_price])
+    attribute_conditions, attribute_params = build_attribute_filter(attributes)
+    query += attribute_conditions
+    params.extend(attribute_params)
+    query += " ORDER BY j.key LIMIT ?"
+    params.append(page_size)
+
+    logger.debug(f"Executing fuzzy match query: {query} with params: {params}")
+    db_cursor = conn.cursor()
+    db_cursor.execute(query, params)
+    items = [dict(zip(columns, row)) for row in db_cursor.fetchall()]
+    for item in items:
+        item["similarity"] = matches[item["id"]]
+    return items
+
+
+def recommend_products(
+        products: List[Dict],
+        name: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+        limit: int = RECOMMENDATION_LIMIT,
+        conn=None,
+) -> List[Dict]:
+    """
+    Recommend alternatives to the first search result.
+
+    Reads the neighbors precomputed by `scripts/build_product_neighbors.py` with one indexed lookup,
+    skipping products already in the results or whose name matches the search.
+
+    Args:
+        products (List[Dict]): The current page of search results; the first one is the anchor.
+        name (str): The searched product name.
+        fields (List[str]): Product columns to return.
+        limit (int): Maximum number of recommendations.
+        conn: SQLite database connection.
+
+    Returns:
+        List[Dict]: Recommended products.
+    """
+    columns = resolve_product_fields(fields)
+    select_list = ", ".join(f"p.{column}" for column in columns)
+    cursor = conn.cursor()
+
+    recommendations_query = f"""
+    SELECT {select_list}, p.name AS match_name
+    FROM product_neighbors n
+    JOIN products p ON p.id = n.neighbor_id
+    WHERE n.product_id = ?
+    ORDER BY n.rank
+    """
+    logger.debug(f"Executing recommendation query: {recommendations_query} with params: {products[0]['id']}")
+    cursor.execute(recommendations_query, (products[0]["id"],))
+
+    result_ids = {product["id"] for product in products}
+    needle = (name or "").lower()
+    recommendations = []
+    for row in cursor.fetchall():
+        item = dict(zip(columns, row[:-1]))
+        if item["id"] in result_ids or (needle and needle in row[-1].lower()):
+            continue
+        recommendations.append(item)
+        if len(recommendations) >= limit:
+            break
+    return recommendations
+
+
+def search_cache_key(conn, name, category, price_range, cursor, page_size, fields, search_mode,
+                     attributes) -> Optional[Tuple]:
+    """
+    Build the search cache key from normalized search parameters, so that "T-Shirt " and
+    "t-shirt" or "10-20" and "10.0-20" share an entry.
+
+    Returns:
+        Optional[Tuple]: The key, or None if the search must not be cached (in-memory database
+        or unparseable parameters, which are reported by the search itself).
+    """
+    db_key = database_key(conn)
+    if db_key is None:
+        return None
+    try:
+        prices = tuple(map(float, price_range.split('-'))) if price_range else None
+        page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+        attribute_key = tuple(sorted((str(key).lower(), str(value).lower())
+                                     for key, value in (attributes or {}).items()))
+    except (AttributeError, TypeError, ValueError):
+        return None
+    return (db_key, " ".join(name.lower().split()) if name else None, category, prices, cursor, page_size,
+            tuple(resolve_product_fields(fields)), search_mode, attribute_key, CATALOG_ENGINE)
+
+
+def get_search_cache_stats() -> Dict[str, int]:
+    """
+    Report the search result cache counters.
+
+    Returns:
+        Dict[str, int]: `hits`, `misses`, `evictions`, `entries`, `bytes` and `max_bytes`.
+    """
+    return _search_cache.stats()
+
+
+def refresh_cached_stock(cursor, result: Dict) -> Dict:
+    """
+    Return a cached search result with the current stock of its products.
+
+    Stock changes that keep a product in (or out of) stock do not invalidate cached searches,
+    so the stock values are re-read by primary key on every cache hit.
+
+    Args:
+        cursor: SQLite cursor.
+        result (Dict): The cached search result; it is not modified.
+
+    Returns:
+        Dict: The search result with up-to-date `stock` fields.
+    """
+    items = result["search_results"] + result["recommendations"]
+    ids = [item["id"] for item in items if "stock" in item]
+    if not ids:
+        return result
+    cursor.execute("SELECT id, stock FROM products WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(ids),))
+    stock = dict(cursor.fetchall())
+
+    def refreshed(products):
+        return [{**item, "stock": stock.get(item["id"], item["stock"])} if "stock" in item else item
+                for item in products]
+
+    return {**result, "search_results": refreshed(result["search_results"]),
+            "recommendations": refreshed(result["recommendations"])}
+
+
+def search_and_recommend_products(
+        name: Optional[str] = None,
+        category: Optional[str] = None,
+        price_range: Optional[str] = None,
+        cursor: Optional[str] = None,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        fields: Optional[List[str]] = None,
+        search_mode: str = "keyword",
+        attributes: Optional[Dict[str, str]] = None,
+        conn=None,
+) -> Dict:
+    """
+    Search for products based on name, category, and price range, and recommend related products.
+
+    Results are paginated; recommendations are only computed for the first page. When a name
+    search finds nothing, the closest names are returned instead, each with a `similarity` score.
+
+    Results for file databases are cached by their normalized parameters. An entry is dropped when
+    a product of the searched category (or, without a category filter, any product) changes, or
+    after SEARCH_CACHE_TTL seconds.
+
+    Args:
+        name (str): The product name or partial name to search for.
+        category (str): The category to filter products by.
+        price_range (str): A price range in the format "min-max".
+        cursor (str): The `next_cursor` returned by the previous page.
+        page_size (int): Number of products per page.
+        fields (List[str]): Product columns to return; defaults to a compact summary.
+        search_mode (str): "keyword" to match the name, or "semantic" to rank by TF-IDF similarity
+            of the name, description and specs.
+        attributes (Dict[str, str]): Spec attributes the products must have, e.g. {"Brand": "Samsung"}.
+        conn
+    Returns:
+        Dict: Search results, recommendations and the cursor of the next page.
+    """
+    logger.info("Starting search_and_recommend_products with parameters.")
+    logger.debug(f"Parameters: name={name}, category={category}, price_range={price_range}, "
+                 f"cursor={cursor}, page_size={page_size}, fields={fields}, search_mode={search_mode}, "
+                 f"attributes={attributes}")
+
+    close_conn = conn is None
+    try:
+        # 打开数据库连接
+        if close_conn:
+            conn = sqlite3.connect(db)
+
+        # 命中缓存：同一规范化搜索参数，且相关版本号未变化
+        db_cursor = conn.cursor()
+        cache_key = search_cache_key(conn, name, category, price_range, cursor, page_size, fields, search_mode,
+                                     attributes)
+        version = None
+        if cache_key is not None:
+            version = get_category_version(db_cursor, category) if category \
+                else get_catalog_version(db_cursor, "search")
+        if version is not None:
+            cached = _search_cache.get(cache_key, version)
+            if cached is not None:
+                logger.info("Search cache hit.")
+                return refresh_cached_stock(db_cursor, cached)
+
+        try:
+            page = search_products_page(name, category, price_range, cursor, page_size, fields,
+                                        mode=search_mode, attributes=attributes, conn=conn)
+        except ValueError as e:
+            logger.error(str(e))
+            return {"search_results": [], "recommendations": [], "next_cursor": None}
+        products = page["items"]
+
+        # 精确搜索没有结果时，按名称三元组相似度返回最接近的产品（可能是拼写错误或部分名称）
+        if not products and name and not cursor and search_mode == "keyword":
+            products = fuzzy_search_products(name, category, price_range, page_size, fields, attributes, conn=conn)
+            if products:
+                logger.info(f"No exact match for '{name}', returning {len(products)} fuzzy matches.")
+
+        # 如果没有找到产品或者不是第一页，则不执行推荐逻辑
+        if not products or cursor:
+            logger.info("No products found or not the first page. Skipping recommendation.")
+            recommendations = []
+        else:
+            recommendations = recommend_products(products, name, fields, conn=conn)
+            logger.info(f"search_and_recommend_products found {len(products)} search results and "
+                        f"{len(recommendations)} recommendations.")
+
+        result = {"search_results": products, "recommendations": recommendations, "next_cursor": page["next_cursor"]}
+        if version is not None:
+            _search_cache.put(cache_key, result, version)
+        return result
 
     except sqlite3.Error as e:
         logger.error(f"Database error: {e}")
-        return {"search_results": [], "recommendations": []}
+        return {"search_results": [], "recommendations": [], "next_cursor": None}
 
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
-        return {"search_results": [], "recommendations": []}
+        return {"search_results": [], "recommendations": [], "next_cursor": None}
 
     finally:
-        # 确保关闭连接
-        if 'conn' in locals():
+        # 只关闭本函数打开的连接
+        if close_conn:
             conn.close()
 
 
@@ -201,60 +1007,136 @@ def check_product_stock(product_id: int, conn=None) -> Optional[Dict]:
             conn.close()
 
 
+def check_products_stock(product_ids: List[int], conn=None) -> List[Dict]:
+    """
+    Check the stock information of many products with a single query.
+
+    The IDs are bound as one JSON array parameter, so the statement stays the same and well under
+    SQLite's variable limit no matter how many IDs are passed.
+
+    Args:
+        product_ids (List[int]): The IDs of the products to check.
+        conn: SQLite database connection.
+
+    Returns:
+        List[Dict]: Stock information for every product found, ordered by ID. Unknown IDs are skipped.
+    """
+    logger.info(f"Checking stock for {len(product_ids)} products.")
+    if not product_ids:
+        return []
+
+    close_conn = conn is None
+    try:
+        # 打开数据库连接
+        if close_conn:
+            conn = sqlite3.connect(db)
+        cursor = conn.cursor()
+
+        # 一次查询所有产品的库存信息
+        query = """
+        SELECT id, name, category, stock
+        FROM products
+        WHERE id IN (SELECT value FROM json_each(?))
+        ORDER BY id
+        """
+        ids = sorted({int(product_id) for product_id in product_ids})
+        cursor.execute(query, (json.dumps(ids),))
+        columns = [column[0] for column in cursor.description]
+        stock_info = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        if len(stock_info) < len(ids):
+            found = {item["id"] for item in stock_info}
+            logger.warning(f"No stock information found for products {[i for i in ids if i not in found]}.")
+        logger.info(f"Found stock information for {len(stock_info)} products.")
+        return stock_info
+
+    except sqlite3.Error as e:
+        logger.error(f"Database error while checking stock for products: {e}")
+        return []
+
+    except Exception as e:
+        logger.error(f"Unexpected error while checking stock for products: {e}")
+        return []
+
+    finally:
+        if close_conn:
+            conn.close()
+
+
 @tool
-def list_categories_tool() -> List[str]:
+def list_categories_tool() -> str:
     """
-    List all available product categories in the database.
+    List all available product categories in the database, with the number of products
+    and the price range of each category.
 
     Returns:
-        List[str]: A list of unique product categories.
+        str: A table with one line per category: `category`, `product_count`, `min_price` and `max_price`.
+    """
+    return encode_output(list_category_summaries())
+
+
+@tool
+def get_product_facets_tool(name: Optional[str] = None, category: Optional[str] = None,
+                            price_range: Optional[str] = None,
+                            attributes: Optional[Dict[str, str]] = None) -> str:
+    """
+    Count the products matching a search, broken down by category, color, size, price range and
+    stock status. Use it to narrow a broad request step by step (e.g. pick the category or price
+    range with results) before calling search_and_recommend_products_tool with those filters.
+
+    Args:
+        name (str): The product name or partial name to search for.
+        category (str): The category to filter products by.
+        price_range (str): A price range in the format "min-max".
+        attributes (Dict[str, str]): Spec attributes the products must have, e.g. {"Material": "Wool"}.
+
+    Returns:
+        str: One line per facet: `total`, counts per `categories`, `colors` and `sizes`, `price_buckets`
+        whose `price_range` can be passed back as a filter, and `stock` (in_stock / out_of_stock).
     """
-    return list_categories()
+    return encode_output(get_product_facets(name, category, price_range, attributes))
 
 
 @tool
 def search_and_recommend_products_tool(name: Optional[str] = None, category: Optional[str] = None,
-                                       price_range: Optional[str] = None) -> Dict[str, List[Dict]]:
+                                       price_range: Optional[str] = None, cursor: Optional[str] = None,
+                                       page_size: int = DEFAULT_PAGE_SIZE,
+                                       fields: Optional[List[str]] = None,
+                                       search_mode: str = "keyword",
+                                       attributes: Optional[Dict[str, str]] = None) -> str:
     """
         Search for products based on name, category, and price range, and recommend related products.
+        Results are paginated: if `next_cursor` is not null, call again with the same filters and
+        `cursor=next_cursor` to get the next page. If nothing matches the name exactly, the closest
+        names are returned instead (typos and partial names are tolerated), each with a `similarity`
+        score between 0 and 1.
 
         Args:
             name (str): The product name or partial name to search for.
             category (str): The category to filter products by.
             price_range (str): A price range in the format "min-max".
+            cursor (str): The `next_cursor` from the previous page. Leave empty for the first page.
+            page_size (int): Number of products per page, at most 100. Default is 20.
+            fields (List[str]): Product fields to return. Default is id, name, price, stock, category;
+                also available: description, color, size, additional_specs, image_url, created_at, updated_at.
+            search_mode (str): "keyword" (default) matches the product name. "semantic" treats `name` as a
+                free-text description such as "noise cancelling sony headphones" and ranks products by
+                similarity of their name, description and specs (Brand, Feature, Material, ...), each
+                with a `score`.
+            attributes (Dict[str, str]): Spec attributes the products must have, matched exactly but
+                case-insensitively, e.g. {"Brand": "Samsung", "Feature": "5G"} or {"Material": "Wool"}.
+                Common specs: Brand, Feature, Material, Fit, Energy Rating, Power, Warranty, Author.
 
         Returns:
-            Dict[str, List[Dict]]: A dictionary with search results and recommendations.
+            str: `search_results` and `recommendations` as tables (a header line, then one `|`-separated
+            line per product; long text is truncated), and `next_cursor`.
         """
-    return search_and_recommend_products(name, category, price_range)
-
-#
-# @tool
-# def update_stock_on_cancellation_tool(order_id: int, conn=None):
-#     """
-#     Restore product stock when an order is cancelled.
-#
-#     Args:
-#         order_id (int): The ID of the cancelled order.
-#         conn: SQLite database connection.
-#     """
-#     return update_stock_on_cancellation(order_id, conn)
-#
-#
-# @tool
-# def update_stock_on_order_tool(order_id: int, conn=None):
-#     """
-#     Update product stock when an order is activated or completed.
-#
-#     Args:
-#         order_id (int): The ID of the order.
-#         conn: SQLite database connection.
-#     """
-#     return update_stock_on_order(order_id, conn)
+    return encode_output(search_and_recommend_products(name, category, price_range, cursor, page_size, fields,
+                                                       search_mode, attributes))
 
 
 @tool
-def check_product_stock_tool(product_id: int, conn=None) -> Optional[Dict]:
+def check_product_stock_tool(product_id: int, conn=None) -> str:
     """
     Check the stock information of a specific product.
 
@@ -263,6 +1145,21 @@ def check_product_stock_tool(product_id: int, conn=None) -> Optional[Dict]:
         conn: SQLite database connection.
 
     Returns:
-        Optional[Dict]: A dictionary containing product stock information or None if not found.
+        str: The product's id, name, category and stock, or null if not found.
+    """
+    return encode_output(check_product_stock(product_id, conn))
+
+
+@tool
+def check_products_stock_tool(product_ids: List[int]) -> str:
+    """
+    Check the stock information of several products at once, e.g. every product in the cart
+    or in a page of search results. Prefer this over calling check_product_stock_tool repeatedly.
+
+    Args:
+        product_ids (List[int]): The IDs of the products to check.
+
+    Returns:
+        str: A table of stock information (id, name, category, stock) for every product found.
     """
-    return check_product_stock(product_id, conn)
+    return encode_output(check_products_stock(product_ids))
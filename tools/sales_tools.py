@@ -0,0 +1,184 @@
+"""
+@Time ： 2024-11-28
+@Auth ： Adam Lyu
+@Desc ： Read-only tools over the materialized sales aggregates.
+
+The aggregate tables are maintained by triggers on `order_events` in the checkout and
+cancellation transactions (see `create_sales_aggregates`), so these reads never scan orders;
+`scripts/rebuild_sales_aggregates.py` rebuilds them from the orders.
+"""
+from typing import Dict, List, Optional
+from langchain_core.tools import tool
+import sqlite3
+import os
+from utils.logger import logger
+from utils.output_encoder import encode_output
+
+# 定义数据库路径
+db = os.path.join(os.path.dirname(__file__), "../data/ecommerce.db")
+
+MAX_SALES_LIMIT = 100
+MAX_SALES_DAYS = 366
+
+
+def get_top_products(category: Optional[str] = None, limit: int = 10, conn=None) -> List[Dict]:
+    """
+    Retrieve the best-selling products by units sold, excluding cancelled orders.
+
+    Args:
+        category (str, optional): Only products in this category.
+        limit (int): Number of products to return, at most 100.
+        conn: Optional database connection.
+
+    Returns:
+        List[Dict]: `id`, `name`, `category`, `units_sold` and `revenue` per product, best-selling first.
+    """
+    limit = max(1, min(limit, MAX_SALES_LIMIT))
+    close_conn = conn is None
+    if close_conn:
+        logger.info(f"Retrieving top {limit} products (category: {category}).")
+        conn = sqlite3.connect(db)
+
+    try:
+        rows = conn.execute("""
+        SELECT s.product_id, p.name, p.category, s.units_sold, s.revenue
+        FROM product_sales s
+        JOIN products p ON p.id = s.product_id
+        WHERE s.units_sold > 0 AND (? IS NULL OR p.category = ?)
+        ORDER BY s.units_sold DESC, s.revenue DESC
+        LIMIT ?
+        """, (category, category, limit)).fetchall()
+    except Exception as e:
+        logger.error(f"Error retrieving top products: {e}")
+        raise
+    finally:
+        if close_conn:
+            conn.close()
+    return [{"id": product_id, "name": name, "category": product_category, "units_sold": units,
+             "revenue": round(revenue, 2)} for product_id, name, product_category, units, revenue in rows]
+
+
+def get_purchase_history(user_id: int, limit: int = 20, conn=None) -> List[Dict]:
+    """
+    Retrieve the products a user has bought, most recently bought first, excluding cancelled orders.
+
+    Args:
+        user_id (int): The ID of the user.
+        limit (int): Number of products to return, at most 100.
+        conn: Optional database connection.
+
+    Returns:
+        List[Dict]: `id`, `name`, `units` bought in total and `last_purchased_at` per product.
+    """
+    limit = max(1, min(limit, MAX_SALES_LIMIT))
+    close_conn = conn is None
+    if close_conn:
+        logger.info(f"Retrieving purchase history for user {user_id}.")
+        conn = sqlite3.connect(db)
+
+    try:
+        rows = conn.execute("""
+        SELECT u.product_id, p.name, u.units, u.last_purchased_at
+        FROM user_product_purchases u
+        LEFT JOIN products p ON p.id = u.product_id
+        WHERE u.user_id = ? AND u.units > 0
+        ORDER BY u.last_purchased_at DESC, u.product_id
+        LIMIT ?
+        """, (user_id, limit)).fetchall()
+    except Exception as e:
+        logger.error(f"Error retrieving purchase history for user {user_id}: {e}")
+        raise
+    finally:
+        if close_conn:
+            conn.close()
+    return [{"id": product_id, "name": name, "units": units, "last_purchased_at": last_purchased_at}
+            for product_id, name, units, last_purchased_at in rows]
+
+
+def get_category_sales(category: Optional[str] = None, days: int = 30, conn=None) -> List[Dict]:
+    """
+    Retrieve units sold and revenue per category and day over the last `days` days, newest first.
+
+    Args:
+        category (str, optional): Only this category.
+        days (int): Number of days to cover, at most 366.
+        conn: Optional database connection.
+
+    Returns:
+        List[Dict]: `category`, `day`, `units` and `revenue` per category and day with sales.
+    """
+    days = max(1, min(days, MAX_SALES_DAYS))
+    close_conn = conn is None
+    if close_conn:
+        logger.info(f"Retrieving sales of the last {days} days (category: {category}).")
+        conn = sqlite3.connect(db)
+
+    try:
+        rows = conn.execute("""
+        SELECT category, day, units, revenue
+        FROM category_daily_sales
+        WHERE day >= date('now', ?) AND (? IS NULL OR category = ?) AND units > 0
+        ORDER BY day DESC, revenue DESC
+        """, (f"-{days - 1} days", category, category)).fetchall()
+    except Exception as e:
+        logger.error(f"Error retrieving category sales: {e}")
+        raise
+    finally:
+        if close_conn:
+            conn.close()
+    return [{"category": row_category, "day": day, "units": units, "revenue": round(revenue, 2)}
+            for row_category, day, units, revenue in rows]
+
+
+@tool
+def get_top_products_tool(category: Optional[str] = None, limit: int = 10) -> str:
+    """
+    Retrieve the best-selling products, optionally within one category.
+
+    Args:
+        category (str, optional): Only products in this category.
+        limit (int): Number of products to return. Default is 10, at most 100.
+
+    Returns:
+        str: A table of products with their units sold and revenue, or a message if nothing has sold.
+    """
+    products = get_top_products(category, limit)
+    if not products:
+        return "No sales found."
+    return encode_output(products)
+
+
+@tool
+def get_purchase_history_tool(user_id: int, limit: int = 20) -> str:
+    """
+    Retrieve the products a user has bought before, most recent first. Use it for "buy again" questions.
+
+    Args:
+        user_id (int): The ID of the user.
+        limit (int): Number of products to return. Default is 20, at most 100.
+
+    Returns:
+        str: A table of products with the units bought and when they were last bought.
+    """
+    products = get_purchase_history(user_id, limit)
+    if not products:
+        return f"No purchases found for user {user_id}."
+    return encode_output(products)
+
+
+@tool
+def get_category_sales_tool(category: Optional[str] = None, days: int = 30) -> str:
+    """
+    Retrieve daily units sold and revenue per category.
+
+    Args:
+        category (str, optional): Only this category.
+        days (int): Number of days to cover. Default is 30, at most 366.
+
+    Returns:
+        str: A table with one row per category and day that had sales, newest first.
+    """
+    sales = get_category_sales(category, days)
+    if not sales:
+        return "No sales found."
+    return encode_output(sales)
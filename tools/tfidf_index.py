@@ -0,0 +1,254 @@
+"""
+@Time ： 2024-11-22
+@Auth ： Adam Lyu
+@Desc ： Offline TF-IDF vector search over product name, description and additional_specs.
+
+Each product is a sparse vector of sublinear term frequencies (name terms weighted higher) stored
+as NumPy COO arrays; IDF weights and document norms are recomputed vectorized whenever products
+are added, while tokenization is only done once per product. Queries are ranked by cosine
+similarity. The index is cached per database file and follows the `text` catalog version: if
+only inserts happened since the last build, the new products are appended instead of rebuilding.
+"""
+import json
+import math
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from tools.fuzzy_index import CJK_WORD, normalize_text
+from utils.db_utils import database_key, get_catalog_version
+from utils.logger import logger
+
+try:
+    import numpy as np
+except ImportError:  # numpy 是可选依赖，没有时语义搜索不可用
+    np = None
+
+# 各字段的词频权重
+FIELD_WEIGHTS = {"name": 3.0, "description": 1.0, "additional_specs": 1.0}
+# 不参与检索的常见英文词
+STOP_WORDS = frozenset(
+    "a an and are as at be by for from in is it of on or the this that to with".split()
+)
+
+_indexes: Dict[str, Tuple[int, "TfidfIndex"]] = {}
+_indexes_lock = threading.Lock()
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into index terms: lowercased words with a trailing plural "s" removed, and
+    character bigrams for CJK runs.
+
+    Args:
+        text (str): Raw text.
+
+    Returns:
+        List[str]: The terms, with repetitions.
+    """
+    terms = []
+    for word in normalize_text(text).split():
+        if CJK_WORD.match(word):
+            terms.extend(word[i:i + 2] for i in range(max(len(word) - 1, 1)))
+        elif word not in STOP_WORDS:
+            if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+                word = word[:-1]
+            terms.append(word)
+    return terms
+
+
+def product_terms(name: Optional[str], description: Optional[str], additional_specs: Optional[str]) -> Counter:
+    """
+    Weighted term frequencies of one product. Only the values of additional_specs are indexed.
+
+    Returns:
+        Counter: term -> weighted frequency.
+    """
+    specs = ""
+    if additional_specs:
+        try:
+            parsed = json.loads(additional_specs)
+            specs = " ".join(str(value) for value in parsed.values()) if isinstance(parsed, dict) else str(parsed)
+        except ValueError:
+            specs = additional_specs
+
+    counts = Counter()
+    for field, text in (("name", name), ("description", description), ("additional_specs", specs)):
+        for term in tokenize(text or ""):
+            counts[term] += FIELD_WEIGHTS[field]
+    return counts
+
+
+class TfidfIndex:
+    """
+    Sparse TF-IDF matrix in column-major (per term) layout.
+    """
+
+    def __init__(self, ids, vocabulary: Dict[str, int], rows, terms, tfs):
+        self.ids = ids
+        self.vocabulary = vocabulary
+        self.max_id = int(ids.max()) if len(ids) else 0
+        # 原始 COO 数据，增量添加产品时直接拼接
+        self._coo = (rows, terms, tfs)
+
+        # 按词排序得到每个词的倒排区间
+        order = np.argsort(terms, kind="stable")
+        self.rows, self.tfs = rows[order], tfs[order]
+        df = np.bincount(terms, minlength=len(vocabulary))
+        self.indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(df, out=self.indptr[1:])
+
+        # 平滑 IDF，与 scikit-learn 的 TfidfVectorizer 相同
+        self.idf = np.log((1 + len(ids)) / (1 + df)) + 1
+        weights = self.tfs * self.idf[terms[order]]
+        self.norms = np.sqrt(np.bincount(self.rows, weights ** 2, minlength=len(ids)))
+        self.norms[self.norms == 0] = 1.0
+        self.weights = weights
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, products: List[Tuple], base: Optional["TfidfIndex"] = None) -> "TfidfIndex":
+        """
+        Build an index from (id, name, description, additional_specs) rows, optionally appending
+        them to an existing index.
+
+        Args:
+            products (List[Tuple]): Product rows.
+            base (TfidfIndex): Index to extend; it is not modified.
+
+        Returns:
+            TfidfIndex: The new index.
+        """
+        vocabulary = dict(base.vocabulary) if base else {}
+        offset = len(base) if base else 0
+        rows, terms, tfs = [], [], []
+        for row, (_, name, description, additional_specs) in enumerate(products, start=offset):
+            for term, count in product_terms(name, description, additional_specs).items():
+                rows.append(row)
+                terms.append(vocabulary.setdefault(term, len(vocabulary)))
+                tfs.append(1 + math.log(count))
+
+        ids = np.array([product[0] for product in products], dtype=np.int64)
+        rows = np.array(rows, dtype=np.int64)
+        terms = np.array(terms, dtype=np.int64)
+        tfs = np.array(tfs, dtype=np.float64)
+        if base:
+            base_rows, base_terms, base_tfs = base._coo
+            ids = np.concatenate([base.ids, ids])
+            rows = np.concatenate([base_rows, rows])
+            terms = np.concatenate([base_terms, terms])
+            tfs = np.concatenate([base_tfs, tfs])
+        return cls(ids, vocabulary, rows, terms, tfs)
+
+    def search(self, text: str, limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Rank products by cosine similarity to a query.
+
+        Args:
+            text (str): The query.
+            limit (int): Maximum number of results; None for every product with a positive score.
+
+        Returns:
+            List[Tuple[int, float]]: (product ID, score) pairs ordered by score, then ID.
+        """
+        query = Counter(term for term in tokenize(text) if term in self.vocabulary)
+        if not query:
+            return []
+
+        scores = np.zeros(len(self.ids))
+        query_norm = 0.0
+        for term, count in query.items():
+            column = self.vocabulary[term]
+            weight = (1 + math.log(count)) * self.idf[column]
+            query_norm += weight ** 2
+            start, end = self.indptr[column], self.indptr[column + 1]
+            np.add.at(scores, self.rows[start:end], weight * self.weights[start:end])
+        # 先取整，使排序与分页游标比较的是同一个分数
+        scores = np.round(scores / (self.norms * math.sqrt(query_norm)), 4)
+
+        matched = np.flatnonzero(scores > 0)
+        if limit is not None and len(matched) > limit:
+            matched = matched[np.argpartition(-scores[matched], limit - 1)[:limit]]
+        matched = matched[np.lexsort((self.ids[matched], -scores[matched]))]
+        return [(int(self.ids[row]), float(scores[row])) for row in matched]
+
+
+def build_index(cursor) -> "TfidfIndex":
+    """
+    Build a TF-IDF index over every product.
+
+    Args:
+        cursor: SQLite cursor.
+
+    Returns:
+        TfidfIndex: The index.
+    """
+    cursor.execute("""
+    SELECT id, name, description, additional_specs FROM products ORDER BY id -- allow-full-scan: TF-IDF index build
+    """)
+    index = TfidfIndex.build(cursor.fetchall())
+    logger.info(f"Built TF-IDF index over {len(index)} products and {len(index.vocabulary)} terms.")
+    return index
+
+
+def get_index(conn) -> Optional["TfidfIndex"]:
+    """
+    Return the TF-IDF index for the connected database, bringing it up to date first.
+
+    The `text` catalog version grows by one per inserted, deleted or updated product. When it grew
+    by exactly the number of products above the indexed maximum ID, only inserts happened and those
+    products are appended; otherwise the index is rebuilt. In-memory databases get a fresh index on
+    every call.
+
+    Args:
+        conn: SQLite database connection.
+
+    Returns:
+        Optional[TfidfIndex]: The index, or None if numpy is not installed.
+    """
+    if np is None:
+        return None
+    cursor = conn.cursor()
+    cache_key = database_key(conn)
+    version = get_catalog_version(cursor, "text") if cache_key else None
+    if version is None:
+        return build_index(cursor)
+
+    with _indexes_lock:
+        cached = _indexes.get(cache_key)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        index = None
+        if cached:
+            cached_version, cached_index = cached
+            cursor.execute("""
+            SELECT id, name, description, additional_specs FROM products WHERE id > ? ORDER BY id
+            """, (cached_index.max_id,))
+            inserted = cursor.fetchall()
+            if version - cached_version == len(inserted):
+                index = TfidfIndex.build(inserted, base=cached_index)
+                logger.info(f"Added {len(inserted)} products to the TF-IDF index.")
+        if index is None:
+            index = build_index(cursor)
+        _indexes[cache_key] = (version, index)
+        return index
+
+
+def tfidf_search_products(text: str, limit: Optional[int] = None, conn=None) -> Optional[List[Tuple[int, float]]]:
+    """
+    Rank products by TF-IDF cosine similarity of their name, description and specs to a query.
+
+    Args:
+        text (str): The query, e.g. "noise cancelling sony headphones".
+        limit (int): Maximum number of results.
+        conn: SQLite database connection.
+
+    Returns:
+        Optional[List[Tuple[int, float]]]: (product ID, score) pairs, best first, or None if the
+        index is unavailable.
+    """
+    index = get_index(conn)
+    return index.search(text, limit) if index is not None else None
@@ -0,0 +1,115 @@
+"""
+@Time ： 2024-11-23
+@Auth ： Adam Lyu
+@Desc ： Thread-safe LRU cache bounded by memory size, with TTL and version-checked entries.
+"""
+import copy
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+_MISSING = object()
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Approximate the memory held by a cached value by the length of its JSON encoding.
+
+    Args:
+        value: A JSON-like value (dicts, lists, strings, numbers).
+
+    Returns:
+        int: Approximate size in bytes.
+    """
+    return len(json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+class LRUCache:
+    """
+    Least-recently-used cache limited by total entry size and entry age.
+
+    Every entry is stored with a version token; a lookup with a different token is a miss and
+    drops the entry, so callers can invalidate precisely by reading a version counter instead of
+    clearing the cache. Values are copied in and out, so callers may mutate what they get.
+    """
+
+    def __init__(self, max_bytes: int, ttl: Optional[float] = None):
+        """
+        Args:
+            max_bytes (int): Upper bound on the summed estimated size of all entries.
+            ttl (float): Seconds an entry stays valid; None for no expiry.
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key: Hashable, version: Hashable = None, default: Any = None) -> Any:
+        """
+        Return the value cached under `key` if it is fresh and was stored with `version`.
+
+        Args:
+            key: Cache key.
+            version: The current version token of the data the value was computed from.
+            default: Returned on a miss.
+
+        Returns:
+            The cached value or `default`.
+        """
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, entry_version, expires_at, _ = entry
+                if entry_version == version and (expires_at is None or expires_at > time.monotonic()):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return copy.deepcopy(value)
+                self._remove(key)
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any, version: Hashable = None):
+        """
+        Cache a value, evicting the least recently used entries to stay within `max_bytes`.
+        Values larger than the whole budget are not cached.
+
+        Args:
+            key: Cache key.
+            value: The value to cache.
+            version: Version token of the data the value was computed from.
+        """
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (copy.deepcopy(value), version, expires_at, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: `hits`, `misses`, `evictions`, `entries`, `bytes` and `max_bytes`.
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+    def _remove(self, key: Hashable):
+        self._bytes -= self._entries.pop(key)[3]
@@ -0,0 +1,142 @@
+"""
+@Time ： 2024-11-20
+@Auth ： Adam Lyu
+"""
+import os
+import sqlite3
+from contextlib import contextmanager
+from typing import Optional
+
+
+def database_key(conn) -> Optional[str]:
+    """
+    Identify the database file behind a connection, for keying process-wide caches.
+
+    In-memory and temporary databases are private to one connection, so they return None
+    and callers should bypass their caches.
+
+    Args:
+        conn: SQLite database connection.
+
+    Returns:
+        Optional[str]: The absolute path of the main database file, or None.
+    """
+    for _, name, path in conn.execute("PRAGMA database_list"):
+        if name == "main":
+            return os.path.abspath(path) if path else None
+    return None
+
+
+def get_catalog_version(cursor, scope: str) -> Optional[int]:
+    """
+    Read a catalog version counter maintained by the triggers in `scripts/initialize_db.py`.
+
+    Args:
+        cursor: SQLite cursor.
+        scope (str): The counter to read, e.g. "categories".
+
+    Returns:
+        Optional[int]: The current version, or None if the database has no such counter.
+    """
+    try:
+        cursor.execute("SELECT version FROM catalog_version WHERE scope = ?", (scope,))
+    except sqlite3.OperationalError:
+        # 旧数据库没有 catalog_version 表
+        return None
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def get_category_version(cursor, category: str) -> Optional[int]:
+    """
+    Read the version counter of one product category, maintained by the triggers in
+    `scripts/initialize_db.py`. It grows whenever a product of the category is inserted,
+    deleted or updated, or moves into or out of the category.
+
+    Args:
+        cursor: SQLite cursor.
+        category (str): The category.
+
+    Returns:
+        Optional[int]: The current version (0 for a category that never changed), or None if
+        the database has no category versions.
+    """
+    try:
+        cursor.execute("SELECT version FROM category_version WHERE category = ?", (category,))
+    except sqlite3.OperationalError:
+        # 旧数据库没有 category_version 表
+        return None
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+@contextmanager
+def immediate_transaction(conn):
+    """
+    Run a block in a `BEGIN IMMEDIATE` transaction, which takes the database write lock up front
+    so that reads inside the block cannot be invalidated by another writer before the block's own
+    writes. Commits when the block succeeds and rolls back when it raises.
+
+    If the connection is already in a transaction, the block runs in a savepoint of it instead and
+    the outer transaction keeps control of the commit.
+
+    Args:
+        conn: SQLite database connection.
+
+    Yields:
+        The connection's cursor.
+    """
+    cursor = conn.cursor()
+    nested = conn.in_transaction
+    cursor.execute("SAVEPOINT immediate_transaction" if nested else "BEGIN IMMEDIATE")
+    try:
+        yield cursor
+    except BaseException:
+        if nested:
+            cursor.execute("ROLLBACK TO immediate_transaction")
+            cursor.execute("RELEASE immediate_transaction")
+        else:
+            conn.rollback()
+        raise
+    cursor.execute("RELEASE immediate_transaction" if nested else "COMMIT")
+
+
+@contextmanager
+def write_transaction(conn):
+    """
+    Run a tool's writes in `immediate_transaction` and commit them when the block succeeds.
+
+    A transaction the caller left open on the connection (e.g. the implicit transaction Python's
+    sqlite3 starts at an INSERT) is committed together with the block, as the tools' former
+    `conn.commit()` did. On a group-commit writer connection the block stays a savepoint of the
+    batch and the writer commits it. If the block raises, only its own writes are rolled back.
+
+    Args:
+        conn: SQLite database connection.
+
+    Yields:
+        The connection's cursor.
+    """
+    with immediate_transaction(conn) as cursor:
+        yield cursor
+    if conn.in_transaction and getattr(conn, "after_commit", None) is None:
+        conn.commit()
+
+
+def run_after_commit(conn, callback):
+    """
+    Run a callback once the changes made on a connection are committed.
+
+    Connections of the group-commit writer (`utils/group_commit.py`) commit many calls in one
+    batch; on them the callback is held until the batch commits and dropped if it rolls back.
+    On any other connection the caller has already committed and the callback runs at once.
+
+    Args:
+        conn: SQLite database connection the changes were made on.
+        callback: Function without arguments.
+    """
+    hooks = getattr(conn, "after_commit", None)
+    if hooks is not None and conn.in_transaction:
+        hooks.append(callback)
+    else:
+        callback()
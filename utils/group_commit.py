@@ -0,0 +1,218 @@
+"""
+@Time ： 2024-11-29
+@Auth ： Adam Lyu
+@Desc ： Group-commit writer: one thread owns the write connection and commits writes in batches.
+
+SQLite allows one writer at a time, so sessions that each commit on their own connection queue
+on the write lock and pay one fsync per change. With DB_WRITER=group the cart and order tools hand
+their writes to a single writer thread instead. It runs the queued calls back to back in one
+`BEGIN IMMEDIATE` transaction, each inside its own savepoint so that a failing call only undoes
+itself, commits once per batch and then resolves every caller's future with its own result.
+
+Calls run on the writer's connection and must not commit or roll it back themselves: they use
+`immediate_transaction` or `write_transaction`, which become a savepoint inside the batch, and
+`run_after_commit` for work that has to wait for the commit (e.g. cache invalidation).
+"""
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+from utils.logger import logger
+
+# 写入方式："direct" 每个调用在自己的连接上提交；"group" 交给写线程批量提交
+DB_WRITER = os.getenv("DB_WRITER", "direct")
+# 每批最多的调用数，以及第一个调用入队后最多等待的秒数
+DB_WRITER_MAX_BATCH = int(os.getenv("DB_WRITER_MAX_BATCH", 64))
+DB_WRITER_MAX_DELAY = float(os.getenv("DB_WRITER_MAX_DELAY", 0.002))
+
+_STOP = object()
+
+
+class _WriterConnection(sqlite3.Connection):
+    """Writer connection that holds the callbacks to run after the current batch commits."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.after_commit: List[Callable] = []
+
+
+class GroupCommitWriter:
+    """
+    A queue of write calls served by one thread that commits them in batches.
+    """
+
+    def __init__(self, db_path: str, max_batch: int = 64, max_delay: float = 0.002):
+        """
+        Args:
+            db_path (str): SQLite database to write to.
+            max_batch (int): Most calls committed in one transaction.
+            max_delay (float): Seconds to wait for more calls after the first call of a batch.
+        """
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self.batches = 0
+        self.calls = 0
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        """
+        Queue a write call; it runs on the writer thread as `func(*args, conn=<writer connection>, **kwargs)`.
+
+        Returns:
+            Future: Resolves with the call's return value (or exception) once its batch is committed.
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The group-commit writer is closed.")
+            self._queue.put((future, func, args, kwargs))
+        return future
+
+    def call(self, func: Callable, *args, **kwargs):
+        """Submit a write call and wait for its committed result."""
+        return self.submit(func, *args, **kwargs).result()
+
+    # ---- 写线程 ----
+
+    def start(self):
+        """Start the writer thread."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="group-commit-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path, factory=_WriterConnection)
+        try:
+            stopping = False
+            while not stopping:
+                job = self._queue.get()
+                if job is _STOP:
+                    break
+                batch = [job]
+                # 收集第一个调用之后 max_delay 秒内到达的调用，最多 max_batch 个
+                deadline = time.monotonic() + self.max_delay
+                while len(batch) < self.max_batch:
+                    try:
+                        job = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                    if job is _STOP:
+                        stopping = True
+                        break
+                    batch.append(job)
+                try:
+                    self._commit_batch(conn, batch)
+                except Exception as e:
+                    # 写线程不能退出：未完成的调用收到异常，继续处理后续批次
+                    logger.error(f"Group-commit writer failed on a batch of {len(batch)} writes: {e}")
+                    for future, _, _, _ in batch:
+                        if not future.done():
+                            future.set_exception(e)
+        finally:
+            conn.close()
+
+    def _commit_batch(self, conn: _WriterConnection, batch: List[tuple]):
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for future, func, args, kwargs in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                # 每个调用一个保存点：失败只撤销该调用的修改
+                conn.execute("SAVEPOINT group_commit")
+                try:
+                    result = func(*args, conn=conn, **kwargs)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO group_commit")
+                    conn.execute("RELEASE group_commit")
+                    outcomes.append((future, None, e))
+                else:
+                    conn.execute("RELEASE group_commit")
+                    outcomes.append((future, result, None))
+            conn.commit()
+        except Exception as e:
+            # 开始或提交事务失败：整批回滚，所有调用都收到该异常
+            if conn.in_transaction:
+                conn.rollback()
+            conn.after_commit.clear()
+            logger.error(f"Group commit of {len(batch)} writes failed: {e}")
+            for future, _, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        hooks, conn.after_commit[:] = list(conn.after_commit), []
+        for hook in hooks:
+            try:
+                hook()
+            except Exception as e:
+                logger.error(f"After-commit callback failed: {e}")
+        self.batches += 1
+        self.calls += len(outcomes)
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def close(self):
+        """Commit the calls already queued and stop the writer thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+_writers: Dict[str, GroupCommitWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_group_writer(db_path: str, conn=None) -> Optional[GroupCommitWriter]:
+    """
+    Return the group-commit writer of a database, starting it on first use.
+
+    Args:
+        db_path (str): The database the caller would write to.
+        conn: The connection the caller was given; calls on an explicit connection write directly.
+    Returns:
+        GroupCommitWriter: The writer, or None when writes are committed by each caller.
+    """
+    if conn is not None or DB_WRITER != "group":
+        return None
+    key = os.path.abspath(db_path)
+    writer = _writers.get(key)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(key)
+            if writer is None:
+                writer = GroupCommitWriter(key, max_batch=DB_WRITER_MAX_BATCH, max_delay=DB_WRITER_MAX_DELAY)
+                writer.start()
+                _writers[key] = writer
+    return writer
+
+
+def close_group_writers():
+    """Commit the queued writes and stop every writer thread."""
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
+
+
+# 进程退出时提交队列中剩余的写入
+atexit.register(close_group_writers)
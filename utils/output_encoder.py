@@ -0,0 +1,140 @@
+"""
+@Time ： 2024-11-23
+@Auth ： Adam Lyu
+@Desc ： Compact encodings for tool outputs that are sent to the LLM.
+
+Two formats are supported:
+- "table": lists of records become a header line followed by one `|`-separated line per record,
+  so keys are written once instead of once per record; dicts become `key: value` lines.
+- "json": minified JSON (orjson when installed).
+Both formats truncate long text fields. The default format is set by TOOL_OUTPUT_FORMAT.
+"""
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+try:
+    import orjson
+except ImportError:  # orjson 是可选依赖，没有时使用标准库 json
+    orjson = None
+
+# 默认输出格式："table" 或 "json"
+TOOL_OUTPUT_FORMAT = os.getenv("TOOL_OUTPUT_FORMAT", "table")
+# 文本字段的最大长度，超出部分截断
+MAX_TEXT_LENGTH = int(os.getenv("TOOL_OUTPUT_MAX_TEXT", 200))
+TRUNCATION_MARK = "…"
+
+
+def truncate_text(value: Any, max_length: int = MAX_TEXT_LENGTH) -> Any:
+    """
+    Truncate every string longer than `max_length` inside a value.
+
+    Args:
+        value: A string, number, or nested dicts/lists of them.
+        max_length (int): Maximum string length; 0 disables truncation.
+
+    Returns:
+        The value with long strings cut and marked with an ellipsis.
+    """
+    if isinstance(value, str):
+        if max_length and len(value) > max_length:
+            return value[:max_length - len(TRUNCATION_MARK)] + TRUNCATION_MARK
+        return value
+    if isinstance(value, dict):
+        return {key: truncate_text(item, max_length) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [truncate_text(item, max_length) for item in value]
+    return value
+
+
+def encode_json(value: Any, max_length: int = MAX_TEXT_LENGTH) -> str:
+    """
+    Encode a value as minified JSON, keeping non-ASCII text readable.
+
+    Args:
+        value: JSON-serializable value.
+        max_length (int): Maximum string length; 0 disables truncation.
+
+    Returns:
+        str: The JSON text.
+    """
+    value = truncate_text(value, max_length)
+    if orjson is not None:
+        # 与标准库 json 一致：非字符串的键（如 int）转换为字符串
+        return orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _is_table(value: Any) -> bool:
+    return isinstance(value, list) and bool(value) and all(isinstance(item, dict) for item in value)
+
+
+def _format_cell(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return encode_json(value, 0)
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).replace("\\", "\\\\").replace("|", "\\|").replace("\n", "\\n")
+
+
+def encode_table(rows: List[Dict], max_length: int = MAX_TEXT_LENGTH) -> str:
+    """
+    Encode records as a header line followed by one `|`-separated line per record.
+
+    The header is the union of the records' keys in first-seen order. Missing values and None
+    are empty cells; nested values are minified JSON; `|`, `\\` and newlines are escaped.
+
+    Args:
+        rows (List[Dict]): The records.
+        max_length (int): Maximum string length; 0 disables truncation.
+
+    Returns:
+        str: The table text.
+    """
+    rows = truncate_text(rows, max_length)
+    columns: List[str] = []
+    for row in rows:
+        columns.extend(key for key in row if key not in columns)
+    lines = ["|".join(_format_cell(column) for column in columns)]
+    lines.extend("|".join(_format_cell(row.get(column)) for column in columns) for row in rows)
+    return "\n".join(lines)
+
+
+def encode_output(value: Any, output_format: Optional[str] = None, max_length: int = MAX_TEXT_LENGTH) -> str:
+    """
+    Encode a tool result for the LLM.
+
+    In "table" format a list of records becomes a table; a dict becomes one `key: value` line per
+    entry, with record lists as a `key:` line followed by their table and other nested values as
+    minified JSON. Strings are returned as they are.
+
+    Args:
+        value: The tool result.
+        output_format (str): "table" or "json"; defaults to TOOL_OUTPUT_FORMAT.
+        max_length (int): Maximum length of text fields; 0 disables truncation.
+
+    Returns:
+        str: The encoded result.
+    """
+    if isinstance(value, str):
+        return value
+    if (output_format or TOOL_OUTPUT_FORMAT) == "json":
+        return encode_json(value, max_length)
+
+    if _is_table(value):
+        return encode_table(value, max_length)
+    if not isinstance(value, dict):
+        return encode_json(value, max_length)
+
+    lines = []
+    for key, item in value.items():
+        if _is_table(item):
+            lines.append(f"{key}:")
+            lines.append(encode_table(item, max_length))
+        elif isinstance(item, (dict, list)):
+            lines.append(f"{key}: {encode_json(item, max_length)}")
+        else:
+            lines.append(f"{key}: {'null' if item is None else _format_cell(truncate_text(item, max_length))}")
+    return "\n".join(lines)